@@ -1,7 +1,41 @@
-import RPi.GPIO as GPIO
-import time
-import traceback
 import threading
+import queue
+
+from services import trace
+from services.log import get_logger
+
+logger = get_logger("audio")
+
+# RPi.GPIO is only available on the Pi, without it the buzzer stays silent
+try:
+    import RPi.GPIO as GPIO
+except (ImportError, RuntimeError):
+    GPIO = None
+
+# Sound profiles as (frequency, duration) tones, a frequency of 0 is a pause
+SOUND_PROFILES = {
+    "success": [
+        (880, 0.2),  # Higher pitch, shorter
+        (1047, 0.2),  # Even higher pitch
+    ],
+    "error": [(220, 0.3)],  # Lower pitch, shorter
+    "waiting": [(440, 0.1)],  # Medium pitch, very short
+    "alert": [
+        (880, 0.2),  # Higher pitch
+        (0, 0.05),  # Pause
+        (880, 0.2),  # Repeat
+    ],
+    "test": [(440, 0.05)],  # Medium pitch, extremely short
+}
+
+# Higher priority sounds cut off lower priority ones that are still playing
+SOUND_PRIORITIES = {
+    "test": 0,
+    "waiting": 1,
+    "success": 2,
+    "alert": 2,
+    "error": 3,
+}
 
 
 class AudioController:
@@ -10,7 +44,23 @@ class AudioController:
         self.buzzer = None
         self.lock = threading.Lock()  # For thread safety
 
+        # Profiles compiled once into timed PWM steps of (frequency, duty, duration)
+        self.sequences = {
+            name: self.compile_profile(profile)
+            for name, profile in SOUND_PROFILES.items()
+        }
+
+        # Command queue feeding the sequencer thread
+        self.commands = queue.Queue()
+        self.preempt = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.current_priority = -1
+
         try:
+            if GPIO is None:
+                raise RuntimeError("RPi.GPIO not available")
+
             # Set GPIO mode - this should be done once in the main controller
             # so we check if it's already set as an extra measure
             if GPIO.getmode() is None:
@@ -18,69 +68,133 @@ class AudioController:
 
             GPIO.setup(self.BUZZER_PIN, GPIO.OUT)
             self.buzzer = GPIO.PWM(self.BUZZER_PIN, 440)
-            print("Buzzer initialized successfully")
-
-            # Test the buzzer with shortened duration
-            self.play_sound("test")
+            logger.info("Buzzer initialized successfully")
 
         except Exception as e:
-            print(f"Buzzer initialization error: {e}")
-            traceback.print_exc()
+            logger.exception("Buzzer initialization error: %s", e)
             self.buzzer = None
 
+        threading.Thread(target=self._sequencer_loop, daemon=True).start()
+
+        # Test the buzzer with shortened duration
+        if self.buzzer is not None:
+            self.play_sound("test")
+
+    @staticmethod
+    def compile_profile(profile):
+        """Turn a profile of (frequency, duration) tones into PWM steps"""
+        return tuple(
+            (frequency, 50 if frequency else 0, duration)
+            for frequency, duration in profile
+        )
+
     def play_sound(self, sound_type):
-        """Thread-safe method to play different buzzer sounds based on the type"""
+        """Queue a buzzer sound and return immediately"""
+        logger.debug("Playing %s sound", sound_type)
+
+        if self.buzzer is None:
+            return
+
+        if sound_type not in self.sequences:
+            sound_type = "test"
+        priority = SOUND_PRIORITIES.get(sound_type, 0)
+
         with self.lock:
-            print(f"BUZZER: Playing {sound_type} sound")
+            self.idle.clear()
+            # Cut off a lower priority sound that is playing right now
+            if priority > self.current_priority >= 0:
+                self.preempt.set()
+            self.commands.put((priority, sound_type))
 
-            if self.buzzer is None:
-                return
+    def play_sound_async(self, sound_type):
+        """Play a sound in the background (play_sound no longer blocks)"""
+        self.play_sound(sound_type)
+
+    def stop_sound(self):
+        """Drop queued sounds and cut off the one that is playing"""
+        with self.lock:
+            while True:
+                try:
+                    self.commands.get_nowait()
+                except queue.Empty:
+                    break
+            if self.current_priority >= 0:
+                self.preempt.set()
+            else:
+                self.idle.set()
+
+    def wait_until_idle(self, timeout=None):
+        """Block until all queued sounds have finished playing"""
+        return self.idle.wait(timeout)
+
+    def _next_command(self):
+        """Take the next sound, dropping queued ones outranked by a later one"""
+        pending = [self.commands.get()]
+        with self.lock:
+            while True:
+                try:
+                    pending.append(self.commands.get_nowait())
+                except queue.Empty:
+                    break
+
+            # A sound followed by one of the same or higher priority is stale
+            # by now, the rest keep their order
+            kept = []
+            for command in pending:
+                while kept and command[0] >= kept[-1][0]:
+                    kept.pop()
+                kept.append(command)
+
+            for command in kept[1:]:
+                self.commands.put(command)
+        return kept[0]
+
+    def _sequencer_loop(self):
+        """Thread function that plays queued sounds step by step"""
+        while True:
+            priority, sound_type = self._next_command()
+
+            with self.lock:
+                self.current_priority = priority
+                self.preempt.clear()
 
             try:
-                # Sound profiles with optimized durations
-                profiles = {
-                    "success": [
-                        (880, 0.2),  # Higher pitch, shorter
-                        (1047, 0.2),  # Even higher pitch
-                    ],
-                    "error": [(220, 0.3)],  # Lower pitch, shorter
-                    "waiting": [(440, 0.1)],  # Medium pitch, very short
-                    "alert": [
-                        (880, 0.2),  # Higher pitch
-                        (0, 0.05),  # Pause
-                        (880, 0.2),  # Repeat
-                    ],
-                    "test": [(440, 0.05)],  # Medium pitch, extremely short
-                }
-
-                profile = profiles.get(sound_type, profiles["test"])
-
-                # Play the sound profile
-                for frequency, duration in profile:
-                    if frequency == 0:
-                        # Pause
-                        self.buzzer.stop()
-                        time.sleep(duration)
-                        self.buzzer.start(50)
-                    else:
-                        # Tone
-                        self.buzzer.start(50)
-                        self.buzzer.ChangeFrequency(frequency)
-                        time.sleep(duration)
+                self._play_sequence(self.sequences[sound_type])
+            except Exception as e:
+                logger.error("Error playing sound: %s", e)
 
+            # Try to stop the buzzer in case of error or preemption
+            try:
                 self.buzzer.stop()
+            except:
+                pass
 
-            except Exception as e:
-                print(f"Error playing sound: {e}")
+            with self.lock:
+                self.current_priority = -1
+                if self.commands.empty():
+                    self.idle.set()
 
-                # Try to stop the buzzer in case of error
-                try:
+    def _play_sequence(self, sequence):
+        """Play compiled PWM steps, returning early when preempted"""
+        playing = False
+        try:
+            for frequency, duty, duration in sequence:
+                if duty:
+                    if playing:
+                        trace.recorder.record(trace.TONE_STOP)
+                    self.buzzer.ChangeFrequency(frequency)
+                    if not playing:
+                        self.buzzer.start(duty)
+                        playing = True
+                    trace.recorder.record(trace.TONE_START, frequency)
+                elif playing:
+                    # Pause
                     self.buzzer.stop()
-                except:
-                    pass
+                    playing = False
+                    trace.recorder.record(trace.TONE_STOP)
 
-    def play_sound_async(self, sound_type):
-        """Play a sound in a background thread"""
-        threading.Thread(
-            target=self.play_sound, args=(sound_type,), daemon=True
-        ).start()
+                if self.preempt.wait(duration):
+                    return
+        finally:
+            if playing:
+                trace.recorder.record(trace.TONE_STOP)
@@ -0,0 +1,112 @@
+import threading
+
+from services.dispense_plan import DisplayStep, SoundStep, ServoStep, PauseStep
+
+
+class DispenseExecutor:
+    """Runs compiled dispense plans while keeping servo current within budget"""
+
+    def __init__(self, servo, display=None, audio=None, max_concurrent=1):
+        self.servo = servo
+        self.display = display
+        self.audio = audio
+        self.max_concurrent = max(1, int(max_concurrent))
+
+    @staticmethod
+    def concurrency_for_budget(budget_ma, servo_ma, servo_count=6):
+        """Number of servos that may run at once within a current budget"""
+        if not servo_ma or servo_ma <= 0:
+            return 1
+        return max(1, min(servo_count, int(budget_ma // servo_ma)))
+
+    def run(self, plan, on_dose=None):
+        """
+        Execute a plan and return (successful_doses, attempted_doses)
+
+        Each chamber program runs in its own thread, and a semaphore sized by
+        plan.max_concurrent is held only while a servo is moving, so pauses
+        between doses on one chamber let another chamber move. An emergency
+        stop on the servo controller ends pauses early and skips every
+        remaining step, including the finish steps.
+
+        on_dose(program, step, success, completed) is called after every servo
+        run, where completed counts the doses attempted so far across the plan.
+        """
+        budget = threading.Semaphore(plan.max_concurrent)
+        counts = {"successful": 0, "attempted": 0}
+        counts_lock = threading.Lock()
+
+        def run_program(program):
+            # Hold the chamber's first screen until it actually gets a slot
+            pending_display = None
+            shown = None
+            for step in program.steps:
+                if self.aborted():
+                    return
+                if isinstance(step, DisplayStep):
+                    pending_display = step
+                elif isinstance(step, ServoStep):
+                    with budget:
+                        if pending_display:
+                            shown = pending_display
+                            pending_display = None
+                            self._show(shown, counts["attempted"], plan.total_doses)
+                        success = self.servo.run_servo(
+                            step.chamber - 1, step.throttle, step.duration
+                        )
+                    with counts_lock:
+                        counts["attempted"] += 1
+                        counts["successful"] += 1 if success else 0
+                        completed = counts["attempted"]
+                    # Advance the progress bar on the chamber's screen
+                    if shown:
+                        self._show(shown, completed, plan.total_doses)
+                    if on_dose:
+                        on_dose(program, step, success, completed)
+                else:
+                    self._run_step(step)
+
+        if plan.max_concurrent == 1 or len(plan.programs) <= 1:
+            for program in plan.programs:
+                run_program(program)
+        else:
+            threads = [
+                threading.Thread(target=run_program, args=(program,), daemon=True)
+                for program in plan.programs
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if not self.aborted():
+            for step in plan.finish:
+                self._run_step(step)
+
+        return counts["successful"], counts["attempted"]
+
+    def _show(self, step, completed, total):
+        """Show a display step with the plan's progress bar"""
+        if self.display:
+            self.display.update_display(
+                step.title,
+                step.status,
+                step.details,
+                int(100 * completed / total) if total else None,
+            )
+
+    def _run_step(self, step):
+        """Run a display, sound or pause step"""
+        if isinstance(step, DisplayStep):
+            if self.display:
+                self.display.update_display(step.title, step.status, step.details)
+        elif isinstance(step, SoundStep):
+            if self.audio:
+                self.audio.play_sound(step.sound)
+        elif isinstance(step, PauseStep):
+            # Returns early on an emergency stop
+            self.servo.clock.wait(self.servo.abort_event, step.duration)
+
+    def aborted(self):
+        """True once the servo controller has been emergency stopped"""
+        return self.servo.abort_event.is_set()
@@ -1,20 +1,42 @@
-import board
-import adafruit_ssd1306
 from PIL import Image, ImageDraw, ImageFont
-import traceback
 import time
 import threading
 
+from controllers.text_layout import TextLayout
+from controllers.framebuffer_display import FramebufferDisplay
+from services import trace
+from services.log import get_logger
+
+# Blinka and the SSD1306 driver are only available on the device
+try:
+    import board
+    import adafruit_ssd1306
+except (ImportError, NotImplementedError):
+    board = None
+    adafruit_ssd1306 = None
+
+logger = get_logger("display")
+
 
 class DisplayController:
-    def __init__(self):
+    # Overflow handling for details text that does not fit in two lines
+    OVERFLOW_ELLIPSIS = "ellipsis"
+    OVERFLOW_PAGE = "page"
+
+    # Display backends, auto uses the SSD1306 and falls back to the framebuffer
+    BACKEND_AUTO = "auto"
+    BACKEND_SSD1306 = "ssd1306"
+    BACKEND_FRAMEBUFFER = "framebuffer"
+
+    def __init__(self, overflow=OVERFLOW_ELLIPSIS, backend=BACKEND_AUTO):
         self.display = None
         self.font = None
+        self.layout = None
+        self.overflow = overflow
         self.lock = threading.Lock()  # Added thread safety
 
         try:
-            i2c = board.I2C()
-            self.display = adafruit_ssd1306.SSD1306_I2C(128, 64, i2c, addr=0x3D)
+            self.display = self.create_backend(backend)
 
             # Load fonts
             try:
@@ -22,20 +44,41 @@ class DisplayController:
                     "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 10
                 )
             except:
-                print("Using default font")
+                logger.info("Using default font")
                 self.font = ImageFont.load_default()
 
+            # Precompute glyph advances once for the loaded font
+            self.layout = TextLayout(self.font)
+
         except Exception as e:
-            print(f"Display initialization error: {e}")
-            traceback.print_exc()
+            logger.exception("Display initialization error: %s", e)
             self.display = None
 
-    def update_display(self, title, status, details="", progress=None):
+    @staticmethod
+    def create_backend(backend):
+        """Create the SSD1306 driver, or an in-memory framebuffer when headless"""
+        if backend != DisplayController.BACKEND_FRAMEBUFFER:
+            try:
+                if board is None:
+                    raise RuntimeError("SSD1306 libraries not available")
+                i2c = board.I2C()
+                return adafruit_ssd1306.SSD1306_I2C(128, 64, i2c, addr=0x3D)
+            except Exception as e:
+                if backend == DisplayController.BACKEND_SSD1306:
+                    raise
+                logger.warning(
+                    "SSD1306 not available (%s), using framebuffer display", e
+                )
+
+        return FramebufferDisplay(128, 64)
+
+    def update_display(self, title, status, details="", progress=None, page=0):
         """Update the OLED display with the given information"""
         # Thread-safe update
         with self.lock:
-            # print message for debug
-            print(f"DISPLAY: {title} - {status} - {details} - Progress: {progress}%")
+            logger.debug(
+                "%s - %s - %s - Progress: %s%%", title, status, details, progress
+            )
 
             if self.display is None:
                 return
@@ -45,17 +88,22 @@ class DisplayController:
                 self.display.fill(0)
 
                 # Create blank image for drawing
-                image = self.create_display_image(title, status, details, progress)
+                image = self.create_display_image(
+                    title, status, details, progress, page
+                )
 
                 # Display image
+                start = time.perf_counter_ns()
                 self.display.image(image)
                 self.display.show()
+                trace.recorder.record(
+                    trace.DISPLAY_PUSH, (time.perf_counter_ns() - start) // 1000
+                )
 
             except Exception as e:
-                print(f"Error updating display: {e}")
-                traceback.print_exc()
+                logger.exception("Error updating display: %s", e)
 
-    def create_display_image(self, title, status, details="", progress=None):
+    def create_display_image(self, title, status, details="", progress=None, page=0):
         """Create a display image without updating the display"""
         # Create blank image for drawing
         image = Image.new("1", (128, 64))
@@ -65,59 +113,71 @@ class DisplayController:
         draw.rectangle((0, 0, 127, 63), outline=1)
 
         # Draw title at top
-        draw.text((5, 5), title, font=self.font, fill=1)
+        draw.text((5, 5), self.fit_line(title), font=self.font, fill=1)
 
         # Draw horizontal line
         draw.line((0, 18, 127, 18), fill=1)
 
         # Draw status text
-        draw.text((5, 22), status, font=self.font, fill=1)
+        draw.text((5, 22), self.fit_line(status), font=self.font, fill=1)
 
         # Draw details in smaller font
         if details:
             # Optimize text wrapping for details
-            self.draw_wrapped_text(draw, details, 5, 36)
+            self.draw_wrapped_text(
+                draw, details, 5, 36, max_lines=self.details_lines(progress), page=page
+            )
 
-        # Draw progress bar if provided (and not None)
-        if progress is not None and 0 <= progress <= 100:
+        # Draw progress bar below a single details line, percentage to its right
+        if self.shows_progress(progress):
+            progress = int(progress)
             # Progress bar outline
-            draw.rectangle((10, 50, 118, 58), outline=1, fill=0)
+            draw.rectangle((5, 50, 90, 58), outline=1, fill=0)
             # Progress bar fill
-            width = int((108 * progress) / 100)
-            draw.rectangle((11, 51, 11 + width, 57), outline=0, fill=1)
+            width = int((84 * progress) / 100)
+            if width:
+                draw.rectangle((6, 51, 5 + width, 57), outline=0, fill=1)
             # Progress text
-            draw.text((50, 50), f"{progress}%", font=self.font, fill=1)
+            draw.text((95, 48), f"{progress}%", font=self.font, fill=1)
 
         return image
 
-    def draw_wrapped_text(self, draw, text, x, y, max_width=118, line_height=10):
-        """Draw text with word wrapping"""
-        # Calculate how many characters fit on a line
-        if len(text) <= 21:  # Short text, no need to wrap
+    def fit_line(self, text, max_width=118):
+        """Truncate a single line of text with an ellipsis if it is too wide"""
+        if self.layout is None:
+            return text
+        return self.layout.truncate(text, max_width)
+
+    @staticmethod
+    def shows_progress(progress):
+        """True if a progress value is drawn as a progress bar"""
+        return progress is not None and 0 <= progress <= 100
+
+    def details_lines(self, progress=None):
+        """Lines available for details, the progress bar takes the second one"""
+        return 1 if self.shows_progress(progress) else 2
+
+    def details_page_count(self, details, progress=None, max_width=118):
+        """Number of pages needed to show the details text in paging mode"""
+        if self.layout is None or not details or self.overflow != self.OVERFLOW_PAGE:
+            return 1
+        return len(self.layout.pages(details, max_width, self.details_lines(progress)))
+
+    def draw_wrapped_text(
+        self, draw, text, x, y, max_width=118, line_height=10, max_lines=2, page=0
+    ):
+        """Draw text with word wrapping, truncating or paging any overflow"""
+        if self.layout is None:
             draw.text((x, y), text, font=self.font, fill=1)
             return
 
-        # Split text into words
-        words = text.split()
-        lines = []
-        current_line = []
-        current_width = 0
-
-        for word in words:
-            word_width = self.font.getlength(word + " ")
-            if current_width + word_width <= max_width:
-                current_line.append(word)
-                current_width += word_width
-            else:
-                lines.append(" ".join(current_line))
-                current_line = [word]
-                current_width = word_width
-
-        if current_line:
-            lines.append(" ".join(current_line))
-
-        # Draw up to 2 lines
-        for i, line in enumerate(lines[:2]):
+        if self.overflow == self.OVERFLOW_PAGE:
+            pages = self.layout.pages(text, max_width, max_lines)
+            lines = pages[page % len(pages)]
+        else:
+            lines = self.layout.fit(text, max_width, max_lines)
+
+        for i, line in enumerate(lines):
             draw.text((x, y + i * line_height), line, font=self.font, fill=1)
 
     def clear(self):
@@ -128,4 +188,4 @@ class DisplayController:
                     self.display.fill(0)
                     self.display.show()
                 except Exception as e:
-                    print(f"Error clearing display: {e}")
+                    logger.error("Error clearing display: %s", e)
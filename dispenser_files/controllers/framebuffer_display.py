@@ -0,0 +1,101 @@
+import time
+import threading
+from collections import deque
+
+from PIL import Image
+
+
+class FramebufferDisplay:
+    """In-memory stand-in for the SSD1306 that captures every pushed frame"""
+
+    def __init__(self, width=128, height=64, max_frames=64):
+        self.width = width
+        self.height = height
+        self.lock = threading.Lock()  # For thread safety
+        self.buffer = Image.new("1", (width, height))
+
+        # Most recent frames pushed with show(), as (timestamp, image)
+        self.frames = deque(maxlen=max_frames)
+
+        # Frame timing statistics
+        self.push_count = 0
+        self.first_push = None
+        self.last_push = None
+        self.total_push_time = 0.0
+        self.max_push_time = 0.0
+
+    def fill(self, color):
+        """Fill the buffer with a single color (SSD1306 compatible)"""
+        with self.lock:
+            self.buffer = Image.new("1", (self.width, self.height), 1 if color else 0)
+
+    def image(self, image):
+        """Copy an image into the buffer (SSD1306 compatible)"""
+        if image.mode != "1" or image.size != (self.width, self.height):
+            raise ValueError(
+                f"Image must be mode '1' and {self.width}x{self.height} pixels"
+            )
+        with self.lock:
+            self.buffer = image.copy()
+
+    def show(self):
+        """Capture the buffer as a pushed frame (SSD1306 compatible)"""
+        start = time.perf_counter()
+        with self.lock:
+            now = time.time()
+            self.frames.append((now, self.buffer.copy()))
+
+            if self.first_push is None:
+                self.first_push = now
+            self.last_push = now
+            self.push_count += 1
+
+            push_time = time.perf_counter() - start
+            self.total_push_time += push_time
+            self.max_push_time = max(self.max_push_time, push_time)
+
+    def last_frame(self):
+        """Return the most recently pushed frame, or None"""
+        with self.lock:
+            return self.frames[-1][1] if self.frames else None
+
+    def stats(self):
+        """Frame count, push rate and push timing since the first frame"""
+        with self.lock:
+            elapsed = self.last_push - self.first_push if self.push_count > 1 else 0.0
+            return {
+                "frames": self.push_count,
+                "elapsed": elapsed,
+                "fps": (self.push_count - 1) / elapsed if elapsed > 0 else 0.0,
+                "avg_push_ms": (
+                    self.total_push_time / self.push_count * 1000
+                    if self.push_count
+                    else 0.0
+                ),
+                "max_push_ms": self.max_push_time * 1000,
+            }
+
+    def reset_stats(self):
+        """Forget captured frames and timing statistics"""
+        with self.lock:
+            self.frames.clear()
+            self.push_count = 0
+            self.first_push = None
+            self.last_push = None
+            self.total_push_time = 0.0
+            self.max_push_time = 0.0
+
+    def dump_png(self, path, index=-1):
+        """Save a captured frame as PNG"""
+        self._dump(path, index, "PNG")
+
+    def dump_pbm(self, path, index=-1):
+        """Save a captured frame as binary PBM"""
+        self._dump(path, index, "PPM")
+
+    def _dump(self, path, index, file_format):
+        with self.lock:
+            if not self.frames:
+                raise ValueError("No frames have been pushed")
+            frame = self.frames[index][1]
+        frame.save(path, format=file_format)
@@ -1,284 +1,493 @@
 #!/usr/bin/env python3
-import RPi.GPIO as GPIO
 import sys
-import traceback
 import time
-import threading
+import queue
 
 from controllers.display_controller import DisplayController
+from controllers.throttled_display import ThrottledDisplay
+from controllers.screen_manager import ScreenManager
 from controllers.audio_controller import AudioController
 from controllers.rfid_controller import RfidController
-from controllers.servo_controller import ServoController
+from controllers.servo_controller import ServoController, DEFAULT_BOARD_ADDRESS
+from controllers.dispense_executor import DispenseExecutor
+from controllers.servo_calibration import CalibrationStore, find_shortest_duration
+from controllers.hardware_self_test import HardwareSelfTest
+from services.event_bus import EventBus
+from services.clock import SystemClock
+from services.tag_index import TagIndex
+from services.dispense_plan import PlanError, compile_plan
+from services import trace
+from services.log import get_logger
+
+logger = get_logger("hardware")
+
+# RPi.GPIO is only available on the Pi, without it pin setup is skipped
+try:
+    import RPi.GPIO as GPIO
+except (ImportError, RuntimeError):
+    GPIO = None
 
 # Debug mode for extra output
 DEBUG = True
 
 
 class HardwareController:
-    def __init__(self):
-        print("\n===== Initializing MediPi Hardware Controller =====")
+    def __init__(
+        self, config=None, events=None, tags=None, calibration=None, clock=None
+    ):
+        logger.info("Initializing MediPi hardware controller")
+
+        # Optional configuration manager, read through setting()
+        self.config = config
+
+        # Event bus shared with the dispenser service (tag events)
+        self.events = events or EventBus()
+
+        # Authorized patient and admin tags
+        self.tags = tags or TagIndex()
+
+        # Per-chamber servo throttle, run time, pause and direction
+        self.calibration = calibration or CalibrationStore()
+
+        # Source of timestamps, timeouts and servo run times
+        self.clock = clock or SystemClock()
 
         # Use lazy initialization for hardware components
         self._display = None
         self._audio = None
         self._rfid = None
         self._servo = None
+        self._dispenser = None
+
+        # Milliseconds each component took to initialize, for the self-test
+        self.init_ms = {}
 
         try:
             # Set up GPIO mode
-            GPIO.setmode(GPIO.BCM)
+            if GPIO is not None:
+                GPIO.setmode(GPIO.BCM)
 
             # Initialize display first for feedback
             self.display.update_display(
                 "MediPi", "Initializing", "Starting hardware...", 0
             )
 
-            print("\n===== MediPi Hardware Controller Initialized =====")
+            logger.info("MediPi hardware controller initialized")
             self.display.update_display("MediPi", "Starting up", "System ready", 100)
 
         except Exception as e:
-            print(f"Error initializing hardware controller: {e}")
-            traceback.print_exc()
+            logger.critical(
+                "Error initializing hardware controller: %s", e, exc_info=True
+            )
             sys.exit(1)
 
+    def setting(self, section, key, default=None):
+        """Read a configuration value, falling back to a default"""
+        if self.config is None:
+            return default
+        value = self.config.get(section, key)
+        return default if value is None else value
+
+    @staticmethod
+    def elapsed_ms(start):
+        return round((time.perf_counter() - start) * 1000, 1)
+
     # Property-based lazy initialization
     @property
     def display(self):
         if self._display is None:
-            print("\n--- Initializing Display ---")
-            self._display = DisplayController()
+            logger.info("Initializing display")
+            start = time.perf_counter()
+            # All display updates go through a single render thread
+            renderer = ThrottledDisplay(
+                DisplayController(
+                    self.setting(
+                        "hardware",
+                        "display_overflow",
+                        DisplayController.OVERFLOW_ELLIPSIS,
+                    ),
+                    self.setting(
+                        "hardware", "display_backend", DisplayController.BACKEND_AUTO
+                    ),
+                ),
+                self.setting("hardware", "display_update_interval", 0.1),
+            )
+            self._display = ScreenManager(renderer)
+            self.init_ms["display"] = self.elapsed_ms(start)
         return self._display
 
     @property
     def audio(self):
         if self._audio is None:
-            print("\n--- Initializing Audio ---")
+            logger.info("Initializing audio")
+            start = time.perf_counter()
             self._audio = AudioController()
+            self.init_ms["audio"] = self.elapsed_ms(start)
         return self._audio
 
     @property
     def rfid(self):
         if self._rfid is None:
-            print("\n--- Initializing RFID ---")
-            self._rfid = RfidController()
+            logger.info("Initializing RFID")
+            start = time.perf_counter()
+            self._rfid = RfidController(
+                self.events,
+                self.setting("hardware", "rfid_poll_interval", 0.1),
+                self.setting("hardware", "rfid_idle_poll_interval", 1.0),
+                self.setting("hardware", "rfid_debounce", 2.0),
+                self.setting("hardware", "rfid_irq_pin"),
+                self.clock,
+            )
+            self.init_ms["rfid"] = self.elapsed_ms(start)
         return self._rfid
 
     @property
     def servo(self):
         if self._servo is None:
-            print("\n--- Initializing Servo Controller ---")
-            self._servo = ServoController()
+            logger.info("Initializing servo controller")
+            start = time.perf_counter()
+            self._servo = ServoController(
+                self.setting("hardware", "servo_count", 6),
+                self.setting("hardware", "servo_boards", [DEFAULT_BOARD_ADDRESS]),
+                self.clock,
+            )
+            self.init_ms["servo"] = self.elapsed_ms(start)
         return self._servo
 
+    @property
+    def dispenser(self):
+        if self._dispenser is None:
+            # Servos allowed to run at once within the servo supply budget
+            max_concurrent = DispenseExecutor.concurrency_for_budget(
+                self.setting("hardware", "servo_power_budget_ma", 0),
+                self.setting("hardware", "servo_current_ma", 0),
+                self.servo.servo_count,
+            )
+            logger.info("Dispensing up to %d chambers at once", max_concurrent)
+            self._dispenser = DispenseExecutor(
+                self.servo, self.display, self.audio, max_concurrent
+            )
+        return self._dispenser
+
+    def plan_dispense(self, schedule):
+        """Compile a schedule into a dispense plan, raising PlanError if invalid"""
+        return compile_plan(
+            schedule,
+            self.calibration,
+            self.servo.servo_count,
+            self.dispenser.max_concurrent,
+        )
+
+    def abort_dispense(self):
+        """Stop every servo now and abort the dispense or calibration in progress"""
+        latency = self.servo.emergency_stop()
+        # Wakes a pending authentication wait
+        self.events.publish("dispense_aborted", {"stop_latency_ms": latency})
+        self.display.show_overlay(
+            "ABORTED",
+            "Dispensing stopped",
+            "",
+            duration=3,
+            priority=ThrottledDisplay.PRIORITY_HIGH,
+        )
+        self.audio.play_sound("error")
+        return latency
+
+    def aborted_result(self, schedule, successful_doses, total_doses):
+        """Dispense result for a schedule stopped by abort_dispense"""
+        logger.warning(
+            "Dispensing aborted after %d/%d doses", successful_doses, total_doses
+        )
+        return {
+            "schedule_id": schedule.id,
+            "timestamp": self.clock.time(),
+            "status": "ERROR",
+            "error": "Dispensing aborted",
+            "dispensed_count": successful_doses,
+            "total_count": total_doses,
+            "servo_stop": self.servo.stop_stats(),
+        }
+
+    def self_test(self, component="all", samples=10):
+        """Check and time the hardware components, returns a report dict"""
+        self.display.update_display(
+            "SELF TEST", f"Testing {component}", "Please wait...", 0
+        )
+        report = HardwareSelfTest(self, samples).run(component)
+        self.display.show_overlay(
+            "SELF TEST",
+            report["status"],
+            ", ".join(
+                name
+                for name, result in report["components"].items()
+                if not result["ok"]
+            )
+            or "All components OK",
+            duration=3,
+        )
+        return report
+
+    def calibrate_chamber(self, chamber, verify, **search):
+        """
+        Find and store the shortest reliable run time for a chamber
+
+        verify is called after every trial run and returns True if a dose
+        dropped, False if not, or None to abort the calibration
+        """
+        settings = self.calibration.get(chamber)
+        throttle = settings["throttle"] * settings["direction"]
+        self.servo.clear_abort()
+
+        self.display.update_display("CALIBRATING", f"Chamber {chamber}", "Watch tray")
+        duration = find_shortest_duration(
+            lambda d: self.servo.run_servo(chamber - 1, throttle, d), verify, **search
+        )
+        self.display.update_display(
+            "CALIBRATION",
+            f"Chamber {chamber}",
+            f"Run time: {duration:.2f}s" if duration else "No reliable setting",
+        )
+
+        if duration:
+            self.calibration.set(chamber, {"duration": duration})
+        return duration
+
     def cleanup(self):
         """Release hardware resources"""
-        print("Cleaning up hardware resources...")
+        logger.info("Cleaning up hardware resources")
 
         # Only clean up components that were actually initialized
         if self._display:
             self._display.clear()
+            self._display.stop()
 
         if self._servo:
             self._servo.stop_all_servos()
 
-        try:
-            GPIO.cleanup()
-            print("GPIO cleaned up")
-        except Exception as e:
-            print(f"Error cleaning up GPIO: {e}")
+        if self._rfid:
+            self._rfid.stop()
+
+        if self._audio:
+            self._audio.stop_sound()
+            self._audio.wait_until_idle(1)
+
+        if GPIO is not None:
+            try:
+                GPIO.cleanup()
+                logger.debug("GPIO cleaned up")
+            except Exception as e:
+                logger.error("Error cleaning up GPIO: %s", e)
 
-        print("Hardware resources released")
+        logger.info("Hardware resources released")
 
-    def wait_for_rfid_auth(self, expected_tag, timeout=900, patient_name="Patient"):
+    def wait_for_rfid_auth(self, schedule, timeout=900, patient_name="Patient"):
         """
         Wait for RFID authentication with timeout (default: 15 minutes = 900 seconds)
-        Returns True if authorized, False otherwise
+        Returns TagIndex.PATIENT or TagIndex.ADMIN if authorized, None otherwise
 
-        Uses non-blocking approach with a callback to avoid blocking the main thread
+        Tags arrive as "tag_detected" events from the RFID reader service
         """
-        print(f"Waiting for RFID authentication. Expected tag: {expected_tag}")
+        logger.info("Waiting for RFID authentication for schedule %s", schedule.id)
         self.display.update_display(
-            "AUTH NEEDED", f"Hello {patient_name}", "Scan your tag"
+            "AUTH NEEDED",
+            f"Hello {patient_name}",
+            "Scan your tag",
+            priority=ThrottledDisplay.PRIORITY_HIGH,
         )
         self.audio.play_sound("waiting")
 
-        # Create event for thread synchronization
-        auth_event = threading.Event()
-        auth_result = {"authorized": False}
-
-        def auth_worker():
-            # Track elapsed time
-            start_time = time.time()
-
-            # Wait for tag within timeout period
-            while time.time() - start_time < timeout and not auth_event.is_set():
-                # Check for tag with non-blocking read
-                tag_data = self.rfid.read_tag()
-
-                # If tag found, process it
-                if tag_data:
-                    tag_id, tag_text = tag_data
-                    print(f"Tag detected: ID={tag_id}, Text={tag_text}")
-
-                    # Check if this is the correct tag
-                    if str(tag_id) == str(expected_tag) or (
-                        expected_tag and expected_tag in tag_text
-                    ):
-                        self.display.update_display(
-                            "AUTHORIZED", "Tag Accepted", "Preparing..."
-                        )
-                        self.audio.play_sound("success")
-                        time.sleep(1)
-                        auth_result["authorized"] = True
-                        auth_event.set()
-                        return
-                    else:
-                        self.display.update_display(
-                            "UNAUTHORIZED", "Wrong Tag", "Try again"
-                        )
-                        self.audio.play_sound("error")
-                        time.sleep(2)
-                        # Reset the display to show scan instruction again
-                        self.display.update_display(
-                            "AUTH NEEDED", f"Hello {patient_name}", "Scan your tag"
-                        )
-
-                # Sleep briefly to avoid CPU spinning
-                time.sleep(0.2)
+        # Tags detected while waiting, handed over by the reader service, and
+        # None if the dispense is aborted
+        tags = queue.Queue()
+        unsubscribe = self.events.subscribe("tag_detected", tags.put)
+        unsubscribe_abort = self.events.subscribe(
+            "dispense_aborted", lambda data: tags.put(None)
+        )
+        deadline = self.clock.time() + timeout
 
-            # Timeout occurred after specified period
-            if not auth_event.is_set():
-                print(
-                    f"Authentication timeout: No valid tag scanned within {timeout} seconds"
-                )
-                self.display.update_display(
-                    "TIMEOUT", "No tag scanned", "Try again later"
-                )
-                self.audio.play_sound("error")
-                time.sleep(2)
-                auth_event.set()
+        try:
+            with self.rfid.active():
+                while True:
+                    remaining = deadline - self.clock.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        tag = self.clock.get(tags, remaining)
+                    except queue.Empty:
+                        break
+
+                    if tag is None:
+                        logger.info("Authentication aborted")
+                        return None
+
+                    # Check the tag against the patient and admin tag index
+                    role = self.tags.authorize(tag["id"], tag["text"], schedule)
+                    logger.info(
+                        "Tag detected: %s, role=%s", self.tags.mask(tag["id"]), role
+                    )
 
-        # Start the authentication thread
-        auth_thread = threading.Thread(target=auth_worker)
-        auth_thread.daemon = True
-        auth_thread.start()
+                    if role:
+                        self.display.show_overlay(
+                            "AUTHORIZED",
+                            (
+                                "Admin Override"
+                                if role == TagIndex.ADMIN
+                                else "Tag Accepted"
+                            ),
+                            "Preparing...",
+                            duration=1,
+                        )
+                        self.audio.play_sound("success")
+                        return role
 
-        # Wait for the authentication to complete or timeout
-        auth_event.wait()
-        return auth_result["authorized"]
+                    # Overlay reverts to the scan instruction on its own
+                    self.display.show_overlay(
+                        "UNAUTHORIZED", "Wrong Tag", "Try again", duration=2
+                    )
+                    self.audio.play_sound("error")
+        finally:
+            unsubscribe()
+            unsubscribe_abort()
+
+        # Timeout occurred after specified period
+        logger.warning(
+            "Authentication timeout: No valid tag scanned within %s seconds", timeout
+        )
+        self.display.show_overlay(
+            "TIMEOUT", "No tag scanned", "Try again later", duration=2
+        )
+        self.audio.play_sound("error")
+        return None
 
     def dispense_scheduled_medication(self, schedule, authorized=False):
         """Process a medication schedule and dispense if authorized"""
         try:
-            print(f"Processing schedule: {schedule}")
+            logger.info("Processing schedule: %s", schedule.id)
 
-            patient_name = schedule.get("patientName", "Patient")
-            scheduled_time = schedule.get("time", "Unknown time")
-            chamber_assignments = schedule.get("chambers", [])
-            rfid_tag = schedule.get("rfidTag", "")
+            # Re-arm the servos after an earlier abort
+            self.servo.clear_abort()
+
+            patient_name = schedule.patient_name
+            scheduled_time = schedule.time
+
+            # Validate the whole schedule before alerting or moving anything
+            try:
+                plan = self.plan_dispense(schedule)
+            except PlanError as e:
+                logger.error("Invalid schedule %s: %s", schedule.id, e)
+                self.display.show_overlay(
+                    "ERROR", "Invalid schedule", str(e), duration=2
+                )
+                self.audio.play_sound("error")
+                return {
+                    "schedule_id": schedule.id,
+                    "timestamp": self.clock.time(),
+                    "status": "ERROR",
+                    "error": str(e),
+                }
+            logger.info(
+                "Plan: %d doses from %d chambers, predicted %.1fs",
+                plan.total_doses,
+                len(plan.programs),
+                plan.predicted_duration,
+            )
 
             # Show scheduled medication info
             self.display.update_display(
                 "MEDICATION DUE", f"{patient_name}", f"Time: {scheduled_time}:00"
             )
 
-            # Sound medication alert
+            # Sound medication alert, the sequencer plays it in the background
             self.audio.play_sound("alert")
-            time.sleep(1)  # Give time for alert to finish
 
             # If not pre-authorized, wait for RFID authentication
             if not authorized:
-                print(f"Waiting for patient authentication with RFID tag: {rfid_tag}")
+                trace.recorder.record(trace.AUTH_START)
                 authorized = self.wait_for_rfid_auth(
-                    rfid_tag, timeout=900, patient_name=patient_name
+                    schedule,
+                    timeout=self.setting("schedules", "auth_timeout", 900),
+                    patient_name=patient_name,
                 )
+                trace.recorder.record(trace.AUTH_END, 1 if authorized else 0)
 
             # If authorized, dispense medications
             if authorized:
-                print("Authentication successful, dispensing medication")
-
-                # Dispense from each chamber
-                total_chambers = len(chamber_assignments)
-                total_doses = 0
-                successful_doses = 0
-
-                for idx, assignment in enumerate(chamber_assignments):
-                    # Extract chamber and medication info
-                    if isinstance(assignment, dict):
-                        chamber_num = assignment.get("chamber", 0)
-
-                        # Get medication info
-                        medication = assignment.get("medication", {})
-                        med_name = medication.get("name", "Unknown Medication")
-                        med_unit = medication.get("dosageUnit", "unit")
-
-                        # Get dosage amount
-                        doses = assignment.get("dosageAmount", 1)
-
-                        print(f"Processing chamber {chamber_num}: {med_name} x{doses}")
-                    else:
-                        print(f"Invalid chamber assignment: {assignment}")
-                        continue
-
-                    self.display.update_display(
-                        f"DISPENSING            {idx+1}/{total_chambers}",
-                        f"Name: {med_name}",
-                        f"Doses: {doses} {med_unit}{'s' if doses > 1 and med_unit != 'mg' and med_unit != 'ml' else ''}",
+                logger.info("Authentication successful, dispensing medication")
+
+                def on_dose(program, step, success, completed):
+                    logger.info(
+                        "Dispensed dose %d/%d from chamber %d: %s",
+                        step.dose,
+                        step.doses,
+                        step.chamber,
+                        "ok" if success else "failed",
+                    )
+                    # Live progress for the dashboard
+                    self.events.publish(
+                        "dispense_progress",
+                        {
+                            "scheduleId": plan.schedule_id,
+                            "chamber": step.chamber,
+                            "dose": step.dose,
+                            "doses": step.doses,
+                            "success": success,
+                            "completed": completed,
+                            "total": plan.total_doses,
+                        },
                     )
 
-                    # Process each dose
-                    for dose in range(1, doses + 1):
-                        print(
-                            f"Dispensing dose {dose}/{doses} from chamber {chamber_num}"
-                        )
-                        total_doses += 1
-
-                        # Run servo at 0.3 throttle for 1.1 seconds (it was the most optimal for the current servos)
-                        success = self.servo.run_servo(chamber_num - 1, 0.3, 1.1)
-
-                        if success:
-                            successful_doses += 1
+                # Run chambers concurrently, as many at once as the power budget allows
+                started = self.clock.monotonic()
+                trace.recorder.record(trace.DISPENSE_START, plan.total_doses)
+                successful_doses, total_doses = self.dispenser.run(plan, on_dose)
+                trace.recorder.record(trace.DISPENSE_END, successful_doses)
+                logger.info(
+                    "Dispensing took %.1fs (predicted %.1fs)",
+                    self.clock.monotonic() - started,
+                    plan.predicted_duration,
+                )
 
-                        # Pause between doses
-                        if dose < doses:
-                            time.sleep(1.0)
+                if self.dispenser.aborted():
+                    return self.aborted_result(schedule, successful_doses, total_doses)
 
-                # Update display wth completion message
-                self.display.update_display(
+                # Show completion message, the caller's next screen appears after it
+                self.display.show_overlay(
                     "COMPLETE",
                     f"Dispensed: {successful_doses}/{total_doses}",
                     "Thank you!",
+                    duration=2,
                 )
-                self.audio.play_sound("success")
-                time.sleep(2)
 
                 return {
-                    "schedule_id": schedule.get("id", "unknown"),
-                    "timestamp": time.time(),
+                    "schedule_id": schedule.id,
+                    "timestamp": self.clock.time(),
                     "status": ("COMPLETED"),
                     "dispensed_count": successful_doses,
                     "total_count": total_doses,
+                    "authorized_by": (
+                        authorized if isinstance(authorized, str) else "COMMAND"
+                    ),
                 }
+            elif self.dispenser.aborted():
+                return self.aborted_result(schedule, 0, 0)
             else:
                 # Authentication failed or timed out
-                print("Authentication failed or timed out")
+                logger.warning("Authentication failed or timed out")
                 return {
-                    "schedule_id": schedule.get("id", "unknown"),
-                    "timestamp": time.time(),
+                    "schedule_id": schedule.id,
+                    "timestamp": self.clock.time(),
                     "status": "MISSED",
                     "reason": "Authentication failed",
                 }
 
         except Exception as e:
-            print(f"Error dispensing medication: {e}")
-            traceback.print_exc()
-            self.display.update_display("ERROR", "Dispensing failed", str(e))
+            logger.exception("Error dispensing medication: %s", e)
+            self.display.show_overlay("ERROR", "Dispensing failed", str(e), duration=2)
             self.audio.play_sound("error")
-            time.sleep(2)
 
             return {
-                "schedule_id": schedule.get("id", "unknown") if schedule else "unknown",
-                "timestamp": time.time(),
+                "schedule_id": schedule.id if schedule else "unknown",
+                "timestamp": self.clock.time(),
                 "status": "ERROR",
                 "error": str(e),
             }
@@ -0,0 +1,178 @@
+import time
+
+from controllers.audio_controller import SOUND_PROFILES
+from services.log import get_logger
+
+logger = get_logger("self_test")
+
+# Components in the order they are tested
+COMPONENTS = ("display", "audio", "rfid", "servo")
+
+# Timed samples per bus operation at most, a test holds the hardware locks
+MAX_SAMPLES = 100
+
+# MFRC522 VersionReg, genuine chips and common clones report one of these
+MFRC522_VERSION_REG = 0x37
+MFRC522_VERSIONS = (0x88, 0x90, 0x91, 0x92, 0xB2)
+
+
+def timings(samples):
+    """Summary of a list of durations in seconds, reported in ms"""
+    return {
+        "avg_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+
+def timed(func, count):
+    """Call func count times, returning the duration of each call"""
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class HardwareSelfTest:
+    """Checks each hardware component and times its bus operations"""
+
+    def __init__(self, hardware, samples=10):
+        self.hardware = hardware
+        self.samples = max(1, min(int(samples), MAX_SAMPLES))
+
+    def run(self, component="all"):
+        """Test one component or all of them and return a structured report"""
+        names = COMPONENTS if component in (None, "all") else (component,)
+        start = time.perf_counter()
+
+        results = {}
+        for name in names:
+            test = getattr(self, f"test_{name}", None)
+            if test is None:
+                results[name] = {"ok": False, "error": "Unknown component"}
+                continue
+            try:
+                results[name] = test()
+            except Exception as e:
+                logger.exception("Self-test of %s failed: %s", name, e)
+                results[name] = {"ok": False, "error": str(e)}
+            results[name]["init_ms"] = self.hardware.init_ms.get(name)
+
+        return {
+            "type": "HARDWARE_TEST",
+            "status": (
+                "PASSED" if all(r["ok"] for r in results.values()) else "FAILED"
+            ),
+            "components": results,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+
+    def test_display(self):
+        """Render and push test frames straight to the OLED"""
+        controller = self.hardware.display.renderer.display
+        backend = controller.display
+        if backend is None:
+            return {"ok": False, "error": "Display not initialized"}
+
+        image = controller.create_display_image(
+            "SELF TEST", "Display", "Frame push timing", 50
+        )
+        render = timed(
+            lambda: controller.create_display_image(
+                "SELF TEST", "Display", "Frame push timing", 50
+            ),
+            self.samples,
+        )
+
+        def push():
+            backend.image(image)
+            backend.show()
+
+        # Every push is a full frame over I2C, the SSD1306 has no readback
+        with controller.lock:
+            pushes = timed(push, self.samples)
+
+        return {
+            "ok": True,
+            "backend": type(backend).__name__,
+            "render": timings(render),
+            "frame_push": timings(pushes),
+        }
+
+    def test_audio(self):
+        """Play the test tone and compare its length with the profile"""
+        audio = self.hardware.audio
+        if audio.buzzer is None:
+            return {"ok": False, "error": "Buzzer not initialized"}
+
+        expected = sum(duration for _, duration in SOUND_PROFILES["test"])
+        audio.wait_until_idle(2)
+        start = time.perf_counter()
+        audio.play_sound("test")
+        finished = audio.wait_until_idle(expected + 1)
+        played = time.perf_counter() - start
+
+        return {
+            "ok": finished,
+            "tone_ms": round(played * 1000, 1),
+            "expected_ms": round(expected * 1000, 1),
+            "overrun_ms": round((played - expected) * 1000, 1),
+        }
+
+    def test_rfid(self):
+        """Read the MFRC522 version register over SPI"""
+        rfid = self.hardware.rfid
+        if rfid.reader is None:
+            return {"ok": False, "error": "RFID reader not initialized"}
+
+        chip = rfid.reader.READER
+        with rfid.lock:  # Keep the reader thread off the bus meanwhile
+            version = chip.Read_MFRC522(MFRC522_VERSION_REG)
+            reads = timed(lambda: chip.Read_MFRC522(MFRC522_VERSION_REG), self.samples)
+
+        return {
+            "ok": version in MFRC522_VERSIONS,
+            "version": hex(version),
+            "spi_round_trip": timings(reads),
+        }
+
+    def test_servo(self):
+        """Time register reads and the writes that start and stop a servo"""
+        servo = self.hardware.servo
+        if not servo.servos_initialized:
+            return {"ok": False, "error": "Servo controller not initialized"}
+
+        boards = []
+        for board, pca in enumerate(servo.pcas):
+            with servo.lock:
+                reads = timed(lambda: pca.mode1_reg, self.samples)
+            boards.append(
+                {"address": hex(servo.board_addresses[board]), **timings(reads)}
+            )
+
+        # Neutral throttle is the same register write that starts a servo,
+        # without moving it, and zero duty is the write that stops it
+        starts, stops = [], []
+        for servo_num in range(servo.servo_count):
+            board, channel = servo.channel_for(servo_num)
+            kit, pca = servo.kits[board], servo.pcas[board]
+            with servo.channel_locks[servo_num], servo.lock:
+                start = time.perf_counter()
+                kit.continuous_servo[channel].throttle = 0
+                starts.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                pca.channels[channel].duty_cycle = 0
+                stops.append(time.perf_counter() - start)
+
+        stop_all = timed(servo.stop_all_servos, 1)
+
+        return {
+            "ok": True,
+            "servos": servo.servo_count,
+            "i2c_round_trip": boards,
+            "start": timings(starts),
+            "stop": timings(stops),
+            "stop_all_ms": round(stop_all[0] * 1000, 3),
+        }
@@ -1,83 +1,207 @@
-from mfrc522 import SimpleMFRC522
-import traceback
 import time
 import threading
+from contextlib import contextmanager
+
+from services.event_bus import EventBus
+from services.clock import SystemClock
+from services import trace
+from services.log import get_logger
+
+logger = get_logger("rfid")
+
+# The reader libraries are only available on the Pi, without them no tags are read
+try:
+    from mfrc522 import SimpleMFRC522
+    import RPi.GPIO as GPIO
+except (ImportError, RuntimeError):
+    SimpleMFRC522 = None
+    GPIO = None
+
 
 class RfidController:
-    def __init__(self):
+    def __init__(
+        self,
+        events=None,
+        poll_interval=0.1,
+        idle_poll_interval=1.0,
+        debounce=2.0,
+        irq_pin=None,
+        clock=None,
+    ):
         # Initialize RFID reader
         self.reader = None
         self.lock = threading.Lock()  # For thread safety
-        
+
+        # Tag events are published as "tag_detected" on this bus
+        self.events = events or EventBus()
+
+        # Debounce and read timeouts follow this clock, polling stays on wall time
+        self.clock = clock or SystemClock()
+
+        # Poll fast while someone waits for a tag, slowly otherwise (0 pauses)
+        self.poll_interval = poll_interval
+        self.idle_poll_interval = idle_poll_interval
+        self.debounce = debounce
+        self.active_count = 0
+
+        # Last tag seen, used to debounce a card resting on the reader
+        self.last_tag_id = None
+        self.last_seen = 0
+
+        # Pending read_tag_async requests as (deadline, callback)
+        self.async_requests = []
+
+        self.wake = threading.Event()
+        self.running = True
+
         try:
+            if SimpleMFRC522 is None:
+                raise RuntimeError("mfrc522 not available")
             self.reader = SimpleMFRC522()
-            print("RFID reader initialized successfully")
+            logger.info("RFID reader initialized successfully")
         except Exception as e:
-            print(f"RFID initialization error: {e}")
-            traceback.print_exc()
+            logger.exception("RFID initialization error: %s", e)
+
+        # Wake the reader loop early on the IRQ line when it is wired
+        if irq_pin is not None and self.reader is not None:
+            try:
+                GPIO.setup(irq_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+                GPIO.add_event_detect(
+                    irq_pin, GPIO.FALLING, callback=lambda channel: self.wake.set()
+                )
+            except Exception as e:
+                logger.error("RFID IRQ setup error: %s", e)
+
+        self.thread = threading.Thread(target=self._reader_loop, daemon=True)
+        self.thread.start()
+
+    def acquire(self):
+        """Request the fast poll rate until release() is called"""
+        with self.lock:
+            self.active_count += 1
+        self.wake.set()
+
+    def release(self):
+        """Drop a fast poll rate request"""
+        with self.lock:
+            self.active_count = max(0, self.active_count - 1)
+
+    @contextmanager
+    def active(self):
+        """Poll at the fast rate while the block is running"""
+        self.acquire()
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def stop(self):
+        """Stop the reader service"""
+        self.running = False
+        self.wake.set()
+        self.thread.join(1)
+
+    def _reader_loop(self):
+        """Thread function that owns the reader and publishes tag events"""
+        while self.running:
+            try:
+                tag_data = self._poll()
+                if tag_data:
+                    self._handle_tag(*tag_data)
+                self._expire_async_requests()
+            except Exception as e:
+                logger.error("Error in RFID reader loop: %s", e)
+
+            if self.active_count or self.async_requests:
+                interval = self.poll_interval
+            else:
+                interval = self.idle_poll_interval or None
+            self.wake.wait(interval)
+            self.wake.clear()
+
+    def _poll(self):
+        """Single non-blocking read, returns (tag_id, tag_text) or None"""
+        with self.lock:
+            if self.reader is None:
+                return None
+            start = time.perf_counter_ns()
+            try:
+                tag_id, tag_text = self.reader.read_no_block()
+            except Exception as e:
+                if "Timeout" not in str(e):
+                    logger.error("Error reading RFID: %s", e)
+                return None
+            finally:
+                trace.recorder.record(
+                    trace.RFID_POLL, (time.perf_counter_ns() - start) // 1000
+                )
+
+        if tag_id is None:
+            return None
+        return tag_id, (tag_text or "").strip()
+
+    def _handle_tag(self, tag_id, tag_text):
+        """Debounce repeat reads and publish new tags"""
+        now = self.clock.time()
+        repeat = tag_id == self.last_tag_id and now - self.last_seen < self.debounce
+        self.last_tag_id = tag_id
+        self.last_seen = now
+        if repeat:
+            return
+
+        tag = {"id": tag_id, "text": tag_text, "timestamp": now}
+
+        with self.lock:
+            requests, self.async_requests = self.async_requests, []
+        for _, callback in requests:
+            callback((tag_id, tag_text))
+
+        self.events.publish("tag_detected", tag)
+
+    def _expire_async_requests(self):
+        """Call back pending async reads whose timeout has passed"""
+        if not self.async_requests:
+            return
+        now = self.clock.time()
+        with self.lock:
+            expired = [r for r in self.async_requests if r[0] <= now]
+            self.async_requests = [r for r in self.async_requests if r[0] > now]
+        for _, callback in expired:
+            callback(None)
 
     def read_tag(self, block=True, timeout=0.5):
         """
         Read an RFID tag
-        
+
         Args:
             block: If True, block until tag is read or timeout. If False, return immediately if no tag.
             timeout: Maximum time to wait for tag in seconds (only used if block=True)
-            
+
         Returns:
             Tuple of (tag_id, tag_text) if successful, None otherwise
         """
-        with self.lock:
-            print("RFID: Checking for tag")
-            
-            if self.reader is None:
-                print("RFID reader not available")
-                return None
-            
-            try:
-                if block:
-                    # Blocking read with timeout
-                    start_time = time.time()
-                    while time.time() - start_time < timeout:
-                        try:
-                            # Try to read with a small timeout
-                            return self.reader.read()
-                        except Exception as e:
-                            if "Timeout" in str(e):
-                                # This is expected if no tag is present
-                                time.sleep(0.1)  # Small sleep to avoid CPU spinning
-                                continue
-                            else:
-                                # Other errors should be reported
-                                print(f"Error reading RFID: {e}")
-                                return None
-                    
-                    # Timeout reached
-                    return None
-                else:
-                    # Non-blocking read
-                    try:
-                        # Attempt a quick read
-                        return self.reader.read_no_block()
-                    except Exception as e:
-                        if "Timeout" not in str(e):
-                            print(f"Error reading RFID: {e}")
-                        return None
-                    
-            except Exception as e:
-                print(f"Error reading RFID: {e}")
-                return None
-    
+        if not block:
+            return self._poll()
+
+        result = {}
+        done = threading.Event()
+
+        def on_tag(tag_data):
+            result["tag"] = tag_data
+            done.set()
+
+        self.read_tag_async(on_tag, timeout)
+        self.clock.wait(done, timeout + self.poll_interval)
+        return result.get("tag")
+
     def read_tag_async(self, callback, timeout=30):
         """
         Read a tag asynchronously and call the callback when done
-        
+
         Args:
             callback: Function to call with result (tag_id, tag_text) or None
             timeout: Maximum time to wait for tag in seconds
         """
-        def read_worker():
-            result = self.read_tag(block=True, timeout=timeout)
-            callback(result)
-        
-        threading.Thread(target=read_worker, daemon=True).start()
\ No newline at end of file
+        with self.lock:
+            self.async_requests.append((self.clock.time() + timeout, callback))
+        self.wake.set()
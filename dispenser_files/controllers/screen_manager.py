@@ -0,0 +1,113 @@
+import time
+import threading
+
+from controllers.throttled_display import ThrottledDisplay
+
+
+class ScreenManager:
+    """Base screen plus a stack of timed overlays drawn through the render thread"""
+
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.condition = threading.Condition()
+
+        # Screen shown when no overlay is active, as (frame, priority)
+        self.base = None
+
+        # Overlay stack, newest last, as (expires_at, frame, priority)
+        self.overlays = []
+        self.running = True
+
+        self.thread = threading.Thread(target=self._expiry_loop, daemon=True)
+        self.thread.start()
+
+    def update_display(
+        self,
+        title,
+        status,
+        details="",
+        progress=None,
+        priority=ThrottledDisplay.PRIORITY_NORMAL,
+    ):
+        """Set the base screen, drawn now or once all overlays have expired"""
+        frame = (title, status, details, progress)
+        with self.condition:
+            self.base = (frame, priority)
+            if not self.overlays:
+                self.renderer.update_display(*frame, priority=priority)
+        return True
+
+    def show_overlay(
+        self,
+        title,
+        status,
+        details="",
+        duration=2.0,
+        progress=None,
+        priority=ThrottledDisplay.PRIORITY_HIGH,
+    ):
+        """Show a screen for duration seconds, then revert to what was below it"""
+        frame = (title, status, details, progress)
+        with self.condition:
+            self.overlays.append((time.time() + duration, frame, priority))
+            self.renderer.update_display(*frame, priority=priority)
+            self.condition.notify()
+        return True
+
+    def dismiss_overlays(self):
+        """Drop all overlays and return to the base screen immediately"""
+        with self.condition:
+            if self.overlays:
+                self.overlays = []
+                self._draw_top()
+            self.condition.notify()
+
+    def clear(self):
+        """Drop all screens and clear the display"""
+        with self.condition:
+            self.base = None
+            self.overlays = []
+            self.renderer.clear()
+
+    def flush(self, timeout=2.0):
+        """Wait until the render thread has pushed all pending frames"""
+        return self.renderer.flush(timeout)
+
+    def stop(self, timeout=2.0):
+        """Stop the overlay timer and the render thread"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
+        self.renderer.stop(timeout)
+
+    def _draw_top(self):
+        """Draw the newest live overlay, or the base screen (lock must be held)"""
+        if self.overlays:
+            _, frame, priority = self.overlays[-1]
+        elif self.base is not None:
+            frame, priority = self.base
+        else:
+            return
+        self.renderer.update_display(*frame, priority=priority)
+
+    def _expiry_loop(self):
+        """Thread function that reverts overlays when their time is up"""
+        with self.condition:
+            while self.running:
+                if not self.overlays:
+                    self.condition.wait()
+                    continue
+
+                now = time.time()
+                next_expiry = min(expires_at for expires_at, _, _ in self.overlays)
+                if next_expiry > now:
+                    self.condition.wait(next_expiry - now)
+                    continue
+
+                top = self.overlays[-1]
+                self.overlays = [o for o in self.overlays if o[0] > now]
+
+                # Only redraw when the overlay on screen actually went away
+                if not self.overlays or self.overlays[-1] is not top:
+                    self._draw_top()
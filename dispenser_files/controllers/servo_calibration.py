@@ -0,0 +1,147 @@
+import os
+import json
+import threading
+
+from services.log import get_logger
+
+logger = get_logger("calibration")
+
+# Settings used for chambers that have not been calibrated, these were the
+# most reliable values for the original servo batch
+DEFAULT_CALIBRATION = {
+    "throttle": 0.3,  # 0 to 1, sign comes from direction
+    "duration": 1.1,  # seconds the servo runs per dose
+    "pause": 1.0,  # seconds between doses from the same chamber
+    "direction": 1,  # 1 or -1 depending on how the servo is mounted
+}
+
+# Allowed range for each calibration value
+CALIBRATION_LIMITS = {
+    "throttle": (0.05, 1.0),
+    "duration": (0.05, 5.0),
+    "pause": (0.0, 5.0),
+}
+
+
+class CalibrationStore:
+    """Persisted per-chamber servo calibration table"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()  # For thread safety
+        self.chambers = {}  # chamber number -> calibration dict
+        self.load()
+
+    def get(self, chamber):
+        """Calibration for a chamber, falling back to the defaults"""
+        with self.lock:
+            return {**DEFAULT_CALIBRATION, **self.chambers.get(int(chamber), {})}
+
+    def table(self):
+        """Calibration of every calibrated chamber, keyed by chamber number"""
+        with self.lock:
+            return {
+                str(chamber): {**DEFAULT_CALIBRATION, **values}
+                for chamber, values in sorted(self.chambers.items())
+            }
+
+    @staticmethod
+    def validate(values):
+        """Return a cleaned copy of calibration values, raising ValueError if invalid"""
+        cleaned = {}
+        for key, value in values.items():
+            if key == "direction":
+                if int(value) not in (1, -1):
+                    raise ValueError("direction must be 1 or -1")
+                cleaned[key] = int(value)
+            elif key in CALIBRATION_LIMITS:
+                low, high = CALIBRATION_LIMITS[key]
+                value = float(value)
+                if not low <= value <= high:
+                    raise ValueError(f"{key} must be between {low} and {high}")
+                cleaned[key] = value
+        return cleaned
+
+    def set(self, chamber, values):
+        """Update a chamber's calibration and persist the table"""
+        cleaned = self.validate(values)
+        with self.lock:
+            self.chambers.setdefault(int(chamber), {}).update(cleaned)
+        self.save()
+        return self.get(chamber)
+
+    def reset(self, chamber):
+        """Return a chamber to the default calibration"""
+        with self.lock:
+            self.chambers.pop(int(chamber), None)
+        self.save()
+
+    def load(self):
+        """Load the calibration table from disk"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.chambers = {
+                int(chamber): self.validate(values) for chamber, values in data.items()
+            }
+        except Exception as e:
+            logger.error("Error loading servo calibration: %s", e)
+
+    def save(self):
+        """Persist the calibration table"""
+        if not self.path:
+            return False
+        try:
+            with self.lock:
+                data = {str(c): v for c, v in sorted(self.chambers.items())}
+            with open(self.path, "w") as f:
+                json.dump(data, f)
+            return True
+        except Exception as e:
+            logger.error("Error saving servo calibration: %s", e)
+            return False
+
+
+def find_shortest_duration(
+    run, verify, min_duration=0.3, max_duration=2.0, resolution=0.05, trials=2
+):
+    """
+    Binary search for the shortest servo run that reliably dispenses one dose
+
+    Args:
+        run: Function that runs the servo for a given duration
+        verify: Function returning True if a dose dropped, False if not, None to abort
+        min_duration / max_duration: Search range in seconds
+        resolution: Stop once the range is narrower than this
+        trials: Consecutive successful drops needed to call a duration reliable
+
+    Returns:
+        Shortest reliable duration, or None if even max_duration failed or aborted
+    """
+
+    def reliable(duration):
+        for _ in range(trials):
+            run(duration)
+            result = verify(duration)
+            if result is None:
+                raise InterruptedError("Calibration aborted")
+            if not result:
+                return False
+        return True
+
+    try:
+        if not reliable(max_duration):
+            return None
+
+        low, high = min_duration, max_duration
+        while high - low > resolution:
+            middle = round((low + high) / 2, 3)
+            if reliable(middle):
+                high = middle
+            else:
+                low = middle
+        return high
+    except InterruptedError:
+        return None
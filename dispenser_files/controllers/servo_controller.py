@@ -1,106 +1,219 @@
-from adafruit_servokit import ServoKit
 import atexit
 import time
-import traceback
 import threading
 
+from services.clock import SystemClock
+from services import trace
+from services.log import get_logger
+
+logger = get_logger("servo")
+
+# ServoKit is only available on the device, without it servo runs are simulated
+try:
+    from adafruit_servokit import ServoKit
+except (ImportError, NotImplementedError):
+    ServoKit = None
+
+# PCA9685 registers used for bulk writes
+MODE1 = 0x00
+MODE1_AUTO_INCREMENT = 0x20
+LED0_ON_L = 0x06  # Each channel has 4 registers: ON_L, ON_H, OFF_L, OFF_H
+ALL_LED_OFF_H = 0xFD
+LED_FULL_OFF = 0x10  # OFF_H bit that holds the output low
+
+
+# Each PCA9685 board drives 16 channels
+CHANNELS_PER_BOARD = 16
+DEFAULT_BOARD_ADDRESS = 0x40
+
+
 class ServoController:
-    def __init__(self):
+    def __init__(
+        self, servo_count=6, board_addresses=(DEFAULT_BOARD_ADDRESS,), clock=None
+    ):
         self.servos_initialized = False
-        self.kit = None
-        self.pca = None  # Direct reference to PCA9685
-        self.lock = threading.Lock()  # For thread safety
+        self.kits = []  # One ServoKit per PCA9685 board
+        self.pcas = []  # Direct references to each PCA9685
+        self.lock = threading.Lock()  # Serializes PCA9685 bus access
+
+        # Run durations follow this clock, a VirtualClock makes them instant
+        self.clock = clock or SystemClock()
+
+        # Chambers are numbered across boards, board N holds 16 channels
+        self.board_addresses = list(board_addresses)
+        self.servo_count = min(
+            int(servo_count), CHANNELS_PER_BOARD * len(self.board_addresses)
+        )
+        if self.servo_count < servo_count:
+            logger.warning(
+                "Only %d servos fit on %d board(s), ignoring the rest",
+                self.servo_count,
+                len(self.board_addresses),
+            )
+
+        # One lock per channel so different chambers can run at the same time
+        self.channel_locks = [threading.Lock() for _ in range(self.servo_count)]
+
+        # Set by emergency_stop, interrupts runs and refuses new ones until cleared
+        self.abort_event = threading.Event()
+
+        # Emergency stop latency, from request until every channel is zeroed
+        self.stop_count = 0
+        self.last_stop_ms = 0.0
+        self.max_stop_ms = 0.0
 
         try:
+            if ServoKit is None:
+                raise RuntimeError("adafruit_servokit not available")
+
             # Initialize the servo controller
-            print("Initializing servo controller...")
-            self.kit = ServoKit(channels=16)
-            
-            # Get direct access to PCA9685 for safety controls
-            self.pca = self.kit._pca
-            
-            # Set all servos to stop (throttle 0)
-            print("Stopping all servos initially...")
-            for i in range(6):
-                # For continuous servos, 0 throttle means stop
-                self.kit.continuous_servo[i].throttle = 0
-                # For extra safety, force the PWM to zero
-                self.pca.channels[i].duty_cycle = 0
-                time.sleep(0.1)
+            logger.info("Initializing servo controller")
+            for board, address in enumerate(self.board_addresses):
+                kit = ServoKit(channels=CHANNELS_PER_BOARD, address=address)
+                # Get direct access to PCA9685 for safety controls
+                pca = kit._pca
+                self.kits.append(kit)
+                self.pcas.append(pca)
+
+                # Block writes rely on register auto-increment
+                pca.mode1_reg = pca.mode1_reg | MODE1_AUTO_INCREMENT
+
+                # Set all servos to stop, zero PWM on every used channel at once
+                used = self.channels_on_board(board)
+                if used:
+                    self.write_registers(pca, LED0_ON_L, bytes(4 * used))
 
             self.servos_initialized = True
-            print("Servo controller initialized successfully")
+            logger.info(
+                "Servo controller initialized with %d servos on %d board(s)",
+                self.servo_count,
+                len(self.pcas),
+            )
 
             # Register cleanup function
             atexit.register(self.stop_all_servos)
 
         except Exception as e:
-            print(f"Servo initialization error: {e}")
-            traceback.print_exc()
+            logger.exception("Servo initialization error: %s", e)
+
+    def channels_on_board(self, board):
+        """Number of servo channels in use on a board"""
+        return max(
+            0, min(CHANNELS_PER_BOARD, self.servo_count - board * CHANNELS_PER_BOARD)
+        )
+
+    def channel_for(self, servo_num):
+        """Board index and channel that drive a servo"""
+        return divmod(servo_num, CHANNELS_PER_BOARD)
 
     def run_servo(self, servo_num, throttle, duration_seconds):
         """Run a servo at specified throttle for a duration, then stop it safely"""
-        with self.lock:  # Thread safety
-            if not self.servos_initialized or self.kit is None:
-                print(f"SERVO: Running servo {servo_num} at {throttle} (simulated)")
-                time.sleep(duration_seconds)
-                return True
-                
+        # Validate servo number
+        if servo_num < 0 or servo_num >= self.servo_count:
+            logger.error("Invalid servo number: %s", servo_num)
+            return False
+
+        with self.channel_locks[servo_num]:  # One run per channel at a time
+            if self.abort_event.is_set():
+                logger.info("Servo %d not started, motion aborted", servo_num)
+                return False
+
+            if not self.servos_initialized:
+                logger.debug("Running servo %d at %s (simulated)", servo_num, throttle)
+                trace.recorder.record(trace.SERVO_START, servo_num)
+                aborted = self.clock.wait(self.abort_event, duration_seconds)
+                trace.recorder.record(trace.SERVO_STOP, servo_num)
+                return not aborted
+
+            board, channel = self.channel_for(servo_num)
+            kit, pca = self.kits[board], self.pcas[board]
             try:
-                # Validate servo number
-                if servo_num < 0 or servo_num >= 6:
-                    print(f"Invalid servo number: {servo_num}")
-                    return False
-                    
                 # Set throttle (ensure it's between -1 and 1)
                 throttle = max(-1, min(1, throttle))
-                self.kit.continuous_servo[servo_num].throttle = throttle
-                print(f"Servo {servo_num} running at {throttle} throttle")
-                
-                # Run for specified duration
-                time.sleep(duration_seconds)
-                
+                with self.lock:
+                    kit.continuous_servo[channel].throttle = throttle
+                trace.recorder.record(trace.SERVO_START, servo_num)
+                logger.debug("Servo %d running at %s throttle", servo_num, throttle)
+
+                # Run for specified duration, an emergency stop ends the wait early
+                aborted = self.clock.wait(self.abort_event, duration_seconds)
+
                 # Stop servo
-                self.kit.continuous_servo[servo_num].throttle = 0
-                self.pca.channels[servo_num].duty_cycle = 0  # Extra safety
-                print(f"Servo {servo_num} stopped")
-                
-                return True
+                with self.lock:
+                    kit.continuous_servo[channel].throttle = 0
+                    pca.channels[channel].duty_cycle = 0  # Extra safety
+                trace.recorder.record(trace.SERVO_STOP, servo_num)
+                logger.debug(
+                    "Servo %d %s", servo_num, "aborted" if aborted else "stopped"
+                )
+
+                return not aborted
             except Exception as e:
-                print(f"Error running servo {servo_num}: {e}")
-                traceback.print_exc()
-                
+                logger.exception("Error running servo %d: %s", servo_num, e)
+
                 # Emergency stop
                 try:
-                    self.kit.continuous_servo[servo_num].throttle = 0
-                    self.pca.channels[servo_num].duty_cycle = 0
+                    kit.continuous_servo[channel].throttle = 0
+                    pca.channels[channel].duty_cycle = 0
                 except:
                     pass
-                    
+
                 return False
 
     def stop_all_servos(self):
-        """Thread-safe method to stop all servos"""
-        with self.lock:
-            if not self.servos_initialized or self.kit is None:
-                return
+        """
+        Stop all servos
 
-            print("Stopping all servos...")
+        Does not wait for self.lock, so a stop is never queued behind a run;
+        the I2C bus itself serializes the register writes.
+        """
+        if not self.servos_initialized:
+            return
 
+        logger.debug("Stopping all servos")
+
+        for board, pca in enumerate(self.pcas):
             try:
-                for i in range(6):
-                    # Stop at throttle level
-                    self.kit.continuous_servo[i].throttle = 0
-                    # For extra safety, force the PWM to zero
-                    self.pca.channels[i].duty_cycle = 0
-                    print(f"Servo {i} stopped")
-                print("All servos stopped")
+                # One write per board holds every output low, the next run clears it
+                self.write_registers(pca, ALL_LED_OFF_H, bytes([LED_FULL_OFF]))
             except Exception as e:
-                print(f"Error stopping servos: {e}")
-                
+                logger.error("Error stopping servos on board %d: %s", board, e)
+
                 # Final emergency stop attempt
                 try:
-                    for i in range(6):
-                        self.pca.channels[i].duty_cycle = 0
+                    for i in range(self.channels_on_board(board)):
+                        pca.channels[i].duty_cycle = 0
                 except:
-                    pass
\ No newline at end of file
+                    pass
+        logger.debug("All servos stopped")
+
+    @staticmethod
+    def write_registers(pca, register, data):
+        """Write consecutive PCA9685 registers in one I2C transaction"""
+        with pca.i2c_device as i2c:
+            i2c.write(bytes([register]) + data)
+
+    def emergency_stop(self):
+        """Abort running servos and zero every channel, returns stop latency in ms"""
+        start = time.perf_counter()
+        self.abort_event.set()
+        self.stop_all_servos()
+        latency = (time.perf_counter() - start) * 1000
+
+        self.stop_count += 1
+        self.last_stop_ms = latency
+        self.max_stop_ms = max(self.max_stop_ms, latency)
+        logger.warning("Emergency stop took %.1f ms", latency)
+        return latency
+
+    def clear_abort(self):
+        """Allow servo runs again after an emergency stop"""
+        self.abort_event.clear()
+
+    def stop_stats(self):
+        """Emergency stop latency metrics"""
+        return {
+            "stops": self.stop_count,
+            "last_stop_ms": round(self.last_stop_ms, 2),
+            "max_stop_ms": round(self.max_stop_ms, 2),
+        }
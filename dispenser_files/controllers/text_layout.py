@@ -0,0 +1,151 @@
+import threading
+from collections import OrderedDict
+
+
+class TextLayout:
+    """Glyph-width text layout for the OLED with cached line breaking"""
+
+    ELLIPSIS = "..."
+
+    def __init__(self, font, cache_size=128):
+        self.font = font
+        self.cache_size = cache_size
+        self.lock = threading.Lock()  # For thread safety
+        self._cache = OrderedDict()
+
+        # Precompute advances for printable ASCII, other glyphs are added on first use
+        self.advances = {chr(c): self.font.getlength(chr(c)) for c in range(32, 127)}
+        self.ellipsis_width = self.measure(self.ELLIPSIS)
+
+    def glyph_width(self, char):
+        """Return the advance width of a single glyph"""
+        width = self.advances.get(char)
+        if width is None:
+            width = self.font.getlength(char)
+            self.advances[char] = width
+        return width
+
+    def measure(self, text):
+        """Return the pixel width of a string using the advance table"""
+        advances = self.advances
+        width = 0
+        for char in text:
+            char_width = advances.get(char)
+            if char_width is None:
+                char_width = self.glyph_width(char)
+            width += char_width
+        return width
+
+    def wrap(self, text, max_width):
+        """Break text into lines no wider than max_width (cached per string)"""
+        key = ("wrap", text, max_width)
+        lines = self._cache_get(key)
+        if lines is None:
+            lines = tuple(self._wrap(text, max_width))
+            self._cache_put(key, lines)
+        return lines
+
+    def fit(self, text, max_width, max_lines=1):
+        """Wrap text into at most max_lines, truncating the last line with an ellipsis"""
+        key = ("fit", text, max_width, max_lines)
+        lines = self._cache_get(key)
+        if lines is None:
+            lines = self.wrap(text, max_width)
+            if len(lines) > max_lines:
+                kept = list(lines[:max_lines])
+                # Carry the overflow onto the last line so the ellipsis cuts mid-text
+                overflow = " ".join(lines[max_lines - 1 :])
+                kept[-1] = self.truncate(overflow, max_width, force_ellipsis=True)
+                lines = tuple(kept)
+            self._cache_put(key, lines)
+        return lines
+
+    def pages(self, text, max_width, max_lines):
+        """Split text into pages of max_lines lines for paged or marquee display"""
+        key = ("pages", text, max_width, max_lines)
+        pages = self._cache_get(key)
+        if pages is None:
+            lines = self.wrap(text, max_width)
+            pages = tuple(
+                lines[i : i + max_lines] for i in range(0, len(lines), max_lines)
+            ) or ((),)
+            self._cache_put(key, pages)
+        return pages
+
+    def truncate(self, text, max_width, force_ellipsis=False):
+        """Cut a single line to max_width, ending it with an ellipsis if shortened"""
+        if not force_ellipsis and self.measure(text) <= max_width:
+            return text
+
+        available = max_width - self.ellipsis_width
+        width = 0
+        end = 0
+        for char in text:
+            char_width = self.glyph_width(char)
+            if width + char_width > available:
+                break
+            width += char_width
+            end += 1
+
+        return text[:end].rstrip() + self.ELLIPSIS
+
+    def _wrap(self, text, max_width):
+        """Greedy word wrap, splitting words that are wider than a whole line"""
+        space_width = self.glyph_width(" ")
+        lines = []
+        current_line = []
+        current_width = 0
+
+        for word in text.split():
+            word_width = self.measure(word)
+
+            # Words that can never fit are split across lines by character
+            while word_width > max_width:
+                if current_line:
+                    lines.append(" ".join(current_line))
+                    current_line = []
+                    current_width = 0
+                head, word = self._split_word(word, max_width)
+                lines.append(head)
+                word_width = self.measure(word)
+
+            if not word:
+                continue
+
+            needed = word_width + (space_width if current_line else 0)
+            if current_width + needed <= max_width:
+                current_line.append(word)
+                current_width += needed
+            else:
+                lines.append(" ".join(current_line))
+                current_line = [word]
+                current_width = word_width
+
+        if current_line:
+            lines.append(" ".join(current_line))
+
+        return lines
+
+    def _split_word(self, word, max_width):
+        """Split a word at the last glyph that still fits within max_width"""
+        width = 0
+        for index, char in enumerate(word):
+            width += self.glyph_width(char)
+            if width > max_width:
+                # Always consume at least one glyph to guarantee progress
+                index = max(index, 1)
+                return word[:index], word[index:]
+        return word, ""
+
+    def _cache_get(self, key):
+        with self.lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, key, value):
+        with self.lock:
+            self._cache[key] = value
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
@@ -0,0 +1,143 @@
+import time
+import threading
+
+from services.log import get_logger
+
+logger = get_logger("display")
+
+
+class ThrottledDisplay:
+    """Render thread that owns the display and coalesces update requests"""
+
+    PRIORITY_NORMAL = 0
+    PRIORITY_HIGH = 1  # Errors and auth prompts preempt the frame interval
+
+    # Sentinel frame used to request a cleared screen
+    CLEAR = object()
+
+    def __init__(self, display_controller, min_interval=0.1, page_interval=3.0):
+        self.display = display_controller
+        self.min_interval = min_interval
+        self.page_interval = page_interval
+        self.last_update = 0
+        self.condition = threading.Condition()
+
+        # Latest-wins slots, one per priority level
+        self.pending_high = None
+        self.pending_normal = None
+
+        # Frame currently on screen, used for paging long details text
+        self.current_frame = None
+        self.current_page = 0
+        self.page_count = 1
+        self.rendering = False
+        self.running = True
+
+        self.thread = threading.Thread(target=self._render_loop, daemon=True)
+        self.thread.start()
+
+    def update_display(
+        self, title, status, details="", progress=None, priority=PRIORITY_NORMAL
+    ):
+        """Queue a display update and return immediately"""
+        frame = (title, status, details, progress)
+        with self.condition:
+            if priority >= self.PRIORITY_HIGH:
+                # A newer high-priority screen supersedes anything still pending
+                self.pending_high = frame
+                self.pending_normal = None
+            else:
+                self.pending_normal = frame
+            self.condition.notify()
+        return True
+
+    def clear(self):
+        """Queue a cleared screen ahead of any normal updates"""
+        with self.condition:
+            self.pending_high = self.CLEAR
+            self.pending_normal = None
+            self.condition.notify()
+
+    def flush(self, timeout=2.0):
+        """Wait until all pending frames have been pushed to the display"""
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.pending_high or self.pending_normal or self.rendering:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def stop(self, timeout=2.0):
+        """Render any pending frames and stop the render thread"""
+        self.flush(timeout)
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def _next_frame(self):
+        """Pick the next frame to render, or how long to wait for one"""
+        if self.pending_high is not None:
+            frame, self.pending_high = self.pending_high, None
+            return frame, 0
+
+        wait = self.min_interval - (time.time() - self.last_update)
+        if self.pending_normal is not None:
+            if wait <= 0:
+                frame, self.pending_normal = self.pending_normal, None
+                return frame, 0
+            return None, wait
+
+        # Nothing pending, cycle pages of the current frame if it overflows
+        if self.page_count > 1:
+            wait = self.page_interval - (time.time() - self.last_update)
+            if wait <= 0:
+                self.current_page = (self.current_page + 1) % self.page_count
+                return self.current_frame, 0
+            return None, wait
+
+        return None, None
+
+    def _render_loop(self):
+        """Thread function that pushes frames to the display"""
+        while True:
+            with self.condition:
+                frame, wait = self._next_frame()
+                while frame is None:
+                    if not self.running:
+                        return
+                    self.condition.wait(wait)
+                    frame, wait = self._next_frame()
+
+                if frame is not self.current_frame:
+                    if frame == self.current_frame:
+                        # Identical content is already on screen, skip the I2C push
+                        self.condition.notify_all()
+                        continue
+                    self.current_page = 0
+                self.rendering = True
+
+            try:
+                self._render(frame)
+            except Exception as e:
+                logger.exception("Error in display render thread: %s", e)
+            finally:
+                with self.condition:
+                    self.rendering = False
+                    self.last_update = time.time()
+                    self.condition.notify_all()
+
+    def _render(self, frame):
+        """Push a single frame to the display (runs on the render thread)"""
+        if frame is self.CLEAR:
+            self.current_frame = None
+            self.page_count = 1
+            self.display.clear()
+            return
+
+        title, status, details, progress = frame
+        self.current_frame = frame
+        self.page_count = self.display.details_page_count(details, progress)
+        self.display.update_display(title, status, details, progress, self.current_page)
@@ -8,12 +8,26 @@ import os
 import signal
 import sys
 import functools
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time as dt_time
 import threading
-from collections import defaultdict
 
 # Import hardware controller
 from controllers.hardware_controller import HardwareController
+from controllers.throttled_display import ThrottledDisplay
+from controllers.servo_calibration import CalibrationStore
+from services.config import Config, settings_dict
+from services.event_bus import EventBus
+from services.tag_index import TagIndex
+from services.history_store import HistoryStore
+from services.dose_ledger import DoseLedger
+from services.dispense_plan import PlanError, describe_plan
+from services.models import Schedule, ScheduleError, parse_schedules
+from services.command_queue import CommandError, CommandQueue
+from services.clock import SystemClock
+from services import trace
+from services import log
+
+logger = log.get_logger("dispenser")
 
 CONFIG_DIR = os.path.expanduser("~/Desktop/MediPi")
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.ini")
@@ -30,11 +44,40 @@ else:
     with open(SERIAL_FILE, "w") as f:
         f.write(SERIAL_NUMBER)
 
-print(f"Dispenser Serial Number: {SERIAL_NUMBER}")
+logger.info("Dispenser Serial Number: %s", SERIAL_NUMBER)
 
 # Local storage for schedules and logs
 SCHEDULES_FILE = os.path.join(CONFIG_DIR, "schedules.json")
-LOGS_FILE = os.path.join(CONFIG_DIR, "logs.json")
+LOGS_FILE = os.path.join(CONFIG_DIR, "logs.db")
+TAGS_FILE = os.path.join(CONFIG_DIR, "tags.json")
+CALIBRATION_FILE = os.path.join(CONFIG_DIR, "calibration.json")
+LEDGER_FILE = os.path.join(CONFIG_DIR, "dose_ledger.bin")
+TRACE_FILE = os.path.join(CONFIG_DIR, "trace.bin")
+
+# Actions accepted on the commands topic
+COMMANDS = (
+    "set_status",
+    "dispense",
+    "abort_dispense",
+    "cancel",
+    "get_logs",
+    "set_config",
+    "test_hardware",
+    "dry_run",
+    "sync_tags",
+    "set_calibration",
+    "get_calibration",
+    "calibrate",
+    "calibration_confirm",
+    "trace",
+)
+
+# Long-running actions, queued by priority; the rest run as they arrive
+QUEUED_COMMANDS = {
+    "dispense": CommandQueue.PRIORITY_HIGH,
+    "calibrate": CommandQueue.PRIORITY_NORMAL,
+    "test_hardware": CommandQueue.PRIORITY_LOW,
+}
 
 
 # Error handling decorator
@@ -49,9 +92,10 @@ def with_error_handling(default_return=None, log_error=True):
             except Exception as e:
                 instance = args[0] if args else None
                 func_name = func.__name__
+                clock = getattr(instance, "clock", None)
 
                 if log_error:
-                    print(f"Error in {func_name}: {e}")
+                    logger.exception("Error in %s: %s", func_name, e)
 
                 if hasattr(instance, "events") and hasattr(instance.events, "publish"):
                     instance.events.publish(
@@ -59,7 +103,9 @@ def with_error_handling(default_return=None, log_error=True):
                         {
                             "function": func_name,
                             "error": str(e),
-                            "timestamp": datetime.now().isoformat(),
+                            "timestamp": (
+                                clock.now() if clock else datetime.now()
+                            ).isoformat(),
                         },
                     )
 
@@ -70,142 +116,75 @@ def with_error_handling(default_return=None, log_error=True):
     return decorator
 
 
-# Dispensers follow event driven architechture with publishers and subscribers
-class EventBus:
-    """Event system for decoupled communication"""
-
-    def __init__(self):
-        self.subscribers = defaultdict(list)
-
-    def subscribe(self, event_type, callback):
-        """Subscribe to an event type"""
-        self.subscribers[event_type].append(callback)
-        return lambda: self.subscribers[event_type].remove(callback)
-
-    def publish(self, event_type, data=None):
-        """Publish an event"""
-        for callback in self.subscribers[event_type]:
-            try:
-                callback(data)
-            except Exception as e:
-                print(f"Error in event handler for {event_type}: {e}")
-
-
-class Config:
-    """Configuration manager"""
-
-    def __init__(self, config_path):
-        self.config_path = config_path
-        self.values = self.load_config()
-
-    def load_config(self):
-        """Load configuration with defaults"""
-        config = {
-            "mqtt": {
-                "broker_host": os.environ.get("MEDIPI_HUB_IP", "192.168.1.156"),
-                "broker_port": int(os.environ.get("MEDIPI_MQTT_PORT", 1883)),
-                "keepalive": 120,
-                "qos": 1,
-                "reconnect_delay": 5,
-            },
-            "hardware": {
-                "servo_count": 6,
-                "display_enabled": True,
-                "rfid_enabled": True,
-                "audio_enabled": True,
-                "display_update_interval": 1.0,  # seconds
-            },
-            "schedules": {
-                "check_interval": 30,  # seconds
-                "dispense_window": 2,  # minutes
-                "auth_timeout": 900,  # seconds
-            },
-        }
-
-        # Load from file if exists (in a real system)
-        # For now, just return the defaults
-        return config
-
-    def get(self, section, key):
-        """Get a configuration value"""
-        return self.values.get(section, {}).get(key)
-
-
-class ThrottledDisplay:
-    """Display controller that prevents too-frequent updates"""
-
-    def __init__(self, display_controller, min_interval=0.1):
-        self.display = display_controller
-        self.min_interval = min_interval
-        self.last_update = 0
-        self.pending_update = None
-        self.lock = threading.Lock()
-
-    def update_display(self, title, status, details="", progress=None):
-        """Throttled display update that prevents rapid changes"""
-        with self.lock:
-            current_time = time.time()
-
-            # Always store the latest update request
-            self.pending_update = (title, status, details, progress)
+class MediPiDispenser:
+    def __init__(self, clock=None):
+        # Time source for schedules, timeouts and logs, a VirtualClock simulates
+        self.clock = clock or SystemClock()
 
-            # If it's been long enough since the last update, do it now
-            if current_time - self.last_update >= self.min_interval:
-                self._do_update()
-                return True
+        # Setup event system
+        self.events = EventBus()
 
-            # Otherwise, schedule it for later if not already scheduled
-            return False
+        # Load configuration, config.ini edits and set_config apply without a restart
+        self.config = Config(CONFIG_FILE, self.events)
 
-    def _do_update(self):
-        """Actually perform the display update"""
-        if self.pending_update:
-            title, status, details, progress = self.pending_update
-            self.display.update_display(title, status, details, progress)
-            self.last_update = time.time()
-            self.pending_update = None
-
-    def process_pending(self):
-        """Process any pending display update"""
-        with self.lock:
-            current_time = time.time()
-            if (
-                self.pending_update
-                and current_time - self.last_update >= self.min_interval
-            ):
-                self._do_update()
+        # Authorized RFID tags, kept in sync with the schedules
+        self.tags = TagIndex(TAGS_FILE)
 
+        # Per-chamber servo calibration, editable over MQTT
+        self.calibration = CalibrationStore(CALIBRATION_FILE)
+        self.calibration_event = threading.Event()
+        self.calibration_result = None
 
-class MediPiDispenser:
-    def __init__(self):
-        # Setup event system
-        self.events = EventBus()
+        # Every log sent to the hub, kept on the device for audits
+        self.history = HistoryStore(
+            LOGS_FILE, self.config.snapshot.logs.retention_days, self.clock
+        )
 
-        # Load configuration
-        self.config = Config(CONFIG_FILE)
+        # Hardware timing trace, toggled by config or the trace command
+        trace.recorder.resize(self.config.snapshot.logs.trace_capacity)
+        trace.recorder.enabled = self.config.snapshot.logs.trace_enabled
 
         # Initialize hardware
-        self.hardware = HardwareController()
-
-        # Create throttled display
-        self.display = ThrottledDisplay(
-            self.hardware.display,
-            self.config.get("hardware", "display_update_interval"),
+        self.hardware = HardwareController(
+            self.config, self.events, self.tags, self.calibration, self.clock
         )
 
+        # Display render thread shared with the hardware controller
+        self.display = self.hardware.display
+
         # Current state
         self.is_connected = False
         self.status = "OFFLINE"
         self.reconnect_count = 0
         self.was_ever_connected = False
         self.schedules = self.load_schedules()
+        self.tags.sync_schedules(self.schedules)
         self.upcoming_notification_shown = False
-        self.processed_schedule_hours = (
-            set()
-        )  # Track which hours we've already processed today
+
+        # Schedule occurrences already triggered, kept across restarts
+        self.ledger = DoseLedger(LEDGER_FILE)
+        self.sync_ledger()
         self.dispensing_in_progress = False
+
+        # One dispense, test or calibration at a time, reentrant so a command
+        # can claim it before calling process_schedule
+        self.dispense_lock = threading.RLock()
+
         self.pending_messages = []  # For offline operation
 
+        # Pre-authorized occurrences, (schedule id, date, hour) -> tag role
+        self.preauthorized = {}
+        self.preauth_armed = False
+
+        # Hub commands, acknowledged on commands/ack; motion runs on a worker
+        self.commands = CommandQueue(
+            self.handle_command,
+            self.ack_command,
+            COMMANDS,
+            QUEUED_COMMANDS,
+            cancel_running=lambda payload: self.abort_work(),
+        )
+
         # Create a unique client ID to prevent conflicts
         unique_id = f"{SERIAL_NUMBER}-{uuid.uuid4().hex[:8]}"
 
@@ -225,7 +204,7 @@ class MediPiDispenser:
             json.dumps(
                 {
                     "status": "OFFLINE",
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": self.clock.now().isoformat(),
                     "ipAddress": self.get_ip_address(),
                     "reason": "Unexpected Disconnect",
                 }
@@ -244,12 +223,18 @@ class MediPiDispenser:
         # Setup event handlers
         self.setup_events()
 
+        # Log level, format and shipping follow the logs settings from here on
+        self.apply_log_settings()
+
     def setup_events(self):
         """Set up event handlers"""
         self.events.subscribe("mqtt_connected", self.on_mqtt_connected)
         self.events.subscribe("schedule_due", self.on_schedule_due)
         self.events.subscribe("dispensing_completed", self.on_dispensing_completed)
         self.events.subscribe("error", self.on_error)
+        self.events.subscribe("tag_detected", self.on_tag_detected)
+        self.events.subscribe("dispense_progress", self.on_dispense_progress)
+        self.events.subscribe("config_changed", self.on_config_changed)
 
     def on_mqtt_connected(self, data):
         """Handle MQTT connected event"""
@@ -262,7 +247,40 @@ class MediPiDispenser:
     def on_schedule_due(self, schedule):
         """Handle schedule due event"""
         # Start dispensing process
-        self.process_schedule(schedule)
+        self.process_schedule(schedule, self.take_preauthorization(schedule))
+
+    def take_preauthorization(self, schedule):
+        """Tag role of a scan cached during the pre-auth window, or False"""
+        due = schedule.due_at or self.clock.now()
+        return self.preauthorized.pop((schedule.id, due.date(), due.hour), False)
+
+    def on_tag_detected(self, tag):
+        """Handle a tag scanned outside a dispense, caching it as pre-authorization"""
+        if self.dispensing_in_progress:
+            return  # The running dispense handles its own authentication
+
+        now = self.clock.now()
+        window = self.config.snapshot.schedules.preauth_window
+        for due, schedule in self.get_upcoming_occurrences(now, window):
+            key = (schedule.id, due.date(), due.hour)
+            if key in self.preauthorized:
+                continue
+
+            role = self.tags.authorize(tag["id"], tag["text"], schedule)
+            if not role:
+                continue
+
+            self.preauthorized[key] = role
+            logger.info("Pre-authorized schedule %s due at %d:00", key[0], due.hour)
+            self.hardware.audio.play_sound("success")
+            self.update_default_display()
+            self.display.show_overlay(
+                "PRE-AUTHORIZED",
+                schedule.patient_name,
+                f"Dose starts at {due.hour}:00",
+                duration=3,
+            )
+            return
 
     def on_dispensing_completed(self, result):
         """Handle dispensing completed event"""
@@ -272,89 +290,116 @@ class MediPiDispenser:
         # Update display
         self.update_default_display()
 
+    def on_dispense_progress(self, progress):
+        """Forward per-dose progress to the hub, dropped while offline"""
+        self.publish_message(
+            f"medipi/dispensers/{SERIAL_NUMBER}/progress",
+            {**progress, "timestamp": self.clock.now().isoformat()},
+            qos=0,
+        )
+
+    def on_config_changed(self, changed):
+        """Apply settings that take effect without a restart"""
+        if any(name.startswith("logs.") for name in changed):
+            self.apply_log_settings()
+        if "logs.retention_days" in changed:
+            self.history.retention_days = self.config.snapshot.logs.retention_days
+            self.history.prune()
+        if "logs.trace_capacity" in changed:
+            # Reallocates the ring buffer, the records so far are dropped
+            trace.recorder.resize(self.config.snapshot.logs.trace_capacity)
+        if "logs.trace_enabled" in changed:
+            trace.recorder.enabled = self.config.snapshot.logs.trace_enabled
+            logger.info(
+                "Tracing %s", "enabled" if trace.recorder.enabled else "disabled"
+            )
+
+    def apply_log_settings(self):
+        """Configure the logging service from the logs settings"""
+        settings = self.config.snapshot.logs
+        log.service.configure(
+            settings.level,
+            settings.json,
+            settings.rate_limit_interval,
+            settings.rate_limit_burst,
+            settings.rate_limit_error_burst,
+        )
+        if settings.mqtt_level == "off":
+            log.service.unship()
+        else:
+            log.service.ship(self.publish_device_log, settings.mqtt_level)
+
+    def publish_device_log(self, entry):
+        """Ship one log record to the hub, dropped while offline"""
+        self.publish_message(
+            f"medipi/dispensers/{SERIAL_NUMBER}/device_logs", entry, qos=0
+        )
+
     def on_error(self, error_data):
         """Handle error event"""
         # Log error
-        print(f"ERROR: {error_data['function']}: {error_data['error']}")
+        logger.error("%s: %s", error_data["function"], error_data["error"])
 
         # Show on display if available
         error_msg = error_data["error"]
         if len(error_msg) > 30:
             error_msg = error_msg[:27] + "..."
 
-        self.display.update_display("ERROR", error_data["function"], error_msg)
+        self.display.update_display(
+            "ERROR",
+            error_data["function"],
+            error_msg,
+            priority=ThrottledDisplay.PRIORITY_HIGH,
+        )
 
     @with_error_handling([])
     def load_schedules(self):
         """Load schedules from local storage"""
         if os.path.exists(SCHEDULES_FILE):
             with open(SCHEDULES_FILE, "r") as f:
-                schedules = json.load(f)
-                # Pre-process dates for efficiency
-                return [self.process_schedule_time(s) for s in schedules]
+                schedules, errors = parse_schedules(json.load(f))
+            for schedule_id, messages in errors.items():
+                logger.warning(
+                    "Ignoring stored schedule %s: %s", schedule_id, "; ".join(messages)
+                )
+            return schedules
         return []
 
     @with_error_handling(False)
     def save_schedules(self):
         """Save schedules to local storage"""
-        # Remove pre-processed fields before saving
-        clean_schedules = []
-        for schedule in self.schedules:
-            clean_schedule = {
-                k: v for k, v in schedule.items() if not k.startswith("_")
-            }
-            clean_schedules.append(clean_schedule)
-
         with open(SCHEDULES_FILE, "w") as f:
-            json.dump(clean_schedules, f)
-        print(f"Saved {len(clean_schedules)} schedules to {SCHEDULES_FILE}")
+            json.dump([schedule.to_dict() for schedule in self.schedules], f)
+        logger.info("Saved %d schedules to %s", len(self.schedules), SCHEDULES_FILE)
         return True
 
-    def process_schedule_time(self, schedule):
-        """Pre-process schedule dates for efficient checking"""
-        try:
-            schedule["_start_date"] = datetime.fromisoformat(
-                schedule.get("startDate", "2000-01-01T00:00:00")
-            ).date()
-        except (ValueError, TypeError):
-            schedule["_start_date"] = datetime(2000, 1, 1).date()
-
-        if schedule.get("endDate"):
-            try:
-                schedule["_end_date"] = datetime.fromisoformat(
-                    schedule.get("endDate")
-                ).date()
-            except (ValueError, TypeError):
-                schedule["_end_date"] = None
-        else:
-            schedule["_end_date"] = None
-
-        return schedule
-
     @with_error_handling(False)
     def connect(self):
         """Connect to MQTT broker"""
         try:
-            print(
-                f"Connecting to MQTT broker at {self.config.get('mqtt', 'broker_host')}:{self.config.get('mqtt', 'broker_port')}"
+            mqtt_config = self.config.snapshot.mqtt
+            logger.info(
+                "Connecting to MQTT broker at %s:%d",
+                mqtt_config.broker_host,
+                mqtt_config.broker_port,
             )
             self.display.update_display(
                 "MQTT",
                 "Connecting",
-                f"To broker: {self.config.get('mqtt', 'broker_host')}",
+                f"To broker: {mqtt_config.broker_host}",
             )
 
             self.client.connect(
-                self.config.get("mqtt", "broker_host"),
-                self.config.get("mqtt", "broker_port"),
-                self.config.get("mqtt", "keepalive"),
+                mqtt_config.broker_host,
+                mqtt_config.broker_port,
+                mqtt_config.keepalive,
             )
             self.client.loop_start()
             time.sleep(2)
             self.update_default_display()
             return True
         except Exception as e:
-            print(f"MQTT Connection Error: {e}")
+            logger.error("MQTT Connection Error: %s", e)
             # return False to indicate failure
             return False
 
@@ -367,11 +412,11 @@ class MediPiDispenser:
 
         # Stop the loop and disconnect
         self.client.loop_stop()
-        print("Disconnected from MQTT broker")
+        logger.info("Disconnected from MQTT broker")
 
     def on_connect(self, client, userdata, flags, rc):
         """Callback when connected to MQTT broker"""
-        print(f"Connected to MQTT broker with result code {rc}")
+        logger.info("Connected to MQTT broker with result code %s", rc)
 
         if rc == 0:
             self.is_connected = True
@@ -379,7 +424,9 @@ class MediPiDispenser:
             self.was_ever_connected = True
 
             if self.status == "OFFLINE_AUTONOMOUS":
-                print("Exiting OFFLINE_AUTONOMOUS mode - broker connection restored")
+                logger.info(
+                    "Exiting OFFLINE_AUTONOMOUS mode - broker connection restored"
+                )
             self.status = "ONLINE"
 
             # Define topics map with QoS levels
@@ -399,12 +446,15 @@ class MediPiDispenser:
             # Publish MQTT connected event
             self.events.publish("mqtt_connected", None)
 
-            print("Successfully connected and subscribed to topics")
+            logger.info("Successfully connected and subscribed to topics")
         else:
             self.is_connected = False
-            print(f"Connection failed with code {rc}")
+            logger.error("Connection failed with code %s", rc)
             self.display.update_display(
-                "ERROR", "Connection Failed", f"Error code: {rc}"
+                "ERROR",
+                "Connection Failed",
+                f"Error code: {rc}",
+                priority=ThrottledDisplay.PRIORITY_HIGH,
             )
 
     def on_disconnect(self, client, userdata, rc):
@@ -412,8 +462,10 @@ class MediPiDispenser:
         self.is_connected = False
 
         self.reconnect_count += 1
-        print(
-            f"Disconnection with code {rc}. Will auto-reconnect... (attempt {self.reconnect_count})"
+        logger.warning(
+            "Disconnection with code %s. Will auto-reconnect... (attempt %d)",
+            rc,
+            self.reconnect_count,
         )
 
         self.display.update_display(
@@ -424,12 +476,14 @@ class MediPiDispenser:
 
         # Immediately go to autonomous mode if dispenser doesnt detect broker
         if not self.was_ever_connected:
-            print("Initial connection failed - entering OFFLINE_AUTONOMOUS mode")
+            logger.warning(
+                "Initial connection failed - entering OFFLINE_AUTONOMOUS mode"
+            )
             self.status = "OFFLINE_AUTONOMOUS"
             self.update_default_display()
         # Regular reconnection attempt handling
         elif self.reconnect_count > 5:
-            print(
+            logger.warning(
                 "Multiple reconnection attempts failed. Setting status to OFFLINE_AUTONOMOUS"
             )
             self.status = "OFFLINE_AUTONOMOUS"
@@ -438,46 +492,50 @@ class MediPiDispenser:
     def on_message(self, client, userdata, msg):
         """Callback when message received"""
         try:
-            print(f"Message received on topic {msg.topic}")
+            logger.debug("Message received on topic %s", msg.topic)
             payload = json.loads(msg.payload.decode())
 
             # Handle broadcast messages
             if msg.topic == "medipi/discovery/broadcast":
                 if payload.get("action") == "scan":
-                    print("Received scan request, sending discovery message")
+                    logger.info("Received scan request, sending discovery message")
                     self.send_discovery_message()
 
             # Handle commands
             elif msg.topic == f"medipi/dispensers/{SERIAL_NUMBER}/commands":
-                self.handle_command(payload)
+                self.commands.submit(payload)
 
             # Handle schedules
             elif msg.topic == f"medipi/dispensers/{SERIAL_NUMBER}/schedules":
                 self.handle_schedule_update(payload)
 
         except json.JSONDecodeError:
-            print("Received invalid JSON message")
+            logger.warning("Received invalid JSON message")
         except Exception as e:
-            print(f"Error handling message: {e}")
+            logger.exception("Error handling message: %s", e)
             self.events.publish(
                 "error",
                 {
                     "function": "on_message",
                     "error": str(e),
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": self.clock.now().isoformat(),
                 },
             )
 
-    @with_error_handling()
     def handle_command(self, payload):
-        """Handle command messages"""
+        """
+        Handle command messages, called by the command queue
+
+        Raises CommandError when a command cannot be carried out, which the
+        queue reports as FAILED on commands/ack.
+        """
         action = payload.get("action")
-        print(f"Handling command: {action}")
+        logger.info("Handling command: %s", action)
 
         if action == "set_status":
             new_status = payload.get("status")
             if new_status:
-                print(f"Setting status to {new_status}")
+                logger.info("Setting status to %s", new_status)
                 self.set_status(new_status)
 
         elif action == "dispense":
@@ -486,18 +544,16 @@ class MediPiDispenser:
 
             # Find the schedule or use a directly provided schedule
             if "schedule" in payload:
-                schedule = payload["schedule"]
-                print(f"Using provided schedule for direct dispensing")
+                try:
+                    schedule = Schedule.from_dict(payload["schedule"])
+                except ScheduleError as e:
+                    raise CommandError(f"Invalid schedule: {e}")
+                logger.info("Using provided schedule for direct dispensing")
             else:
-                schedule = next(
-                    (s for s in self.schedules if s.get("id") == schedule_id), None
-                )
+                schedule = self.find_schedule(schedule_id)
 
-            if schedule:
-                # Process schedule
-                self.events.publish("schedule_due", schedule)
-            else:
-                print(f"Schedule {schedule_id} not found")
+            if not schedule:
+                logger.warning("Schedule %s not found", schedule_id)
                 self.send_log(
                     {
                         "scheduleId": schedule_id,
@@ -505,51 +561,337 @@ class MediPiDispenser:
                         "error": "Schedule not found",
                     }
                 )
+                raise CommandError("Schedule not found")
+            # Claim the lock without waiting, so a retried command or a dose the
+            # scheduler just triggered is never dispensed a second time
+            if not self.dispense_lock.acquire(blocking=False):
+                raise CommandError("Dispensing in progress")
+            try:
+                # Runs on the command worker, so abort_dispense still arrives
+                result = self.process_schedule(
+                    schedule, self.take_preauthorization(schedule)
+                )
+            finally:
+                self.dispense_lock.release()
+            if result is None:
+                raise CommandError("Dispensing failed")
+            if result["status"] not in ("COMPLETED", "LATE"):
+                raise CommandError(
+                    f"Dispensing ended {result['status']}: "
+                    f"{result.get('error') or result.get('reason') or 'no details'}"
+                )
+
+        elif action == "abort_dispense":
+            # Emergency stop, also ends an authentication wait or calibration
+            self.abort_work()
+
+        elif action == "cancel":
+            # Drop a queued command, or stop it if it is already running
+            if not self.commands.cancel(payload.get("targetId")):
+                raise CommandError(
+                    f"No queued or running command {payload.get('targetId')}"
+                )
+
+        elif action == "get_logs":
+            # Page through the on-device history, newest first
+            try:
+                entries, next_cursor = self.history.query(
+                    since=payload.get("since"),
+                    until=payload.get("until"),
+                    schedule_id=payload.get("scheduleId"),
+                    status=payload.get("status"),
+                    limit=payload.get("limit", 50),
+                    cursor=payload.get("cursor"),
+                )
+            except (TypeError, ValueError) as e:
+                raise CommandError(f"Invalid history query: {e}")
+            self.publish_message(
+                f"medipi/dispensers/{SERIAL_NUMBER}/history",
+                {
+                    "requestId": payload.get("requestId"),
+                    "entries": entries,
+                    "nextCursor": next_cursor,
+                    "timestamp": self.clock.now().isoformat(),
+                },
+            )
+
+        elif action == "set_config":
+            # Change settings fleet-wide, e.g. {"schedules": {"check_interval": 10}}
+            try:
+                changed = self.config.set(payload.get("settings", {}))
+                reply = {
+                    "status": "SUCCESS",
+                    "changed": changed,
+                    "restartRequired": self.config.needs_restart(changed),
+                }
+            except ValueError as e:
+                reply = {"status": "ERROR", "error": str(e)}
+            self.publish_message(
+                f"medipi/dispensers/{SERIAL_NUMBER}/config",
+                {
+                    **reply,
+                    "config": settings_dict(self.config.snapshot),
+                    "timestamp": self.clock.now().isoformat(),
+                },
+            )
+
+        elif action == "test_hardware":
+            if self.dispensing_in_progress:
+                self.send_log(
+                    {
+                        "type": "HARDWARE_TEST",
+                        "status": "FAILED",
+                        "error": "Dispensing in progress",
+                    }
+                )
+                raise CommandError("Dispensing in progress")
+            self.run_self_test(payload)
+
+        elif action == "dry_run":
+            # Compile a schedule and report the predicted motion without moving
+            schedule = None
+            if payload.get("schedule"):
+                try:
+                    schedule = Schedule.from_dict(payload["schedule"])
+                    report = {}
+                except ScheduleError as e:
+                    report = {"valid": False, "errors": e.errors}
+            else:
+                schedule = self.find_schedule(payload.get("scheduleId"))
+                report = {"valid": False, "errors": ["Schedule not found"]}
+
+            if schedule is not None:
+                try:
+                    plan = self.hardware.plan_dispense(schedule)
+                    report = {"valid": True, **describe_plan(plan)}
+                except PlanError as e:
+                    report = {"valid": False, "errors": e.errors}
+            self.publish_message(
+                f"medipi/dispensers/{SERIAL_NUMBER}/plan",
+                {
+                    "scheduleId": payload.get("scheduleId")
+                    or (schedule.id if schedule else None),
+                    **report,
+                    "timestamp": self.clock.now().isoformat(),
+                },
+            )
+
+        elif action == "sync_tags":
+            # Patient and admin tags registered for this dispenser on the hub
+            count = self.tags.sync_tags(payload.get("tags", []))
+            logger.info("Synced %d RFID tags", count)
+
+        elif action in ("set_calibration", "get_calibration"):
+            # Per-chamber servo settings, see controllers/servo_calibration.py
+            if action == "set_calibration":
+                try:
+                    if payload.get("reset"):
+                        self.calibration.reset(payload["chamber"])
+                    else:
+                        self.calibration.set(
+                            payload["chamber"], payload.get("settings", {})
+                        )
+                except (KeyError, ValueError) as e:
+                    self.publish_calibration({"status": "ERROR", "error": str(e)})
+                    raise CommandError(str(e))
+            self.publish_calibration({"status": "SUCCESS"})
+
+        elif action == "calibrate":
+            if self.dispensing_in_progress:
+                self.publish_calibration(
+                    {"status": "ERROR", "error": "Dispensing in progress"}
+                )
+                raise CommandError("Dispensing in progress")
+            self.run_calibration(payload)
+
+        elif action == "trace":
+            # Toggle the timing trace, e.g. {"enabled": true}, and dump it
+            # with {"dump": true}; "chrome": true includes Chrome trace JSON
+            if "enabled" in payload:
+                enabled = payload["enabled"]
+                if not isinstance(enabled, bool):
+                    raise CommandError("enabled must be true or false")
+                trace.recorder.enabled = enabled
+            if payload.get("clear"):
+                trace.recorder.clear()
+            reply = {
+                "enabled": trace.recorder.enabled,
+                "capacity": trace.recorder.capacity,
+                "recorded": trace.recorder.total,
+            }
+            if payload.get("dump"):
+                reply["records"] = trace.recorder.dump(TRACE_FILE)
+                reply["file"] = TRACE_FILE
+            if payload.get("chrome"):
+                reply["chrome"] = trace.to_chrome(
+                    trace.recorder.records(),
+                    time.time_ns() - time.perf_counter_ns(),
+                )
+            self.publish_message(
+                f"medipi/dispensers/{SERIAL_NUMBER}/trace",
+                {**reply, "timestamp": self.clock.now().isoformat()},
+            )
+
+        elif action == "calibration_confirm":
+            # Operator feedback for the trial run that is waiting on it
+            self.calibration_result = bool(payload.get("dropped"))
+            self.calibration_event.set()
+
+    def abort_work(self):
+        """Emergency stop, also ends an authentication wait or calibration"""
+        latency = self.hardware.abort_dispense()
+        self.calibration_result = None
+        self.calibration_event.set()
+        logger.warning("Dispense aborted, servos stopped in %.1f ms", latency)
+        if not self.dispensing_in_progress:
+            self.update_default_display()
+
+    def ack_command(self, request_id, action, status, **details):
+        """Report a command's state to the hub"""
+        self.publish_message(
+            f"medipi/dispensers/{SERIAL_NUMBER}/commands/ack",
+            {
+                "requestId": request_id,
+                "action": action,
+                "status": status,
+                **details,
+                "timestamp": self.clock.now().isoformat(),
+            },
+        )
+
+    def publish_calibration(self, message):
+        """Publish the calibration table with a status message"""
+        self.publish_message(
+            f"medipi/dispensers/{SERIAL_NUMBER}/calibration",
+            {
+                **message,
+                "calibration": self.calibration.table(),
+                "timestamp": self.clock.now().isoformat(),
+            },
+        )
+
+    def run_self_test(self, payload):
+        """
+        Run the hardware self-test and log the report
+
+        Raises CommandError for an invalid sample count or if a component
+        failed.
+        """
+        samples = payload.get("samples", 10)
+        if isinstance(samples, bool) or not isinstance(samples, int):
+            raise CommandError(f"samples is not an integer: {samples!r}")
+
+        with self.dispense_lock:
+            self.dispensing_in_progress = True  # Keep the servos to ourselves
+            try:
+                report = self.hardware.self_test(
+                    payload.get("component", "all"), samples
+                )
+            finally:
+                self.dispensing_in_progress = False
+
+        logger.info("Hardware self-test %s", report["status"])
+        self.send_log(report)
+        self.update_default_display()
+        if report["status"] != "PASSED":
+            failed = [n for n, r in report["components"].items() if not r["ok"]]
+            raise CommandError(f"Self-test failed: {', '.join(failed)}")
+
+    def run_calibration(self, payload):
+        """
+        Calibrate one chamber with operator feedback
+
+        Raises CommandError for an invalid request or when no reliable run
+        time was found.
+        """
+        try:
+            chamber = int(payload["chamber"])
+            timeout = float(payload.get("confirmTimeout", 60))
+            search = {
+                "min_duration": float(payload.get("minDuration", 0.3)),
+                "max_duration": float(payload.get("maxDuration", 2.0)),
+                "trials": int(payload.get("trials", 2)),
+            }
+        except (KeyError, TypeError, ValueError) as e:
+            error = f"Invalid calibration request: {e}"
+            self.publish_calibration({"status": "ERROR", "error": error})
+            raise CommandError(error)
+
+        def verify(duration):
+            # Ask the operator whether a dose dropped and wait for the answer
+            self.calibration_event.clear()
+            self.publish_calibration(
+                {"status": "TRIAL", "chamber": chamber, "duration": duration}
+            )
+            if not self.clock.wait(self.calibration_event, timeout):
+                return None
+            return self.calibration_result
+
+        with self.dispense_lock:
+            self.dispensing_in_progress = True
+            try:
+                duration = self.hardware.calibrate_chamber(chamber, verify, **search)
+            finally:
+                self.dispensing_in_progress = False
+
+        self.publish_calibration(
+            {
+                "status": "SUCCESS" if duration else "FAILED",
+                "chamber": chamber,
+                "duration": duration,
+            }
+        )
+        self.update_default_display()
+        if not duration:
+            raise CommandError(f"No reliable run time found for chamber {chamber}")
 
     @with_error_handling()
     def handle_schedule_update(self, payload):
         """Handle schedule updates"""
+        if not isinstance(payload, list):
+            raise ScheduleError(["schedules payload is not a list"])
 
-        print(f"Received {len(payload)} schedules")
-
-        # Process each schedule to ensure required fields
-        processed_schedules = []
-        for schedule in payload:
-            # Ensure schedule has required fields with defaults
-            processed_schedule = {
-                "id": schedule.get("id", str(uuid.uuid4())),
-                "time": schedule.get("time", 0),  # Hour (0-23)
-                "patientName": schedule.get("patientName", "Patient"),
-                "patientId": schedule.get("patientId", ""),
-                "startDate": schedule.get("startDate", datetime.now().isoformat()),
-                "endDate": schedule.get("endDate", None),
-                "isActive": schedule.get("isActive", True),
-                "rfidTag": schedule.get("rfidTag", ""),
-                "medications": schedule.get("medications", []),
-                "chambers": schedule.get("chambers", []),
-            }
-            # Process datetime fields
-            processed_schedules.append(self.process_schedule_time(processed_schedule))
+        logger.info("Received %d schedules", len(payload))
 
-        self.schedules = processed_schedules
+        # Parse and validate once, malformed schedules are rejected here
+        schedules, errors = parse_schedules(payload)
+        for schedule_id, messages in errors.items():
+            logger.warning("Rejected schedule %s: %s", schedule_id, "; ".join(messages))
 
-        # Save schedules to local storage
-        self.save_schedules()
+        # PARTIAL when only some schedules were applied, ERROR applies nothing
+        if not errors:
+            status = "SUCCESS"
+        else:
+            status = "PARTIAL" if schedules else "ERROR"
 
-        # Update display with notification
-        self.display.update_display("SCHEDULES", "Updated", f"{len(payload)} schedules")
+        if status != "ERROR":
+            # A rejected schedule keeps its last good version, so a malformed
+            # update never stops its doses or frees its ledger slot
+            for schedule_id in errors:
+                previous = self.find_schedule(schedule_id)
+                if previous is not None:
+                    schedules.append(previous)
 
-        # Show notification for 5 seconds, then return to default display
-        time.sleep(5)
-        self.update_default_display()
+            self.schedules = schedules
+            self.tags.sync_schedules(self.schedules)
+            self.sync_ledger()
+
+            # Save schedules to local storage
+            self.save_schedules()
+
+            # Show notification for 5 seconds, then return to default display
+            self.update_default_display()
+            self.display.show_overlay(
+                "SCHEDULES", "Updated", f"{len(schedules)} schedules", duration=5
+            )
 
-        # Send confirmation
         self.publish_message(
             f"medipi/dispensers/{SERIAL_NUMBER}/schedules/confirm",
             {
-                "status": "SUCCESS",
-                "count": len(payload),
-                "timestamp": datetime.now().isoformat(),
+                "status": status,
+                "count": len(self.schedules),
+                **({"errors": errors} if errors else {}),
+                "timestamp": self.clock.now().isoformat(),
             },
         )
 
@@ -559,35 +901,41 @@ class MediPiDispenser:
         # Get patient name from any active schedule
         patient_name = "No Patient"
         for schedule in self.schedules:
-            if schedule.get("isActive", True):
-                patient_name = schedule.get("patientName", "Patient")
+            if schedule.is_active:
+                patient_name = schedule.patient_name
                 break
 
         # To check for upcoming schedule in next 15 minutes
-        now = datetime.now()
+        now = self.clock.now()
         current_hour = now.hour
         current_minute = now.minute
         current_date = now.date()
 
         upcoming_text = ""
-        for schedule in self.schedules:
-            if not schedule.get("isActive", True):
-                continue
 
-            # Check if schedule is active today
-            if current_date < schedule.get("_start_date"):
-                continue
-            if schedule.get("_end_date") and current_date > schedule.get("_end_date"):
-                continue
+        # Occurrences inside the pre-auth window invite an early scan
+        window = self.config.snapshot.schedules.preauth_window
+        for due, schedule in self.get_upcoming_occurrences(now, window):
+            if (schedule.id, due.date(), due.hour) in self.preauthorized:
+                upcoming_text = f"Ready for {due.hour}:00"
+            else:
+                upcoming_text = f"Med due at {due.hour}:00 - scan tag"
+            break
 
-            schedule_hour = int(schedule.get("time", 0))
+        if not upcoming_text:
+            for schedule in self.schedules:
+                # Check if schedule is active today
+                if not schedule.active_on(current_date):
+                    continue
 
-            # Check if schedule is within the next 15 minutes
-            if (current_hour == schedule_hour and current_minute >= 45) or (
-                current_hour == (schedule_hour - 1) % 24 and current_minute >= 45
-            ):
-                upcoming_text = f"Med due at {schedule_hour}:00"
-                break
+                schedule_hour = schedule.time
+
+                # Check if schedule is within the next 15 minutes
+                if (current_hour == schedule_hour and current_minute >= 45) or (
+                    current_hour == (schedule_hour - 1) % 24 and current_minute >= 45
+                ):
+                    upcoming_text = f"Med due at {schedule_hour}:00"
+                    break
 
         self.display.update_display(
             "MediPi",
@@ -602,7 +950,7 @@ class MediPiDispenser:
             "serialNumber": SERIAL_NUMBER,
             "ipAddress": self.get_ip_address(),
             "status": self.status,
-            "lastSeen": datetime.now().isoformat(),
+            "lastSeen": self.clock.now().isoformat(),
             "action": "announce",
             "model": "MediPi Dispenser Zero 2 W",
         }
@@ -618,7 +966,7 @@ class MediPiDispenser:
 
         message = {
             "status": self.status,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self.clock.now().isoformat(),
             "ipAddress": self.get_ip_address(),
             "reason": reason or "Status Update",
             "scheduleCount": len(self.schedules),
@@ -634,10 +982,13 @@ class MediPiDispenser:
         # Add common fields
         log_entry = {
             "dispenserId": SERIAL_NUMBER,
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": self.clock.now().isoformat(),
             **log_data,
         }
 
+        # Keep a local copy whether or not the hub receives it
+        self.history.append(log_entry)
+
         return self.publish_message(
             f"medipi/dispensers/{SERIAL_NUMBER}/logs", log_entry, qos=1
         )
@@ -645,7 +996,9 @@ class MediPiDispenser:
     def publish_message(self, topic, payload, qos=1, retain=False):
         """Centralized method for publishing MQTT messages with error handling"""
         if not self.is_connected:
-            self.pending_messages.append((topic, payload, qos, retain))
+            # QoS 0 messages are best effort, only queue the rest for later
+            if qos > 0:
+                self.pending_messages.append((topic, payload, qos, retain))
             return False
 
         try:
@@ -654,12 +1007,14 @@ class MediPiDispenser:
             )
             success = result.rc == mqtt.MQTT_ERR_SUCCESS
             if success:
-                print(f"Message sent to {topic}")
+                logger.debug("Message sent to %s", topic)
             else:
-                print(f"Failed to send message to {topic}, error code: {result.rc}")
+                logger.error(
+                    "Failed to send message to %s, error code: %s", topic, result.rc
+                )
             return success
         except Exception as e:
-            print(f"Error publishing to {topic}: {e}")
+            logger.error("Error publishing to %s: %s", topic, e)
             return False
 
     def process_pending_messages(self):
@@ -667,128 +1022,228 @@ class MediPiDispenser:
         if not self.pending_messages:
             return
 
-        print(f"Processing {len(self.pending_messages)} pending messages")
+        logger.info("Processing %d pending messages", len(self.pending_messages))
         for topic, payload, qos, retain in self.pending_messages[:]:
             if self.publish_message(topic, payload, qos, retain):
                 self.pending_messages.remove((topic, payload, qos, retain))
 
     @with_error_handling()
     def process_schedule(self, schedule, authorized=False):
-        """Process a schedule and dispense medication"""
-        print(f"Processing schedule: {schedule}")
+        """Process a schedule and dispense medication, returns the result"""
+        logger.info("Processing schedule: %s", schedule.id)
 
-        # Set dispensing flag to prevent duplicate processes
-        self.dispensing_in_progress = True
+        # Serialize with command dispenses that raced the scheduler
+        with self.dispense_lock:
+            # Set dispensing flag to prevent duplicate processes
+            self.dispensing_in_progress = True
 
-        try:
-            # Dispense medication and get result
-            result = self.hardware.dispense_scheduled_medication(schedule, authorized)
+            try:
+                return self.dispense_schedule(schedule, authorized)
+            finally:
+                # clear dispensing flag
+                self.dispensing_in_progress = False
+
+    def dispense_schedule(self, schedule, authorized):
+        """Dispense a schedule, report and return the result"""
+        # Dispense medication and get result
+        result = self.hardware.dispense_scheduled_medication(schedule, authorized)
+
+        # A dose caught up after its dispense window is reported as late
+        if schedule.late and result["status"] == "COMPLETED":
+            result["status"] = "LATE"
+
+        # Publish dispensing completed event
+        self.events.publish(
+            "dispensing_completed",
+            {
+                "scheduleId": schedule.id,
+                "status": result["status"],
+                "details": result,
+            },
+        )
 
-            # Publish dispensing completed event
-            self.events.publish(
-                "dispensing_completed",
-                {
-                    "scheduleId": schedule.get("id", "unknown"),
-                    "status": result["status"],
-                    "details": result,
-                },
-            )
+        # The dose is settled once its result is reported
+        if schedule.due_at is not None:
+            self.ledger.complete(schedule.id, schedule.due_at.date())
 
-            # Return to ready state
-            self.update_default_display()
+        # Return to ready state
+        self.update_default_display()
+        return result
+
+    def find_schedule(self, schedule_id):
+        """Stored schedule with an ID, or None"""
+        return next((s for s in self.schedules if s.id == schedule_id), None)
+
+    def get_upcoming_occurrences(self, now, window_minutes):
+        """Active schedule occurrences due after now and within window_minutes"""
+        if not window_minutes:
+            return []
+
+        horizon = now + timedelta(minutes=window_minutes)
+        upcoming = []
+        for day in {now.date(), horizon.date()}:
+            for schedule in self.schedules:
+                if not schedule.active_on(day):
+                    continue
 
-        finally:
-            # clear dispensing flag
-            self.dispensing_in_progress = False
+                due = datetime.combine(day, dt_time(schedule.time))
+                if now < due <= horizon:
+                    upcoming.append((due, schedule))
 
-    def get_active_schedules_for_hour(self, hour, current_date):
-        """Get all active schedules for a specific hour and date"""
-        active_schedules = []
+        upcoming.sort(key=lambda occurrence: occurrence[0])
+        return upcoming
 
-        for schedule in self.schedules:
-            # Skip inactive schedules
-            if not schedule.get("isActive", True):
-                continue
+    def get_due_occurrences(self, now, lookback=timedelta(days=1)):
+        """Active schedule occurrences due at or before now within lookback, oldest first"""
+        since = now - lookback
+        due_occurrences = []
+        for day in {since.date(), now.date()}:
+            for schedule in self.schedules:
+                if not schedule.active_on(day):
+                    continue
 
-            # Use pre-processed dates
-            if current_date < schedule.get("_start_date"):
-                continue
-            if schedule.get("_end_date") and current_date > schedule.get("_end_date"):
-                continue
+                due = datetime.combine(day, dt_time(schedule.time))
+                if since < due <= now:
+                    due_occurrences.append((due, schedule))
+
+        due_occurrences.sort(key=lambda occurrence: occurrence[0])
+        return due_occurrences
+
+    def sync_ledger(self):
+        """Track the current schedules in the dose ledger"""
+        now = self.clock.now()
+        added = set(self.ledger.sync((s.id for s in self.schedules), now.date()))
 
-            # Check hour match
-            if int(schedule.get("time", 0)) == hour:
-                active_schedules.append(schedule)
+        # Doses past their grace window before a schedule was known are
+        # settled, not reported missed; check_schedules handles the rest
+        if added:
+            _, grace_window = self.catch_up_windows(self.config.snapshot.schedules)
+            for due, schedule in self.get_due_occurrences(now):
+                if schedule.id in added and now - due >= grace_window:
+                    self.ledger.complete(schedule.id, due.date())
 
-        return active_schedules
+    @staticmethod
+    def catch_up_windows(schedules_config):
+        """(dispense window, grace window) as timedeltas, grace never shorter"""
+        dispense_window = timedelta(minutes=schedules_config.dispense_window)
+        grace_window = max(
+            dispense_window, timedelta(minutes=schedules_config.grace_window)
+        )
+        return dispense_window, grace_window
+
+    def update_preauth_window(self, now):
+        """Poll RFID quickly while a dose is inside its pre-auth window"""
+        schedules_config = self.config.snapshot.schedules
+        upcoming = self.get_upcoming_occurrences(now, schedules_config.preauth_window)
+
+        # Forget pre-authorizations whose dose was never triggered
+        dispense_window = timedelta(minutes=schedules_config.dispense_window)
+        for key in list(self.preauthorized):
+            if datetime.combine(key[1], dt_time(key[2])) + dispense_window < now:
+                del self.preauthorized[key]
+
+        if upcoming and not self.preauth_armed:
+            self.preauth_armed = True
+            self.hardware.rfid.acquire()
+            self.update_default_display()
+        elif not upcoming and self.preauth_armed:
+            self.preauth_armed = False
+            self.hardware.rfid.release()
+
+    def report_interrupted(self):
+        """Report doses whose dispense was cut short by a crash or power loss"""
+        schedules = {self.ledger.digest(s.id): s for s in self.schedules}
+        for digest, day in self.ledger.unfinished():
+            schedule = schedules.get(digest)
+            entry = {
+                "scheduleId": schedule.id if schedule else None,
+                "status": "MISSED",
+                "reason": "Interrupted before completion",
+                "dueAt": (
+                    datetime.combine(day, dt_time(schedule.time)).isoformat()
+                    if schedule
+                    else day.isoformat()
+                ),
+            }
+            logger.warning("Schedule interrupted: %s on %s", entry["scheduleId"], day)
+            self.send_log(entry)
+            self.ledger.complete_digest(digest, day)
 
     def check_schedules(self):
         """Thread function to check for upcoming schedules"""
-        # Track the last day we reset our processed hours
-        last_reset_date = datetime.now().date()
-
+        self.report_interrupted()
         while True:
             try:
-                now = datetime.now()
-                current_hour = now.hour
-                current_minute = now.minute
-                current_date = now.date()
+                now = self.clock.now()
 
-                # Reset processed hours at midnight
-                if current_date != last_reset_date:
-                    self.processed_schedule_hours = set()
-                    last_reset_date = current_date
-                    print(f"Reset processed schedule hours for new day: {current_date}")
+                # One consistent snapshot for the whole iteration
+                schedules_config = self.config.snapshot.schedules
 
                 # Skip if dispensing is already in progress
                 if self.dispensing_in_progress:
-                    time.sleep(5)  # Check more frequently when dispensing
+                    self.clock.sleep(5)  # Check more frequently when dispensing
                     continue
 
-                # Get active schedules for this hour
-                active_schedules = self.get_active_schedules_for_hour(
-                    current_hour, current_date
-                )
-
-                # Check if it's time to dispense (start of hour)
-                dispense_window = self.config.get("schedules", "dispense_window")
-                if 0 <= current_minute < dispense_window:
-                    for schedule in active_schedules:
-                        schedule_key = f"{current_date.isoformat()}-{current_hour}"
-
-                        # Check if already processed
-                        if schedule_key in self.processed_schedule_hours:
-                            continue
-
-                        # Mark as processed
-                        self.processed_schedule_hours.add(schedule_key)
-
-                        # Publish schedule due event
-                        print(
-                            f"Schedule triggered: {schedule.get('id')} at {current_hour}:00"
+                # Doses due but not yet handled, including any missed while the
+                # device was off, busy or stalled
+                dispense_window, grace_window = self.catch_up_windows(schedules_config)
+                for due, schedule in self.get_due_occurrences(now):
+                    # Check if already processed, including before a restart
+                    if self.ledger.is_handled(schedule.id, due.date()):
+                        continue
+
+                    # Mark as triggered before dispensing, never dispense twice
+                    self.ledger.mark(schedule.id, due.date())
+
+                    overdue = now - due
+                    if overdue >= grace_window:
+                        # Too late to catch up, record the dose as missed
+                        logger.warning("Schedule missed: %s at %s", schedule.id, due)
+                        self.send_log(
+                            {
+                                "scheduleId": schedule.id,
+                                "status": "MISSED",
+                                "reason": "Not dispensed within grace window",
+                                "dueAt": due.isoformat(),
+                            }
                         )
-                        self.events.publish("schedule_due", schedule)
+                        self.ledger.complete(schedule.id, due.date())
+                        continue
+
+                    # Publish schedule due event
+                    late = overdue >= dispense_window
+                    trace.recorder.record(trace.SCHEDULE_TRIGGER, due.hour)
+                    logger.info(
+                        "Schedule triggered: %s at %d:00%s",
+                        schedule.id,
+                        due.hour,
+                        " (late)" if late else "",
+                    )
+                    self.events.publish("schedule_due", schedule.occurrence(due, late))
 
-                        # Only process one schedule at a time
-                        break
+                    # Only process one schedule at a time
+                    break
 
-                # Process any pending display updates
-                self.display.process_pending()
+                self.update_preauth_window(now)
 
-                # Sleep according to configuration
-                time.sleep(self.config.get("schedules", "check_interval"))
+                # Sleep according to configuration, waking exactly when a dose is due
+                sleep_for = schedules_config.check_interval
+                upcoming = self.get_upcoming_occurrences(now, sleep_for / 60)
+                if upcoming:
+                    sleep_for = (upcoming[0][0] - now).total_seconds() + 0.05
+                self.clock.sleep(sleep_for)
 
             except Exception as e:
-                print(f"Error in schedule checker: {e}")
+                logger.exception("Error in schedule checker: %s", e)
                 self.events.publish(
                     "error",
                     {
                         "function": "check_schedules",
                         "error": str(e),
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp": self.clock.now().isoformat(),
                     },
                 )
-                time.sleep(60)  # Longer sleep after error
+                self.clock.sleep(60)  # Longer sleep after error
 
     def maintain_connection(self):
         """Thread function to keep connection alive and handle reconnection"""
@@ -799,8 +1254,8 @@ class MediPiDispenser:
                     self.publish_message(
                         f"medipi/dispensers/{SERIAL_NUMBER}/ping",
                         {
-                            "timestamp": datetime.now().isoformat(),
-                            "uptime": time.time() - self.start_time,
+                            "timestamp": self.clock.now().isoformat(),
+                            "uptime": self.clock.time() - self.start_time,
                             "status": self.status,
                         },
                         qos=0,
@@ -808,30 +1263,44 @@ class MediPiDispenser:
                 else:
                     # Not connected - trigger reconnect if in offline autonomous mode
                     if self.status == "OFFLINE_AUTONOMOUS":
-                        print("Attempting to reconnect from OFFLINE_AUTONOMOUS mode")
+                        logger.info(
+                            "Attempting to reconnect from OFFLINE_AUTONOMOUS mode"
+                        )
                         try:
                             self.connect()
                         except Exception as e:
-                            print(f"Reconnection attempt failed: {e}")
+                            logger.warning("Reconnection attempt failed: %s", e)
 
                 # Sleep for 30 seconds
-                time.sleep(30)
+                self.clock.sleep(30)
             except Exception as e:
-                print(f"Error in maintain_connection thread: {e}")
-                time.sleep(60)  # Longer sleep after error
+                logger.exception("Error in maintain_connection thread: %s", e)
+                self.clock.sleep(60)  # Longer sleep after error
 
     def signal_handler(self, sig, frame):
         """Handle system signals for clean shutdown"""
-        print("Shutting down...")
+        logger.info("Shutting down...")
 
-        # Display shutdown message
-        self.display.update_display("SHUTDOWN", "System stopping", "Please wait...")
+        # Display shutdown message in place of any transient screen
+        self.display.dismiss_overlays()
+        self.display.update_display(
+            "SHUTDOWN",
+            "System stopping",
+            "Please wait...",
+            priority=ThrottledDisplay.PRIORITY_HIGH,
+        )
 
-        # Disconnect from MQTT
+        # Drop queued commands, then disconnect from MQTT
+        self.commands.stop()
         self.disconnect()
 
         # Clean up hardware
         self.hardware.cleanup()
+        self.history.close()
+        self.ledger.close()
+
+        # Write out queued log records
+        log.service.stop()
 
         sys.exit(0)
 
@@ -849,20 +1318,19 @@ class MediPiDispenser:
 
     def run(self):
         """Start the dispenser service"""
-        self.start_time = time.time()
+        self.start_time = self.clock.time()
 
         # Try to connect to MQTT broker
         connection_success = self.connect()
 
         if not connection_success:
-            print("MQTT connection failed - entering OFFLINE_AUTONOMOUS mode")
-            self.display.update_display(
-                "OFFLINE MODE", "No connection", "Operating autonomously"
+            logger.warning("MQTT connection failed - entering OFFLINE_AUTONOMOUS mode")
+            self.display.show_overlay(
+                "OFFLINE MODE", "No connection", "Operating autonomously", duration=2
             )
             self.status = "OFFLINE_AUTONOMOUS"
-            time.sleep(2)  # Show the message for 2 seconds
         else:
-            print("Dispenser service running with MQTT connection")
+            logger.info("Dispenser service running with MQTT connection")
 
         # Start threads regardless of connection status
         connection_thread = threading.Thread(
@@ -870,6 +1338,9 @@ class MediPiDispenser:
         )
         connection_thread.start()
 
+        # Pick up edits to config.ini
+        self.config.watch()
+
         schedule_thread = threading.Thread(target=self.check_schedules, daemon=True)
         schedule_thread.start()
 
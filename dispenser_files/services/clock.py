@@ -0,0 +1,99 @@
+import time
+import queue
+import threading
+from datetime import datetime, timedelta
+
+
+class SystemClock:
+    """Wall-clock time, used unless a simulation passes its own clock"""
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(max(0, seconds))
+
+    def wait(self, event, timeout=None):
+        """Wait for a threading.Event, returns True if it was set"""
+        return event.wait(timeout)
+
+    def get(self, items, timeout=None):
+        """Take from a queue.Queue, raises queue.Empty on timeout"""
+        return items.get(timeout=timeout)
+
+
+class VirtualClock:
+    """
+    Simulated time that only moves forward when someone sleeps or waits
+
+    sleep() and timed waits that would block jump the clock to their deadline
+    and return at once, so a 900 s authentication timeout or a whole day of
+    schedule checks take milliseconds. Time never goes backwards: a thread
+    whose deadline has already passed returns without moving the clock.
+    """
+
+    def __init__(self, start=None, yield_time=0.001):
+        """
+        Args:
+            start: datetime the simulation starts at, defaults to now
+            yield_time: Real seconds a wait gives other threads to set its
+                event or fill its queue before the clock jumps
+        """
+        self.start = start or datetime.now()
+        self.epoch = self.start.timestamp()
+        self.yield_time = yield_time
+        self.elapsed = 0.0  # Simulated seconds since start
+        self.lock = threading.Lock()  # For thread safety
+
+    def time(self):
+        return self.epoch + self.elapsed
+
+    def monotonic(self):
+        return self.elapsed
+
+    def now(self):
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def advance(self, seconds):
+        """Move the clock forward, returns the new simulated time"""
+        with self.lock:
+            self.elapsed += max(0, seconds)
+            return self.now()
+
+    def advance_to(self, moment):
+        """Move the clock forward to a datetime, if it is still ahead"""
+        return self._advance_until((moment - self.start).total_seconds())
+
+    def _advance_until(self, elapsed):
+        with self.lock:
+            self.elapsed = max(self.elapsed, elapsed)
+            return self.now()
+
+    def sleep(self, seconds):
+        self._advance_until(self.elapsed + max(0, seconds))
+
+    def wait(self, event, timeout=None):
+        """Wait for a threading.Event, jumping to the timeout if it stays clear"""
+        deadline = self.elapsed + (timeout or 0)
+        if event.wait(self.yield_time) or timeout is None:
+            # Without a timeout only a set event ends the wait
+            return event.wait() if timeout is None else True
+        self._advance_until(deadline)
+        return event.is_set()
+
+    def get(self, items, timeout=None):
+        """Take from a queue.Queue, jumping to the timeout if nothing arrives"""
+        if timeout is None:
+            return items.get()
+        deadline = self.elapsed + timeout
+        try:
+            return items.get(timeout=self.yield_time)
+        except queue.Empty:
+            self._advance_until(deadline)
+            raise
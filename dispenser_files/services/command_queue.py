@@ -0,0 +1,204 @@
+import uuid
+import heapq
+import itertools
+import threading
+from collections import OrderedDict
+
+from services.log import get_logger
+
+logger = get_logger("commands")
+
+
+class CommandError(Exception):
+    """A command that was accepted but could not be carried out"""
+
+
+class CommandQueue:
+    """
+    Runs hub commands with request IDs, acknowledgements and cancellation
+
+    Quick commands run inline as they arrive. Long-running ones are queued
+    by priority and run one at a time on a worker thread, so the MQTT thread
+    stays free for aborts and cancellations. Every state change is reported
+    through on_ack(request_id, action, status, **details).
+    """
+
+    # Queue priorities, higher runs first
+    PRIORITY_LOW = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_HIGH = 2
+    PRIORITY_NAMES = {"low": 0, "normal": 1, "high": 2}
+
+    # Command states reported in acknowledgements
+    ACCEPTED = "ACCEPTED"
+    REJECTED = "REJECTED"
+    DUPLICATE = "DUPLICATE"
+    STARTED = "STARTED"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"
+
+    def __init__(
+        self,
+        handler,
+        on_ack,
+        actions,
+        queued_actions,
+        cancel_running=None,
+        history_size=256,
+        max_queued=32,
+    ):
+        """
+        Args:
+            handler: Function that carries out a command payload, raises on failure
+            on_ack: Function called with (request_id, action, status, **details)
+            actions: Every action the handler understands
+            queued_actions: Long-running action -> default priority
+            cancel_running: Function that interrupts a running command payload
+            history_size: Request IDs remembered for duplicate detection
+            max_queued: Commands waiting at most before new ones are rejected
+        """
+        self.handler = handler
+        self.on_ack = on_ack
+        self.actions = set(actions)
+        self.queued_actions = dict(queued_actions)
+        self.cancel_running = cancel_running
+        self.history_size = history_size
+        self.max_queued = max_queued
+
+        self.condition = threading.Condition()  # For thread safety
+        self.queue = []  # Heap of (-priority, sequence, request_id, payload)
+        self.sequence = itertools.count()
+        self.states = OrderedDict()  # request_id -> latest state, oldest first
+        self.running = None  # (request_id, payload) on the worker
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self._worker_loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, payload):
+        """Acknowledge a command and run or queue it, returns its request ID"""
+        action = payload.get("action")
+        request_id = str(payload.get("requestId") or f"auto-{uuid.uuid4().hex[:12]}")
+
+        with self.condition:
+            if request_id in self.states:
+                # A retry of a command already seen, never run it twice
+                self._ack(
+                    request_id, action, self.DUPLICATE, state=self.states[request_id]
+                )
+                return request_id
+
+            if action not in self.actions:
+                self._set_state(
+                    request_id, action, self.REJECTED, error="Unknown action"
+                )
+                return request_id
+
+            queued = action in self.queued_actions
+            if queued and len(self.queue) >= self.max_queued:
+                self._set_state(request_id, action, self.REJECTED, error="Queue full")
+                return request_id
+
+            self._set_state(request_id, action, self.ACCEPTED, queued=queued)
+            if queued:
+                priority = self.PRIORITY_NAMES.get(
+                    payload.get("priority"), self.queued_actions[action]
+                )
+                heapq.heappush(
+                    self.queue,
+                    (-priority, next(self.sequence), request_id, payload),
+                )
+                self.condition.notify_all()
+                return request_id
+
+        # Quick commands run right away on the caller's thread
+        self._execute(request_id, payload)
+        return request_id
+
+    def cancel(self, request_id):
+        """Cancel a queued or running command, returns True if it was found"""
+        with self.condition:
+            for index, entry in enumerate(self.queue):
+                if entry[2] == request_id:
+                    self.queue.pop(index)
+                    heapq.heapify(self.queue)
+                    self._set_state(request_id, entry[3].get("action"), self.CANCELLED)
+                    return True
+
+            running = self.running
+        if running and running[0] == request_id and self.cancel_running:
+            # The worker reports the final state once the command returns
+            with self.condition:
+                self.states[request_id] = self.CANCELLED
+            self.cancel_running(running[1])
+            return True
+        return False
+
+    def pending(self):
+        """Request IDs waiting in the queue, in the order they will run"""
+        with self.condition:
+            return [entry[2] for entry in sorted(self.queue)]
+
+    def stop(self):
+        """Stop the worker after the running command, dropping queued ones"""
+        with self.condition:
+            self.stopped = True
+            for entry in self.queue:
+                self._set_state(entry[2], entry[3].get("action"), self.CANCELLED)
+            self.queue = []
+            self.condition.notify_all()
+
+    def _worker_loop(self):
+        """Thread function that runs queued commands by priority"""
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                _, _, request_id, payload = heapq.heappop(self.queue)
+                self.running = (request_id, payload)
+                self._set_state(request_id, payload.get("action"), self.STARTED)
+
+            try:
+                self._execute(request_id, payload)
+            finally:
+                with self.condition:
+                    self.running = None
+
+    def _execute(self, request_id, payload):
+        """Run one command and report how it ended"""
+        action = payload.get("action")
+        try:
+            self.handler(payload)
+        except Exception as e:
+            if not isinstance(e, CommandError):
+                logger.exception("Command %s failed: %s", request_id, e)
+            with self.condition:
+                if self.states.get(request_id) == self.CANCELLED:
+                    # Cancelling a running command usually makes it fail
+                    self._ack(request_id, action, self.CANCELLED, error=str(e))
+                else:
+                    self._set_state(request_id, action, self.FAILED, error=str(e))
+            return
+
+        with self.condition:
+            if self.states.get(request_id) == self.CANCELLED:
+                self._ack(request_id, action, self.CANCELLED)
+            else:
+                self._set_state(request_id, action, self.COMPLETED)
+
+    def _set_state(self, request_id, action, status, **details):
+        """Remember a command's state and acknowledge it (holding the condition)"""
+        self.states[request_id] = status
+        self.states.move_to_end(request_id)
+        while len(self.states) > self.history_size:
+            self.states.popitem(last=False)
+        self._ack(request_id, action, status, **details)
+
+    def _ack(self, request_id, action, status, **details):
+        try:
+            self.on_ack(request_id, action, status, **details)
+        except Exception as e:
+            logger.error("Error acknowledging command %s: %s", request_id, e)
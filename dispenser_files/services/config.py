@@ -0,0 +1,333 @@
+import os
+import time
+import threading
+import configparser
+from typing import NamedTuple, Optional, Tuple
+
+from services.log import get_logger
+
+logger = get_logger("config")
+
+
+# Typed sections, the field defaults are the built-in configuration
+class MqttConfig(NamedTuple):
+    broker_host: str = "192.168.1.156"
+    broker_port: int = 1883
+    keepalive: int = 120
+    qos: int = 1
+    reconnect_delay: int = 5
+
+
+class HardwareConfig(NamedTuple):
+    servo_count: int = 6
+    servo_boards: Tuple[int, ...] = (0x40,)  # PCA9685 I2C addresses, 16 servos each
+    servo_power_budget_ma: int = 650  # current available to servos, one at a time
+    servo_current_ma: int = 650  # peak draw of one running servo
+    display_enabled: bool = True
+    rfid_enabled: bool = True
+    audio_enabled: bool = True
+    display_update_interval: float = 1.0  # seconds
+    display_overflow: str = "ellipsis"  # ellipsis or page
+    display_backend: str = "auto"  # auto, ssd1306 or framebuffer
+    rfid_poll_interval: float = 0.1  # seconds, while waiting for a tag
+    rfid_idle_poll_interval: float = 1.0  # seconds, 0 pauses polling
+    rfid_debounce: float = 2.0  # seconds before the same tag reports again
+    rfid_irq_pin: Optional[int] = None  # BCM pin of the MFRC522 IRQ line, if wired
+
+
+class SchedulesConfig(NamedTuple):
+    check_interval: int = 30  # seconds
+    dispense_window: int = 2  # minutes
+    preauth_window: int = 10  # minutes before due time a scan is accepted
+    grace_window: int = 60  # minutes a missed dose is still dispensed as LATE
+    auth_timeout: int = 900  # seconds
+
+
+class LogsConfig(NamedTuple):
+    retention_days: int = 90  # dispense history kept on the device
+    trace_enabled: bool = False  # record hardware timing events, see services/trace.py
+    trace_capacity: int = 4096  # trace records kept, the oldest are overwritten
+    level: str = "info"  # lowest level written, debug shows every poll and publish
+    json: bool = False  # write JSON lines instead of text
+    rate_limit_interval: float = 10.0  # seconds, 0 disables rate limiting
+    rate_limit_burst: int = 5  # records per message and interval below warning
+    rate_limit_error_burst: int = 20  # records per message and interval from warning
+    mqtt_level: str = "off"  # lowest level also published to the hub
+
+
+class Settings(NamedTuple):
+    mqtt: MqttConfig = MqttConfig()
+    hardware: HardwareConfig = HardwareConfig()
+    schedules: SchedulesConfig = SchedulesConfig()
+    logs: LogsConfig = LogsConfig()
+
+
+# Allowed range of numeric settings, (section, key) -> (low, high)
+LIMITS = {
+    ("mqtt", "broker_port"): (1, 65535),
+    ("mqtt", "keepalive"): (5, 3600),
+    ("mqtt", "qos"): (0, 2),
+    ("mqtt", "reconnect_delay"): (1, 600),
+    ("hardware", "servo_count"): (1, 64),
+    ("hardware", "servo_power_budget_ma"): (0, 20000),
+    ("hardware", "servo_current_ma"): (0, 5000),
+    ("hardware", "display_update_interval"): (0.0, 10.0),
+    ("hardware", "rfid_poll_interval"): (0.01, 5.0),
+    ("hardware", "rfid_idle_poll_interval"): (0.0, 60.0),
+    ("hardware", "rfid_debounce"): (0.0, 60.0),
+    ("hardware", "rfid_irq_pin"): (0, 27),
+    ("schedules", "check_interval"): (1, 3600),
+    ("schedules", "dispense_window"): (1, 59),
+    ("schedules", "preauth_window"): (0, 120),
+    ("schedules", "grace_window"): (0, 720),
+    ("schedules", "auth_timeout"): (10, 3600),
+    ("logs", "retention_days"): (0, 3650),
+    ("logs", "trace_capacity"): (256, 1048576),
+    ("logs", "rate_limit_interval"): (0.0, 3600.0),
+    ("logs", "rate_limit_burst"): (1, 1000),
+    ("logs", "rate_limit_error_burst"): (1, 1000),
+}
+
+# Allowed values of string settings
+CHOICES = {
+    ("hardware", "display_overflow"): ("ellipsis", "page"),
+    ("hardware", "display_backend"): ("auto", "ssd1306", "framebuffer"),
+    ("logs", "level"): ("debug", "info", "warning", "error"),
+    ("logs", "mqtt_level"): ("off", "debug", "info", "warning", "error"),
+}
+
+# Sections only read when the service starts
+RESTART_SECTIONS = ("mqtt", "hardware")
+
+# Older environment variable names, still honoured
+ENV_ALIASES = {
+    "MEDIPI_HUB_IP": ("mqtt", "broker_host"),
+    "MEDIPI_MQTT_PORT": ("mqtt", "broker_port"),
+}
+
+
+def parse_value(field_type, value):
+    """Convert a config.ini, environment or MQTT value to a field's type"""
+    if field_type == Optional[int]:
+        if value is None or str(value).strip().lower() in ("", "none"):
+            return None
+        return int(value, 0) if isinstance(value, str) else int(value)
+    if field_type == Tuple[int, ...]:
+        if isinstance(value, str):
+            value = [v for v in value.replace(",", " ").split() if v]
+        return tuple(int(v, 0) if isinstance(v, str) else int(v) for v in value)
+    if field_type is bool:
+        if isinstance(value, str):
+            if value.strip().lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+                raise ValueError(f"not a boolean: {value}")
+            return configparser.ConfigParser.BOOLEAN_STATES[value.strip().lower()]
+        return bool(value)
+    if field_type is int and isinstance(value, str):
+        return int(value, 0)
+    return field_type(value)
+
+
+def format_value(value):
+    """Text form of a setting for config.ini"""
+    if isinstance(value, tuple):
+        return ", ".join(hex(v) for v in value)
+    return "" if value is None else str(value)
+
+
+def build_settings(overrides):
+    """
+    Validated Settings from {section: {key: value}} overrides
+
+    Raises ValueError listing every invalid setting.
+    """
+    errors = []
+    sections = {}
+    for section, section_type in Settings.__annotations__.items():
+        values = {}
+        for key, value in overrides.get(section, {}).items():
+            field_type = section_type.__annotations__.get(key)
+            if field_type is None:
+                errors.append(f"{section}.{key} is not a setting")
+                continue
+            try:
+                value = parse_value(field_type, value)
+            except (TypeError, ValueError):
+                errors.append(f"{section}.{key} has invalid value {value!r}")
+                continue
+
+            limits = LIMITS.get((section, key))
+            if limits and value is not None and not limits[0] <= value <= limits[1]:
+                errors.append(
+                    f"{section}.{key} must be between {limits[0]} and {limits[1]}"
+                )
+                continue
+            choices = CHOICES.get((section, key))
+            if choices and value not in choices:
+                errors.append(f"{section}.{key} must be one of {', '.join(choices)}")
+                continue
+            values[key] = value
+        sections[section] = section_type(**values)
+
+    for section in overrides:
+        if section not in Settings.__annotations__:
+            errors.append(f"{section} is not a config section")
+
+    if errors:
+        raise ValueError("; ".join(errors))
+    return Settings(**sections)
+
+
+def settings_dict(settings):
+    """Plain nested dict of a Settings snapshot"""
+    return {
+        section: {
+            key: list(value) if isinstance(value, tuple) else value
+            for key, value in values._asdict().items()
+        }
+        for section, values in settings._asdict().items()
+    }
+
+
+class Config:
+    """
+    Configuration manager
+
+    Built-in defaults are overridden by config.ini, then by MEDIPI_<SECTION>_<KEY>
+    environment variables. Readers use the immutable snapshot, which reload()
+    and set() replace in one assignment, so a reader never sees a half-applied
+    update.
+    """
+
+    def __init__(self, config_path, events=None):
+        self.config_path = config_path
+        self.events = events
+        self.lock = threading.Lock()  # Serializes reloads and writes
+        self.mtime = None
+        self.watcher = None
+        self.snapshot = None
+        self.reload()
+        if self.snapshot is None:
+            self.snapshot = Settings()
+
+    def get(self, section, key):
+        """Get a configuration value"""
+        return getattr(getattr(self.snapshot, section, None), key, None)
+
+    def read_file(self):
+        """Overrides from config.ini, {section: {key: text}}"""
+        parser = configparser.ConfigParser()
+        if self.config_path and os.path.exists(self.config_path):
+            parser.read(self.config_path)
+        return {section: dict(parser[section]) for section in parser.sections()}
+
+    @staticmethod
+    def read_environment():
+        """Overrides from environment variables, {section: {key: text}}"""
+        overrides = {}
+        for name, (section, key) in ENV_ALIASES.items():
+            if name in os.environ:
+                overrides.setdefault(section, {})[key] = os.environ[name]
+        for section, section_type in Settings.__annotations__.items():
+            for key in section_type._fields:
+                name = f"MEDIPI_{section}_{key}".upper()
+                if name in os.environ:
+                    overrides.setdefault(section, {})[key] = os.environ[name]
+        return overrides
+
+    def reload(self):
+        """Rebuild the snapshot from config.ini and the environment"""
+        with self.lock:
+            self.mtime = self.file_mtime()
+            overrides = self.read_file()
+            for section, values in self.read_environment().items():
+                overrides.setdefault(section, {}).update(values)
+
+            try:
+                settings = build_settings(overrides)
+            except ValueError as e:
+                # Keep running on the last good configuration
+                logger.error("Invalid configuration in %s: %s", self.config_path, e)
+                return False
+
+            changed = self.swap(settings)
+        self.announce(changed)
+        return changed
+
+    def set(self, changes):
+        """
+        Validate {section: {key: value}} changes, persist them to config.ini
+        and apply them
+
+        Raises ValueError if any change is invalid, nothing is applied then.
+        """
+        with self.lock:
+            current = settings_dict(self.snapshot)
+            for section, values in changes.items():
+                current.setdefault(section, {}).update(values)
+            settings = build_settings(current)
+
+            # Write only the changed keys, so other defaults keep tracking the code
+            parser = configparser.ConfigParser()
+            if self.config_path and os.path.exists(self.config_path):
+                parser.read(self.config_path)
+            for section, values in changes.items():
+                if not parser.has_section(section):
+                    parser.add_section(section)
+                for key in values:
+                    parser[section][key] = format_value(
+                        getattr(getattr(settings, section), key)
+                    )
+            if self.config_path:
+                temp_path = f"{self.config_path}.tmp"
+                with open(temp_path, "w") as f:
+                    parser.write(f)
+                os.replace(temp_path, self.config_path)
+                self.mtime = self.file_mtime()
+
+            changed = self.swap(settings)
+        self.announce(changed)
+        return changed
+
+    def swap(self, settings):
+        """Replace the snapshot, returns the changed "section.key" names"""
+        old, self.snapshot = self.snapshot, settings
+        if old is None:
+            return []  # Initial load
+        return [
+            f"{section}.{key}"
+            for section in Settings._fields
+            for key, value in getattr(settings, section)._asdict().items()
+            if getattr(getattr(old, section), key) != value
+        ]
+
+    def announce(self, changed):
+        """Publish config_changed, outside the lock so handlers may use the config"""
+        if changed:
+            logger.info("Configuration changed: %s", ", ".join(changed))
+            if self.events:
+                self.events.publish("config_changed", changed)
+
+    @staticmethod
+    def needs_restart(changed):
+        """True if any changed setting is only read at startup"""
+        return any(name.split(".")[0] in RESTART_SECTIONS for name in changed)
+
+    def file_mtime(self):
+        try:
+            return os.stat(self.config_path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def watch(self, interval=5.0):
+        """Reload whenever config.ini changes on disk"""
+
+        def run():
+            while True:
+                time.sleep(interval)
+                if self.file_mtime() != self.mtime:
+                    logger.info("%s changed, reloading configuration", self.config_path)
+                    self.reload()
+
+        if self.watcher is None:
+            self.watcher = threading.Thread(target=run, daemon=True)
+            self.watcher.start()
@@ -0,0 +1,165 @@
+import heapq
+from collections import namedtuple
+
+# Plan steps, executed in order within a chamber program
+DisplayStep = namedtuple("DisplayStep", "title status details")
+SoundStep = namedtuple("SoundStep", "sound")
+ServoStep = namedtuple("ServoStep", "chamber throttle duration dose doses")
+PauseStep = namedtuple("PauseStep", "duration")
+
+# Steps for one chamber, chamber programs may run concurrently
+ChamberProgram = namedtuple("ChamberProgram", "index chamber medication doses steps")
+
+# Immutable motion plan for one schedule
+DispensePlan = namedtuple(
+    "DispensePlan",
+    "schedule_id programs finish max_concurrent total_doses predicted_duration",
+)
+
+# Units that are not pluralized on the display
+UNCOUNTABLE_UNITS = ("mg", "ml")
+
+# Upper bound on doses per chamber, guards against corrupt payloads
+MAX_DOSES_PER_CHAMBER = 10
+
+
+class PlanError(ValueError):
+    """A schedule that cannot be turned into a safe motion plan"""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def compile_plan(schedule, calibration, servo_count=6, max_concurrent=1):
+    """
+    Turn a schedule into an immutable dispense plan
+
+    The schedule was validated when it was parsed, this checks it against the
+    hardware. Raises PlanError listing every chamber assignment that does not
+    fit, so nothing moves unless the whole schedule is valid.
+    """
+    errors = []
+    parsed = []
+
+    for assignment in schedule.chambers:
+        chamber, doses = assignment.chamber, assignment.dosage_amount
+        if not 1 <= chamber <= servo_count:
+            errors.append(f"chamber {chamber} is outside 1-{servo_count}")
+            continue
+        if not 1 <= doses <= MAX_DOSES_PER_CHAMBER:
+            errors.append(
+                f"chamber {chamber} dosage {doses} is outside 1-{MAX_DOSES_PER_CHAMBER}"
+            )
+            continue
+
+        medication = assignment.medication
+        parsed.append((chamber, doses, medication.name, medication.dosage_unit))
+
+    if errors:
+        raise PlanError(errors)
+
+    programs = []
+    for index, (chamber, doses, med_name, med_unit) in enumerate(parsed):
+        settings = calibration.get(chamber)
+        throttle = settings["throttle"] * settings["direction"]
+        plural = "s" if doses > 1 and med_unit not in UNCOUNTABLE_UNITS else ""
+
+        steps = [
+            DisplayStep(
+                f"DISPENSING            {index + 1}/{len(parsed)}",
+                f"Name: {med_name}",
+                f"Doses: {doses} {med_unit}{plural}",
+            )
+        ]
+        for dose in range(1, doses + 1):
+            steps.append(
+                ServoStep(chamber, throttle, settings["duration"], dose, doses)
+            )
+            # Pause between doses
+            if dose < doses:
+                steps.append(PauseStep(settings["pause"]))
+
+        programs.append(ChamberProgram(index, chamber, med_name, doses, tuple(steps)))
+
+    finish = (SoundStep("success"),)
+    max_concurrent = max(1, int(max_concurrent))
+
+    return DispensePlan(
+        schedule.id,
+        tuple(programs),
+        finish,
+        max_concurrent,
+        sum(program.doses for program in programs),
+        predict_duration(programs, max_concurrent),
+    )
+
+
+def predict_duration(programs, max_concurrent=1):
+    """
+    Predicted wall-clock seconds to run all chamber programs
+
+    Simulates the executor: every program runs at once, servo steps need one
+    of max_concurrent power slots and pauses do not. With a single slot the
+    executor runs programs back to back, so their times simply add up.
+    """
+    if max_concurrent <= 1 or len(programs) <= 1:
+        return round(
+            sum(
+                step.duration
+                for program in programs
+                for step in program.steps
+                if isinstance(step, (ServoStep, PauseStep))
+            ),
+            3,
+        )
+
+    slots = [0.0] * max(1, max_concurrent)  # Time each power slot frees up
+    ready = [(0.0, program.index, 0) for program in programs]
+    heapq.heapify(ready)
+    finish = 0.0
+
+    while ready:
+        at, index, position = heapq.heappop(ready)
+        steps = programs[index].steps
+        if position >= len(steps):
+            finish = max(finish, at)
+            continue
+
+        step = steps[position]
+        if isinstance(step, ServoStep):
+            free_at = heapq.heappop(slots)
+            at = max(at, free_at) + step.duration
+            heapq.heappush(slots, at)
+        elif isinstance(step, PauseStep):
+            at += step.duration
+
+        heapq.heappush(ready, (at, index, position + 1))
+
+    return round(finish, 3)
+
+
+def describe_plan(plan):
+    """JSON-friendly summary of a plan for the hub"""
+    return {
+        "scheduleId": plan.schedule_id,
+        "maxConcurrent": plan.max_concurrent,
+        "totalDoses": plan.total_doses,
+        "predictedDuration": plan.predicted_duration,
+        "chambers": [
+            {
+                "chamber": program.chamber,
+                "medication": program.medication,
+                "doses": program.doses,
+                "duration": round(
+                    sum(
+                        step.duration
+                        for step in program.steps
+                        if isinstance(step, (ServoStep, PauseStep))
+                    ),
+                    3,
+                ),
+            }
+            for program in plan.programs
+        ],
+    }
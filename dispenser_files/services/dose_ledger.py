@@ -0,0 +1,226 @@
+import os
+import mmap
+import struct
+import hashlib
+import threading
+from datetime import date
+
+from services.log import get_logger
+
+logger = get_logger("ledger")
+
+# File layout: header, slot table of schedule ID digests, then a ring of days
+HEADER = struct.Struct("<4sHH")  # magic, slot count, day count
+SLOT = struct.Struct("<8sI")  # schedule ID digest (zeros when free), retired on
+DAY = struct.Struct("<IQQ")  # date ordinal, bitmasks of triggered and completed slots
+MAGIC = b"MPL3"
+FREE = bytes(8)
+
+
+class DoseLedger:
+    """
+    Persistent record of which schedule occurrences have been handled
+
+    Every schedule holds one slot, and each day keeps two bitmasks over the
+    slots: occurrences triggered, and occurrences whose result was reported.
+    One triggered but never completed was cut short by a crash or power
+    loss, see unfinished(). A lookup is a dict access plus a bit test. The file has a
+    fixed size and is memory-mapped, so marks survive a crash and loading
+    at boot reads only a few hundred bytes.
+
+    A schedule dropped from the schedules keeps its slot, retired, until its
+    marks have aged out of the ring of days. If it comes back before then it
+    gets the same slot back, so its doses are never dispensed twice.
+    """
+
+    def __init__(self, path=None, slots=64, days=8):
+        self.path = path
+        self.lock = threading.Lock()  # For thread safety
+        self.slot_count = min(slots, 64)  # One bit per slot in a day mask
+        self.day_count = days
+        self.size = HEADER.size + SLOT.size * self.slot_count + DAY.size * days
+
+        self.file = None
+        if path:
+            self.file = open(path, "a+b")
+            self.file.seek(0, os.SEEK_END)
+            if self.file.tell() != self.size:
+                # Missing, truncated or from another layout, start over
+                self.file.truncate(0)
+                self.file.write(bytes(self.size))
+                self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), self.size)
+        else:
+            self.map = mmap.mmap(-1, self.size)
+
+        if self.map[: HEADER.size] != HEADER.pack(MAGIC, self.slot_count, days):
+            self.map[:] = bytes(self.size)
+            HEADER.pack_into(self.map, 0, MAGIC, self.slot_count, days)
+            self.map.flush()
+
+        # Schedule digest -> slot, and retired digest -> (slot, retired on),
+        # read once from the slot table
+        self.slots = {}
+        self.retired = {}
+        for slot in range(self.slot_count):
+            digest, retired = SLOT.unpack_from(self.map, self.slot_offset(slot))
+            if digest == FREE:
+                continue
+            if retired:
+                self.retired[digest] = (slot, retired)
+            else:
+                self.slots[digest] = slot
+
+    @staticmethod
+    def digest(schedule_id):
+        """Fixed-size key for a schedule ID"""
+        return hashlib.blake2b(str(schedule_id).encode(), digest_size=8).digest()
+
+    def slot_offset(self, slot):
+        return HEADER.size + SLOT.size * slot
+
+    def ring_offset(self, index):
+        return HEADER.size + SLOT.size * self.slot_count + DAY.size * index
+
+    def day_offset(self, day):
+        return self.ring_offset(day.toordinal() % self.day_count)
+
+    def sync(self, schedule_ids, today):
+        """
+        Give every schedule a slot, retiring the slots of removed schedules
+
+        Returns the IDs of schedules that were not tracked before, a schedule
+        that comes back while its slot is retired keeps its marks
+        """
+        wanted = {self.digest(schedule_id): schedule_id for schedule_id in schedule_ids}
+        added = []
+        with self.lock:
+            for digest, slot in list(self.slots.items()):
+                if digest not in wanted:
+                    SLOT.pack_into(
+                        self.map, self.slot_offset(slot), digest, today.toordinal()
+                    )
+                    self.retired[digest] = (slot, today.toordinal())
+                    del self.slots[digest]
+
+            untracked = 0
+            for digest in wanted.keys() - self.slots.keys():
+                known = digest in self.retired
+                if self._assign(digest, today) is None:
+                    untracked += 1
+                elif not known:
+                    added.append(wanted[digest])
+            self.map.flush()
+        if untracked:
+            logger.warning(
+                "Dose ledger is full, %d schedules are not tracked", untracked
+            )
+        return added
+
+    def _assign(self, digest, today):
+        """
+        Slot for a schedule that has none (holding the lock)
+
+        Takes back the schedule's retired slot, else a free one, else the
+        slot retired longest ago once its marks have left the ring of days.
+        Returns None when every slot is in use.
+        """
+        if digest in self.retired:
+            slot, _ = self.retired.pop(digest)
+        else:
+            used = set(self.slots.values())
+            used.update(slot for slot, _ in self.retired.values())
+            free = sorted(set(range(self.slot_count)) - used)
+            if free:
+                slot = free[0]
+            else:
+                expired = [
+                    (retired, old)
+                    for old, (slot, retired) in self.retired.items()
+                    if today.toordinal() - retired >= self.day_count
+                ]
+                if not expired:
+                    return None
+                _, old = min(expired)
+                slot, _ = self.retired.pop(old)
+                self._clear(slot)
+
+        SLOT.pack_into(self.map, self.slot_offset(slot), digest, 0)
+        self.slots[digest] = slot
+        return slot
+
+    def _clear(self, slot):
+        """Clear a slot's bits on every day so another schedule can use it"""
+        bit = ~(1 << slot) & 0xFFFFFFFFFFFFFFFF
+        for index in range(self.day_count):
+            offset = self.ring_offset(index)
+            ordinal, triggered, completed = DAY.unpack_from(self.map, offset)
+            DAY.pack_into(self.map, offset, ordinal, triggered & bit, completed & bit)
+
+    def is_handled(self, schedule_id, day):
+        """True if the schedule's occurrence on day was already triggered"""
+        with self.lock:
+            slot = self.slots.get(self.digest(schedule_id))
+            if slot is None:
+                return False
+            ordinal, triggered, _ = DAY.unpack_from(self.map, self.day_offset(day))
+            return ordinal == day.toordinal() and bool(triggered >> slot & 1)
+
+    def mark(self, schedule_id, day):
+        """Record the schedule's occurrence on day as triggered"""
+        return self._set(self.digest(schedule_id), day, completed=False)
+
+    def complete(self, schedule_id, day):
+        """Record the schedule's occurrence on day as triggered and reported"""
+        return self._set(self.digest(schedule_id), day, completed=True)
+
+    def complete_digest(self, digest, day):
+        """complete() for an occurrence returned by unfinished()"""
+        return self._set(digest, day, completed=True)
+
+    def _set(self, digest, day, completed):
+        with self.lock:
+            slot = self.slots.get(digest)
+            if slot is None and digest in self.retired:
+                slot = self.retired[digest][0]
+            if slot is None:
+                # Schedule dispensed before the ledger was synced with it
+                slot = self._assign(digest, day)
+                if slot is None:
+                    return False
+
+            offset = self.day_offset(day)
+            ordinal, triggered, done = DAY.unpack_from(self.map, offset)
+            if ordinal != day.toordinal():
+                # The ring wrapped onto an older day, start it fresh
+                ordinal, triggered, done = day.toordinal(), 0, 0
+            triggered |= 1 << slot
+            if completed:
+                done |= 1 << slot
+            DAY.pack_into(self.map, offset, ordinal, triggered, done)
+            self.map.flush()
+            return True
+
+    def unfinished(self):
+        """(schedule digest, date) of occurrences triggered but never completed"""
+        with self.lock:
+            owners = {slot: digest for digest, slot in self.slots.items()}
+            owners.update((slot, digest) for digest, (slot, _) in self.retired.items())
+            occurrences = []
+            for index in range(self.day_count):
+                ordinal, triggered, done = DAY.unpack_from(
+                    self.map, self.ring_offset(index)
+                )
+                pending = triggered & ~done
+                for slot, digest in owners.items():
+                    if ordinal and pending >> slot & 1:
+                        occurrences.append((digest, date.fromordinal(ordinal)))
+        return sorted(occurrences, key=lambda occurrence: occurrence[1])
+
+    def close(self):
+        """Flush and release the ledger file"""
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            if self.file:
+                self.file.close()
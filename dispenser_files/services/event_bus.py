@@ -0,0 +1,38 @@
+import threading
+from collections import defaultdict
+
+from services.log import get_logger
+
+logger = get_logger("events")
+
+
+# Dispensers follow event driven architechture with publishers and subscribers
+class EventBus:
+    """Event system for decoupled communication"""
+
+    def __init__(self):
+        self.subscribers = defaultdict(list)
+        self.lock = threading.Lock()  # Subscribers change from several threads
+
+    def subscribe(self, event_type, callback):
+        """Subscribe to an event type, returns a function that unsubscribes"""
+        with self.lock:
+            self.subscribers[event_type].append(callback)
+
+        def unsubscribe():
+            with self.lock:
+                if callback in self.subscribers[event_type]:
+                    self.subscribers[event_type].remove(callback)
+
+        return unsubscribe
+
+    def publish(self, event_type, data=None):
+        """Publish an event"""
+        with self.lock:
+            callbacks = list(self.subscribers[event_type])
+
+        for callback in callbacks:
+            try:
+                callback(data)
+            except Exception as e:
+                logger.exception("Error in event handler for %s: %s", event_type, e)
@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from services.clock import SystemClock
+from services.log import get_logger
+
+logger = get_logger("history")
+
+
+class HistoryStore:
+    """Append-only on-device dispense history backed by SQLite"""
+
+    # Entries returned by one query page at most
+    MAX_PAGE_SIZE = 200
+
+    # Appends between retention sweeps
+    PRUNE_EVERY = 100
+
+    def __init__(self, path=None, retention_days=90, clock=None):
+        self.path = path or ":memory:"
+        self.retention_days = retention_days
+        self.clock = clock or SystemClock()  # Untimed entries and retention
+        self.lock = threading.Lock()  # For thread safety
+        self.appends = 0
+
+        # Shared by the MQTT and scheduler threads, guarded by self.lock
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock:
+            if self.path != ":memory:":
+                # Appends do not block readers and survive power loss
+                self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp REAL NOT NULL,
+                    schedule_id TEXT,
+                    status TEXT,
+                    entry TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS history_timestamp ON history (timestamp);
+                CREATE INDEX IF NOT EXISTS history_schedule ON history (schedule_id);
+                CREATE INDEX IF NOT EXISTS history_status ON history (status);
+                """)
+            self.db.commit()
+        self.prune()
+
+    def entry_time(self, entry):
+        """Epoch seconds of a log entry, from its ISO timestamp if present"""
+        value = entry.get("timestamp")
+        if isinstance(value, (int, float)):
+            return float(value)
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except (TypeError, ValueError):
+            return self.clock.time()
+
+    @staticmethod
+    def filter_time(value, name):
+        """Epoch seconds of a since / until filter, raises ValueError if invalid"""
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} is not a timestamp: {value!r}")
+
+    def append(self, entry):
+        """Record a log entry and return its history ID"""
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO history (timestamp, schedule_id, status, entry) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    self.entry_time(entry),
+                    entry.get("scheduleId"),
+                    entry.get("status"),
+                    json.dumps(entry),
+                ),
+            )
+            self.db.commit()
+            self.appends += 1
+            prune = self.appends % self.PRUNE_EVERY == 0
+
+        if prune:
+            self.prune()
+        return cursor.lastrowid
+
+    def query(
+        self,
+        since=None,
+        until=None,
+        schedule_id=None,
+        status=None,
+        limit=50,
+        cursor=None,
+    ):
+        """
+        Newest-first page of history entries matching the filters
+
+        since / until are epoch seconds or ISO timestamps. Pass the returned
+        cursor back to get the next page; it is None after the last page.
+        Raises ValueError for an invalid filter, limit or cursor.
+
+        Returns:
+            (entries, next_cursor)
+        """
+        clauses = []
+        params = []
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(self.filter_time(since, "since"))
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(self.filter_time(until, "until"))
+        if schedule_id is not None:
+            clauses.append("schedule_id = ?")
+            params.append(schedule_id)
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if cursor is not None:
+            # Keyset pagination, stable while new entries are appended
+            clauses.append("id < ?")
+            params.append(int(cursor))
+
+        limit = max(1, min(int(limit), self.MAX_PAGE_SIZE))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        # Unfiltered pages walk the rowid backwards; filtered ones look the
+        # matches up through an index and sort them by id
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT id, entry FROM history {where} ORDER BY id DESC LIMIT ?",
+                (*params, limit + 1),
+            ).fetchall()
+
+        entries = [{"historyId": row[0], **json.loads(row[1])} for row in rows[:limit]]
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return entries, next_cursor
+
+    def count(self):
+        """Number of entries kept"""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def prune(self):
+        """Drop entries older than the retention period"""
+        if not self.retention_days:
+            return 0
+        cutoff = self.clock.time() - self.retention_days * 86400
+        with self.lock:
+            removed = self.db.execute(
+                "DELETE FROM history WHERE timestamp < ?", (cutoff,)
+            ).rowcount
+            self.db.commit()
+        if removed:
+            logger.info("Pruned %d history entries", removed)
+        return removed
+
+    def close(self):
+        """Close the database"""
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,200 @@
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from datetime import datetime
+
+# Every project logger lives under this one, e.g. "medipi.servo"
+ROOT = "medipi"
+
+# Records waiting for the writer thread at most, further ones are dropped
+QUEUE_SIZE = 1000
+
+
+def get_logger(name):
+    """Logger for one part of the dispenser"""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most burst records per key every interval seconds
+
+    The key is the record's "key" extra if given, otherwise its message
+    template, so the same message with different values counts as one.
+    The next record let through after a quiet spell reports how many were
+    suppressed. Warnings and above get the larger error_burst, so a failure
+    is always seen but a failing hot loop cannot flood the log.
+    """
+
+    def __init__(self, interval=10.0, burst=5, error_burst=20):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.error_burst = error_burst
+        self.lock = threading.Lock()  # For thread safety
+        self.windows = {}  # key -> [window start, records let through, suppressed]
+
+    def filter(self, record):
+        if not self.interval:
+            return True
+        burst = self.error_burst if record.levelno >= logging.WARNING else self.burst
+        key = getattr(record, "key", None) or (record.name, record.msg)
+        now = record.created
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self.windows[key] = [now, 1, 0]
+                if len(self.windows) > 1024:
+                    # Forget keys whose window is long over
+                    self.windows = {
+                        k: w
+                        for k, w in self.windows.items()
+                        if now - w[0] < self.interval
+                    }
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class TextFormatter(logging.Formatter):
+    """Single-line text, with a count of suppressed repeats"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} ({suppressed} similar suppressed)" if suppressed else text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, for log shipping"""
+
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records while the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class MqttHandler(logging.Handler):
+    """Ships formatted records through a publish(entry) function"""
+
+    def __init__(self, publish, level=logging.WARNING):
+        super().__init__(level)
+        self.publish = publish
+        self.setFormatter(JsonFormatter())
+
+    def emit(self, record):
+        # Records logged by publish itself run on this thread, shipping them
+        # would feed every publish back into another one
+        if record.thread == threading.get_ident():
+            return
+        try:
+            self.publish(json.loads(self.format(record)))
+        except Exception:
+            self.handleError(record)
+
+
+class LogService:
+    """
+    Asynchronous logging for the whole project
+
+    Callers only filter and enqueue records, a listener thread formats and
+    writes them, so a slow console, journald or SD card never blocks a
+    hardware thread.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.rate_limit = RateLimitFilter()
+        self.handler.addFilter(self.rate_limit)
+        self.console = logging.StreamHandler()
+        self.console.setFormatter(TextFormatter())
+        self.mqtt = None
+        self.listener = None
+
+        logger = logging.getLogger(ROOT)
+        logger.addHandler(self.handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    def configure(
+        self, level="INFO", json_output=False, interval=10.0, burst=5, error_burst=20
+    ):
+        """Apply logging settings, safe to call again at runtime"""
+        logging.getLogger(ROOT).setLevel(level.upper())
+        self.console.setFormatter(JsonFormatter() if json_output else TextFormatter())
+        self.rate_limit.interval = interval
+        self.rate_limit.burst = burst
+        self.rate_limit.error_burst = error_burst
+
+    def start(self):
+        """Start the writer thread"""
+        if self.listener is None:
+            handlers = [self.console] + ([self.mqtt] if self.mqtt else [])
+            self.listener = logging.handlers.QueueListener(
+                self.queue, *handlers, respect_handler_level=True
+            )
+            self.listener.start()
+
+    def ship(self, publish, level="WARNING"):
+        """Also send records at or above level through publish(entry)"""
+        self.unship()
+        self.mqtt = MqttHandler(publish, level.upper())
+        if self.listener is not None:
+            self.listener.handlers = self.listener.handlers + (self.mqtt,)
+
+    def unship(self):
+        """Stop sending records through publish"""
+        if self.mqtt is None:
+            return
+        if self.listener is not None:
+            self.listener.handlers = tuple(
+                h for h in self.listener.handlers if h is not self.mqtt
+            )
+        self.mqtt = None
+
+    def stop(self):
+        """Write out queued records and stop the writer thread"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+# Set up and started once at import, so scripts log without any setup
+service = LogService()
+service.start()
+atexit.register(service.stop)
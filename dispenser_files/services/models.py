@@ -0,0 +1,277 @@
+import uuid
+from datetime import datetime
+
+
+class ScheduleError(ValueError):
+    """A schedule payload that does not describe a valid schedule"""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def parse_int(value, name, errors, low=None, high=None):
+    """Integer field value, or None with a message added to errors"""
+    try:
+        # True and 2.5 would otherwise pass as 1 and 2
+        if isinstance(value, bool) or (
+            isinstance(value, float) and not value.is_integer()
+        ):
+            raise ValueError(value)
+        number = int(value)
+    except (TypeError, ValueError):
+        errors.append(f"{name} is not an integer: {value!r}")
+        return None
+    if (low is not None and number < low) or (high is not None and number > high):
+        errors.append(f"{name} {number} is outside {low}-{high}")
+        return None
+    return number
+
+
+def parse_date(value, name, errors):
+    """Date of an ISO date or timestamp field, None when missing"""
+    if value in (None, ""):
+        return None
+    try:
+        # fromisoformat only accepts a trailing Z from Python 3.11
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).date()
+    except ValueError:
+        errors.append(f"{name} is not an ISO date: {value!r}")
+        return None
+
+
+class Medication:
+    """Medication loaded in a chamber"""
+
+    __slots__ = ("id", "name", "dosage_unit")
+
+    def __init__(self, id=None, name="Unknown Medication", dosage_unit="unit"):
+        self.id = id
+        self.name = name
+        self.dosage_unit = dosage_unit
+
+    @classmethod
+    def from_dict(cls, data, errors, name="medication"):
+        if not isinstance(data, dict):
+            errors.append(f"{name} is not an object")
+            return None
+        return cls(
+            data.get("id"),
+            str(data.get("name") or "Unknown Medication"),
+            str(data.get("dosageUnit") or "unit"),
+        )
+
+    def to_dict(self):
+        return {"id": self.id, "name": self.name, "dosageUnit": self.dosage_unit}
+
+    def __repr__(self):
+        return f"Medication({self.name!r}, {self.dosage_unit!r})"
+
+
+class ChamberAssignment:
+    """Doses of one medication dispensed from one chamber"""
+
+    __slots__ = ("chamber", "dosage_amount", "medication")
+
+    def __init__(self, chamber, dosage_amount=1, medication=None):
+        self.chamber = chamber
+        self.dosage_amount = dosage_amount
+        self.medication = medication or Medication()
+
+    @classmethod
+    def from_dict(cls, data, errors, name="assignment"):
+        if not isinstance(data, dict):
+            errors.append(f"{name} is not an object")
+            return None
+        count = len(errors)
+        chamber = parse_int(data.get("chamber"), f"{name} chamber", errors, low=1)
+        doses = parse_int(
+            data.get("dosageAmount", 1), f"{name} dosage amount", errors, low=1
+        )
+        medication = None
+        if data.get("medication") is not None:
+            medication = Medication.from_dict(
+                data["medication"], errors, f"{name} medication"
+            )
+        if len(errors) > count:
+            return None
+        return cls(chamber, doses, medication)
+
+    def to_dict(self):
+        return {
+            "chamber": self.chamber,
+            "dosageAmount": self.dosage_amount,
+            "medication": self.medication.to_dict(),
+        }
+
+    def __repr__(self):
+        return (
+            f"ChamberAssignment({self.chamber}, {self.dosage_amount}, "
+            f"{self.medication!r})"
+        )
+
+
+class Schedule:
+    """
+    Daily medication schedule for one patient, parsed once at ingest
+
+    due_at and late are only set on the copy made for one occurrence, see
+    occurrence().
+    """
+
+    __slots__ = (
+        "id",
+        "time",
+        "patient_name",
+        "patient_id",
+        "start_date",
+        "end_date",
+        "is_active",
+        "rfid_tag",
+        "rfid_tags",
+        "medications",
+        "chambers",
+        "due_at",
+        "late",
+    )
+
+    def __init__(
+        self,
+        id,
+        time=0,
+        patient_name="Patient",
+        patient_id="",
+        start_date=None,
+        end_date=None,
+        is_active=True,
+        rfid_tag="",
+        rfid_tags=(),
+        medications=(),
+        chambers=(),
+        due_at=None,
+        late=False,
+    ):
+        self.id = id
+        self.time = time  # Hour of the day the dose is due
+        self.patient_name = patient_name
+        self.patient_id = patient_id
+        self.start_date = start_date
+        self.end_date = end_date
+        self.is_active = is_active
+        self.rfid_tag = rfid_tag
+        self.rfid_tags = tuple(rfid_tags)
+        self.medications = tuple(medications)  # Older format, kept for the hub
+        self.chambers = tuple(chambers)
+        self.due_at = due_at
+        self.late = late
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Parse and validate a schedule in the hub's wire format
+
+        Raises ScheduleError listing every invalid field.
+        """
+        if not isinstance(data, dict):
+            raise ScheduleError(["schedule is not an object"])
+        errors = []
+
+        # Schedules sent without an ID get one, as they always have
+        schedule_id = data.get("id")
+        if schedule_id in (None, ""):
+            schedule_id = uuid.uuid4()
+        hour = parse_int(data.get("time", 0), "time", errors, low=0, high=23)
+
+        rfid_tags = data.get("rfidTags") or []
+        if not isinstance(rfid_tags, list):
+            errors.append("rfidTags is not a list")
+            rfid_tags = []
+
+        medications = data.get("medications") or []
+        chambers = data.get("chambers") or []
+        for field, value in (("medications", medications), ("chambers", chambers)):
+            if not isinstance(value, list):
+                errors.append(f"{field} is not a list")
+        if not isinstance(medications, list):
+            medications = []
+        if not isinstance(chambers, list):
+            chambers = []
+
+        schedule = cls(
+            str(schedule_id),
+            hour,
+            str(data.get("patientName") or "Patient"),
+            str(data.get("patientId") or ""),
+            parse_date(data.get("startDate"), "startDate", errors),
+            parse_date(data.get("endDate"), "endDate", errors),
+            bool(data.get("isActive", True)),
+            str(data.get("rfidTag") or ""),
+            [str(tag) for tag in rfid_tags],
+            [
+                Medication.from_dict(m, errors, f"medication {position}")
+                for position, m in enumerate(medications, start=1)
+            ],
+            [
+                ChamberAssignment.from_dict(a, errors, f"assignment {position}")
+                for position, a in enumerate(chambers, start=1)
+            ],
+        )
+
+        if errors:
+            raise ScheduleError(errors)
+        return schedule
+
+    def to_dict(self):
+        """Wire format, as received from the hub"""
+        return {
+            "id": self.id,
+            "time": self.time,
+            "patientName": self.patient_name,
+            "patientId": self.patient_id,
+            "startDate": self.start_date.isoformat() if self.start_date else None,
+            "endDate": self.end_date.isoformat() if self.end_date else None,
+            "isActive": self.is_active,
+            "rfidTag": self.rfid_tag,
+            "rfidTags": list(self.rfid_tags),
+            "medications": [m.to_dict() for m in self.medications],
+            "chambers": [a.to_dict() for a in self.chambers],
+        }
+
+    def active_on(self, day):
+        """True if the schedule is due on a date"""
+        if not self.is_active:
+            return False
+        if self.start_date and day < self.start_date:
+            return False
+        return not (self.end_date and day > self.end_date)
+
+    def occurrence(self, due_at, late=False):
+        """Copy of the schedule for one due time"""
+        copy = Schedule.__new__(Schedule)
+        for name in self.__slots__:
+            setattr(copy, name, getattr(self, name))
+        copy.due_at = due_at
+        copy.late = late
+        return copy
+
+    def __repr__(self):
+        return f"Schedule({self.id!r}, time={self.time}, chambers={len(self.chambers)})"
+
+
+def parse_schedules(payload):
+    """
+    Valid schedules of a list payload, and the errors of the rest
+
+    Returns:
+        (schedules, errors) where errors maps a schedule's position or ID to
+        its ScheduleError messages
+    """
+    schedules = []
+    errors = {}
+    for position, data in enumerate(payload, start=1):
+        try:
+            schedules.append(Schedule.from_dict(data))
+        except ScheduleError as e:
+            key = data.get("id") if isinstance(data, dict) else None
+            errors[str(key or position)] = e.errors
+    return schedules, errors
@@ -0,0 +1,159 @@
+import os
+import json
+import hashlib
+import threading
+
+from services.log import get_logger
+
+logger = get_logger("tags")
+
+
+class TagIndex:
+    """Authorized RFID tags keyed by a salted hash of the normalized tag"""
+
+    # Matches the RfidType enum on the hub
+    PATIENT = "PATIENT"
+    ADMIN = "ADMIN"
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()  # For thread safety
+        self.salt = None
+
+        # Tags pushed by the hub with sync_tags, persisted as digests only
+        self.synced_patients = {}  # digest -> frozenset of patient keys
+        self.admin_tags = frozenset()
+
+        # Tags taken from the schedules, rebuilt on every schedule update
+        self.schedule_patients = {}
+
+        self.load()
+        if self.salt is None:
+            self.salt = os.urandom(16)
+
+    @staticmethod
+    def normalize(tag):
+        """Canonical form of a tag ID or tag text"""
+        return str(tag).strip().upper()
+
+    @staticmethod
+    def patient_key(schedule):
+        """Key identifying who may authorize a schedule"""
+        return schedule.patient_id or schedule.id
+
+    def digest(self, tag):
+        """Salted hash of a normalized tag, the only form that is kept"""
+        return hashlib.blake2b(
+            self.normalize(tag).encode(), key=self.salt, digest_size=16
+        ).hexdigest()
+
+    def mask(self, tag):
+        """Short, non-reversible tag reference that is safe to log"""
+        return f"tag:{self.digest(tag)[:8]}" if tag else "tag:none"
+
+    def schedule_tags(self, schedule):
+        """Raw tags listed on a schedule (rfidTag plus any rfidTags)"""
+        tags = list(schedule.rfid_tags)
+        if schedule.rfid_tag:
+            tags.append(schedule.rfid_tag)
+        return [t for t in tags if self.normalize(t)]
+
+    def sync_schedules(self, schedules):
+        """Rebuild the patient tags taken from the schedules"""
+        index = {}
+        for schedule in schedules:
+            key = self.patient_key(schedule)
+            for tag in self.schedule_tags(schedule):
+                index.setdefault(self.digest(tag), set()).add(key)
+
+        frozen = {digest: frozenset(keys) for digest, keys in index.items()}
+        with self.lock:
+            self.schedule_patients = frozen
+
+    def sync_tags(self, tags):
+        """Replace the hub-managed tags, a list of {rfidTag, type, patientId}"""
+        patients = {}
+        admins = set()
+        for entry in tags:
+            tag = entry.get("rfidTag")
+            if not tag or not self.normalize(tag):
+                continue
+            if entry.get("type") == self.ADMIN:
+                admins.add(self.digest(tag))
+            elif entry.get("patientId"):
+                patients.setdefault(self.digest(tag), set()).add(entry["patientId"])
+
+        with self.lock:
+            self.synced_patients = {d: frozenset(k) for d, k in patients.items()}
+            self.admin_tags = frozenset(admins)
+
+        self.save()
+        return len(patients) + len(admins)
+
+    def authorize(self, tag_id, tag_text, schedule):
+        """
+        Check a scanned tag against a schedule
+
+        Returns TagIndex.ADMIN, TagIndex.PATIENT or None if the tag is not allowed
+        """
+        digests = {self.digest(tag_id)}
+        if tag_text and self.normalize(tag_text):
+            digests.add(self.digest(tag_text))
+
+        with self.lock:
+            admin_tags = self.admin_tags
+            schedule_patients = self.schedule_patients
+            synced_patients = self.synced_patients
+
+        if digests & admin_tags:
+            return self.ADMIN
+
+        key = self.patient_key(schedule)
+        for digest in digests:
+            if key in schedule_patients.get(digest, ()) or key in synced_patients.get(
+                digest, ()
+            ):
+                return self.PATIENT
+
+        # Schedules sent directly with a dispense command are not in the index
+        if digests & {self.digest(tag) for tag in self.schedule_tags(schedule)}:
+            return self.PATIENT
+
+        return None
+
+    def load(self):
+        """Load the salt and hub-managed tag digests from disk"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.salt = bytes.fromhex(data["salt"])
+            self.admin_tags = frozenset(data.get("admin", []))
+            self.synced_patients = {
+                digest: frozenset(keys)
+                for digest, keys in data.get("patients", {}).items()
+            }
+        except Exception as e:
+            logger.error("Error loading tag index: %s", e)
+
+    def save(self):
+        """Persist the salt and hub-managed tag digests"""
+        if not self.path:
+            return False
+        try:
+            with self.lock:
+                data = {
+                    "salt": self.salt.hex(),
+                    "admin": sorted(self.admin_tags),
+                    "patients": {
+                        digest: sorted(keys)
+                        for digest, keys in self.synced_patients.items()
+                    },
+                }
+            with open(self.path, "w") as f:
+                json.dump(data, f)
+            return True
+        except Exception as e:
+            logger.error("Error saving tag index: %s", e)
+            return False
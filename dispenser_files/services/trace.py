@@ -0,0 +1,168 @@
+import time
+import struct
+import threading
+from array import array
+
+# Event codes, the arg recorded with each is noted alongside
+SERVO_START = 1  # servo number
+SERVO_STOP = 2  # servo number
+DISPLAY_PUSH = 3  # push duration in microseconds, recorded when it ends
+TONE_START = 4  # frequency in Hz
+TONE_STOP = 5  # 0
+RFID_POLL = 6  # poll duration in microseconds, recorded when it ends
+SCHEDULE_TRIGGER = 7  # hour the dose is due
+DISPENSE_START = 8  # doses in the plan
+DISPENSE_END = 9  # doses dispensed
+AUTH_START = 10  # 0
+AUTH_END = 11  # 1 if authorized
+
+# Code -> (name, Chrome phase, lane), a lane of None puts each servo in its own
+EVENTS = {
+    SERVO_START: ("servo", "B", None),
+    SERVO_STOP: ("servo", "E", None),
+    DISPLAY_PUSH: ("display push", "X", "display"),
+    TONE_START: ("tone", "B", "buzzer"),
+    TONE_STOP: ("tone", "E", "buzzer"),
+    RFID_POLL: ("rfid poll", "X", "rfid"),
+    SCHEDULE_TRIGGER: ("schedule trigger", "i", "schedule"),
+    DISPENSE_START: ("dispense", "B", "schedule"),
+    DISPENSE_END: ("dispense", "E", "schedule"),
+    AUTH_START: ("authentication", "B", "schedule"),
+    AUTH_END: ("authentication", "E", "schedule"),
+}
+LANES = ("schedule", "display", "buzzer", "rfid")  # Servo lanes follow
+
+# Dump file layout: header, then records oldest first
+HEADER = struct.Struct("<4sII")  # magic, record count, capacity
+OFFSET = struct.Struct("<q")  # epoch ns minus perf_counter ns when dumped
+RECORD = struct.Struct("<qHq")  # perf_counter ns, event code, arg
+MAGIC = b"MPT1"
+
+
+class TraceRecorder:
+    """
+    Low-overhead recorder of hardware timing events
+
+    Records (timestamp, event code, arg) into preallocated arrays used as a
+    ring buffer, so recording never allocates and the newest records
+    overwrite the oldest. Timestamps come from perf_counter_ns, the trace
+    measures the real hardware even when the dispenser runs on a virtual
+    clock. record() returns at once while disabled.
+    """
+
+    def __init__(self, capacity=4096, enabled=False):
+        self.lock = threading.Lock()  # For thread safety
+        self.enabled = enabled
+        self.resize(capacity)
+
+    def resize(self, capacity):
+        """Reallocate the ring buffer, dropping every record"""
+        with self.lock:
+            self.capacity = max(1, int(capacity))
+            self.times = array("q", bytes(8 * self.capacity))
+            self.codes = array("H", bytes(2 * self.capacity))
+            self.args = array("q", bytes(8 * self.capacity))
+            self.total = 0  # Records written since the last clear
+
+    def record(self, code, arg=0):
+        """Record an event if tracing is enabled"""
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        with self.lock:
+            slot = self.total % self.capacity
+            self.times[slot] = now
+            self.codes[slot] = code
+            self.args[slot] = arg
+            self.total += 1
+
+    def clear(self):
+        with self.lock:
+            self.total = 0
+
+    def records(self):
+        """Buffered records, oldest first, as (perf_counter ns, code, arg)"""
+        with self.lock:
+            count = min(self.total, self.capacity)
+            first = self.total - count
+            slots = [(first + i) % self.capacity for i in range(count)]
+            return [(self.times[s], self.codes[s], self.args[s]) for s in slots]
+
+    def dump(self, path):
+        """Write the buffered records to a binary file, returns the count"""
+        records = self.records()
+        offset = time.time_ns() - time.perf_counter_ns()
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(records), self.capacity))
+            f.write(OFFSET.pack(offset))
+            for record in records:
+                f.write(RECORD.pack(*record))
+        return len(records)
+
+
+def load(path):
+    """
+    Read a dump file written by TraceRecorder.dump
+
+    Returns:
+        (epoch_offset_ns, records)
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, count, _ = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a MediPi trace dump")
+    (offset,) = OFFSET.unpack_from(data, HEADER.size)
+    start = HEADER.size + OFFSET.size
+    records = [RECORD.unpack_from(data, start + RECORD.size * i) for i in range(count)]
+    return offset, records
+
+
+def to_chrome(records, offset=0):
+    """
+    Chrome trace JSON (chrome://tracing, Perfetto) for a list of records
+
+    Each component gets its own lane, and each servo a lane of its own, so
+    concurrent chambers show side by side.
+    """
+    events = []
+    lanes = {name: tid for tid, name in enumerate(LANES, 1)}
+    for timestamp, code, arg in records:
+        if code not in EVENTS:
+            continue
+        name, phase, lane = EVENTS[code]
+        if lane is None:
+            lane = f"servo {arg}"
+        tid = lanes.setdefault(lane, len(lanes) + 1)
+
+        event = {
+            "name": name,
+            "ph": phase,
+            "pid": 1,
+            "tid": tid,
+            "ts": (timestamp + offset) / 1000,
+            "args": {"arg": arg},
+        }
+        if phase == "X":
+            # Recorded when the operation ended, arg is its duration in us
+            event["ts"] -= arg
+            event["dur"] = arg
+        elif phase == "i":
+            event["s"] = "t"
+        events.append(event)
+
+    for lane, tid in lanes.items():
+        events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": 1,
+                "tid": tid,
+                "args": {"name": lane},
+            }
+        )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+# Shared recorder the controllers write to, see MediPiDispenser for toggling
+recorder = TraceRecorder()
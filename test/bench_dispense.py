@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+# Make the dispenser controllers importable when run from the repo root
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dispenser_files")
+)
+
+from controllers.servo_controller import ServoController
+from controllers.dispense_executor import DispenseExecutor
+from controllers.servo_calibration import DEFAULT_CALIBRATION, CalibrationStore
+from services.dispense_plan import compile_plan
+from services.models import Schedule
+from services.clock import SystemClock, VirtualClock
+from services import log
+
+# Keep controller logs out of the results table
+log.service.configure("critical")
+
+# Chamber -> doses for each sample, matching the samples in test_dispenser.py
+SAMPLES = {
+    "single": {1: 1},
+    "odd": {1: 1, 3: 1, 5: 2},
+    "all": {1: 1, 2: 1, 3: 1, 4: 1, 5: 1, 6: 1},
+    "realistic": {1: 5, 2: 2, 4: 1},
+    "heavy": {1: 3, 2: 3, 3: 2, 4: 2, 5: 2, 6: 1},
+}
+
+# Set up argument parser
+parser = argparse.ArgumentParser(
+    description="Compare serial and concurrent dispense times (simulated servos "
+    "unless run on a dispenser)"
+)
+parser.add_argument(
+    "--sample", "-s", choices=SAMPLES.keys(), help="Only run one sample schedule"
+)
+parser.add_argument(
+    "--budget", type=float, default=2000, help="Servo power budget in mA"
+)
+parser.add_argument(
+    "--servo-current", type=float, default=650, help="Peak draw of one servo in mA"
+)
+parser.add_argument(
+    "--scale",
+    type=float,
+    help="Multiply servo run and pause times (default 0.1, 1.0 with --virtual)",
+)
+parser.add_argument(
+    "--virtual",
+    action="store_true",
+    help="Run on a virtual clock, real timing measured instantly",
+)
+
+args = parser.parse_args()
+if args.scale is None:
+    args.scale = 1.0 if args.virtual else 0.1
+clock = VirtualClock() if args.virtual else SystemClock()
+
+with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+    io.StringIO()
+):
+    servo = ServoController(clock=clock)
+
+max_concurrent = DispenseExecutor.concurrency_for_budget(
+    args.budget, args.servo_current, servo.servo_count
+)
+print(f"Servo budget {args.budget:.0f} mA allows {max_concurrent} servos at once")
+print(f"Timing scale {args.scale} (throttle 0.3, run 1.1 s, pause 1.0 s)\n")
+
+
+# Default calibration for every chamber, with run and pause times scaled
+calibration = CalibrationStore()
+for chamber in range(1, servo.servo_count + 1):
+    calibration.set(
+        chamber,
+        {
+            "duration": DEFAULT_CALIBRATION["duration"] * args.scale,
+            "pause": DEFAULT_CALIBRATION["pause"] * args.scale,
+        },
+    )
+
+
+def timed_run(sample, concurrency):
+    schedule = Schedule.from_dict(
+        {
+            "id": "bench",
+            "chambers": [
+                {"chamber": chamber, "dosageAmount": doses}
+                for chamber, doses in sample.items()
+            ],
+        }
+    )
+    plan = compile_plan(schedule, calibration, max_concurrent=concurrency)
+    executor = DispenseExecutor(servo)
+    start = clock.monotonic()
+    with contextlib.redirect_stdout(io.StringIO()):
+        successful, _ = executor.run(plan)
+    elapsed = clock.monotonic() - start
+    return elapsed / args.scale, plan.predicted_duration / args.scale, successful
+
+
+samples = {args.sample: SAMPLES[args.sample]} if args.sample else SAMPLES
+print(
+    f"{'sample':12} {'doses':>5} {'serial s':>9} {'predicted':>9} "
+    f"{'concurrent s':>13} {'predicted':>9} {'speedup':>8}"
+)
+for name, sample in samples.items():
+    serial, serial_predicted, doses = timed_run(sample, 1)
+    concurrent, concurrent_predicted, _ = timed_run(sample, max_concurrent)
+    print(
+        f"{name:12} {doses:5d} {serial:9.2f} {serial_predicted:9.2f} "
+        f"{concurrent:13.2f} {concurrent_predicted:9.2f} "
+        f"{serial / concurrent:7.2f}x"
+    )
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageChops
+
+# Make the dispenser controllers importable when run from the repo root
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dispenser_files")
+)
+
+from controllers.display_controller import DisplayController
+from controllers.throttled_display import ThrottledDisplay
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+# Representative screens: (title, status, details, progress)
+SCREENS = {
+    "default": ("MediPi", "Patient: Bing Chillin", "Schedules: 3 - Med due at 12:00"),
+    "auth_needed": ("AUTH NEEDED", "Hello Bing Chillin", "Scan your tag"),
+    "dispensing": (
+        "DISPENSING            1/3",
+        "Name: Lisinopril",
+        "Doses: 5 pills",
+    ),
+    "long_name": (
+        "DISPENSING            2/3",
+        "Name: Hydrochlorothiazide Extended Release",
+        "Doses: 2 pills - take with food and a full glass of water",
+    ),
+    "progress": ("MediPi", "Initializing", "Starting hardware...", 40),
+    "dispense_progress": (
+        "DISPENSING            2/3",
+        "Name: Metformin",
+        "Doses: 2 pills - take with food",
+        63,
+    ),
+    "error": ("ERROR", "check_schedules", "Connection refused by broker"),
+}
+
+# Set up argument parser
+parser = argparse.ArgumentParser(
+    description="Benchmark OLED rendering and check screens against golden images"
+)
+parser.add_argument(
+    "--iterations", "-n", type=int, default=500, help="Iterations per benchmark"
+)
+parser.add_argument(
+    "--update-golden",
+    action="store_true",
+    help="Regenerate the golden images instead of comparing against them",
+)
+parser.add_argument(
+    "--dump", "-d", help="Directory to write a PNG of every rendered screen"
+)
+
+args = parser.parse_args()
+
+controller = DisplayController(backend=DisplayController.BACKEND_FRAMEBUFFER)
+framebuffer = controller.display
+
+# Benchmark image creation, first with a cold layout cache and then warm
+print(f"\ncreate_display_image ({args.iterations} iterations per screen)")
+for name, screen in SCREENS.items():
+    controller.layout._cache.clear()
+    start = time.perf_counter()
+    controller.create_display_image(*screen)
+    cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        controller.create_display_image(*screen)
+    warm = (time.perf_counter() - start) / args.iterations
+
+    print(f"  {name:12} cold {cold * 1e6:8.1f} us   warm {warm * 1e6:8.1f} us")
+
+# Benchmark the full push path straight into the framebuffer
+framebuffer.reset_stats()
+screens = list(SCREENS.values())
+with contextlib.redirect_stdout(io.StringIO()):
+    for i in range(args.iterations):
+        controller.update_display(*screens[i % len(screens)])
+stats = framebuffer.stats()
+print(f"\nDirect push: {stats['frames']} frames at {stats['fps']:.0f} fps")
+print(
+    f"  avg push {stats['avg_push_ms']:.3f} ms   max push {stats['max_push_ms']:.3f} ms"
+)
+
+# Benchmark the render thread with coalescing and no frame interval
+framebuffer.reset_stats()
+renderer = ThrottledDisplay(controller, min_interval=0)
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    for i in range(args.iterations):
+        renderer.update_display(*screens[i % len(screens)])
+    renderer.stop(timeout=10)
+elapsed = time.perf_counter() - start
+print(
+    f"\nRender thread: {args.iterations} requests in {elapsed * 1000:.1f} ms, "
+    f"{framebuffer.stats()['frames']} frames pushed after coalescing"
+)
+
+# Golden image comparison
+print()
+os.makedirs(GOLDEN_DIR, exist_ok=True)
+if args.dump:
+    os.makedirs(args.dump, exist_ok=True)
+
+failures = 0
+for name, screen in SCREENS.items():
+    with contextlib.redirect_stdout(io.StringIO()):
+        controller.update_display(*screen)
+    golden_path = os.path.join(GOLDEN_DIR, f"{name}.pbm")
+
+    if args.dump:
+        framebuffer.dump_png(os.path.join(args.dump, f"{name}.png"))
+
+    if args.update_golden:
+        framebuffer.dump_pbm(golden_path)
+        print(f"Updated golden image: {golden_path}")
+        continue
+
+    if not os.path.exists(golden_path):
+        print(f"MISSING  {name}: no golden image, run with --update-golden")
+        failures += 1
+        continue
+
+    golden = Image.open(golden_path).convert("1")
+    diff = ImageChops.logical_xor(framebuffer.last_frame(), golden)
+    changed = diff.convert("L").histogram()[255]
+    if changed:
+        print(f"FAIL     {name}: {changed} pixels differ from golden image")
+        failures += 1
+    else:
+        print(f"OK       {name}")
+
+sys.exit(1 if failures else 0)
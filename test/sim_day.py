@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# The dispenser keeps its files under ~/Desktop/MediPi, use a scratch home so
+# a simulation never touches the schedules, ledger or history of a real device
+os.environ["HOME"] = tempfile.mkdtemp(prefix="medipi-sim-")
+
+# Make the dispenser controllers importable when run from the repo root
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dispenser_files")
+)
+
+from services import log
+
+# Dispenser logs are only shown with --verbose, see below
+log.service.configure("critical")
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import medipi_dispenser
+from services.clock import VirtualClock
+from services.tag_index import TagIndex
+from services.models import Schedule
+
+# Set up argument parser
+parser = argparse.ArgumentParser(
+    description="Run the schedule checker over simulated days on a virtual clock"
+)
+parser.add_argument(
+    "--days", type=float, default=1, help="Simulated days to run (default 1)"
+)
+parser.add_argument(
+    "--hours",
+    default="8,12,18,22",
+    help="Comma-separated hours schedules are due at (default 8,12,18,22)",
+)
+parser.add_argument(
+    "--start",
+    default="23:30",
+    help="Time of day the simulation starts, HH:MM (default 23:30 to cross midnight)",
+)
+parser.add_argument(
+    "--scan",
+    action="store_true",
+    help="Patient scans before every dose, otherwise authentication times out",
+)
+parser.add_argument(
+    "--verbose", "-v", action="store_true", help="Show the dispenser output"
+)
+
+args = parser.parse_args()
+
+hour, minute = (int(part) for part in args.start.split(":"))
+start = datetime.now().replace(hour=hour, minute=minute, second=0, microsecond=0)
+end = start + timedelta(days=args.days)
+clock = VirtualClock(start)
+
+output = sys.stdout if args.verbose else io.StringIO()
+with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+    dispenser = medipi_dispenser.MediPiDispenser(clock)
+    dispenser.schedules = [
+        Schedule.from_dict(
+            {
+                "id": f"sim-{due_hour:02d}",
+                "patientName": "Simulated Patient",
+                "time": due_hour,
+                "isActive": True,
+                "startDate": (start - timedelta(days=1)).isoformat(),
+                "chambers": [{"chamber": 1, "dosageAmount": 1}],
+            }
+        )
+        for due_hour in (int(h) for h in args.hours.split(","))
+    ]
+    dispenser.sync_ledger()
+# The dispenser applied its configured log level, override it
+log.service.configure("debug" if args.verbose else "critical")
+
+if args.scan:
+    # Pre-authorize each occurrence ahead of the dispenser's own handler
+    def scan(schedule):
+        due = schedule.due_at
+        key = (schedule.id, due.date(), due.hour)
+        dispenser.preauthorized[key] = TagIndex.PATIENT
+
+    with dispenser.events.lock:
+        dispenser.events.subscribers["schedule_due"].insert(0, scan)
+
+print(
+    f"Simulating {start:%Y-%m-%d %H:%M} to {end:%Y-%m-%d %H:%M}, "
+    f"doses at {args.hours}, {'scanning' if args.scan else 'no scans'}"
+)
+
+wall_start = time.perf_counter()
+with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+    threading.Thread(target=dispenser.check_schedules, daemon=True).start()
+    while clock.now() < end:
+        time.sleep(0.01)
+wall = time.perf_counter() - wall_start
+
+entries, _ = dispenser.history.query(limit=dispenser.history.MAX_PAGE_SIZE)
+print(f"\n{'time':16} {'schedule':10} {'status':10}")
+for entry in reversed(entries):
+    timestamp = datetime.fromisoformat(entry["timestamp"])
+    print(f"{timestamp:%Y-%m-%d %H:%M} {entry['scheduleId']:10} {entry['status']:10}")
+
+simulated = (clock.now() - start).total_seconds()
+print(
+    f"\n{simulated / 3600:.1f} simulated hours in {wall:.2f} s "
+    f"({simulated / wall:,.0f}x real time)"
+)
+os._exit(0)  # Skip the dispenser's hardware cleanup
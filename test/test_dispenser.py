@@ -103,10 +103,15 @@ print(f"Testing dispenser: {SERIAL_NUMBER}")
 # Topics
 COMMAND_TOPIC = f"medipi/dispensers/{SERIAL_NUMBER}/commands"
 LOGS_TOPIC = f"medipi/dispensers/{SERIAL_NUMBER}/logs"
+ACK_TOPIC = f"medipi/dispensers/{SERIAL_NUMBER}/commands/ack"
 
 # If running hardware test, send that command instead
 if args.hardware_test:
-    test_command = {"action": "test_hardware", "component": args.component}
+    test_command = {
+        "action": "test_hardware",
+        "component": args.component,
+        "requestId": str(uuid.uuid4()),
+    }
 
     # Connect to MQTT and send command
     client = mqtt.Client()
@@ -115,7 +120,7 @@ if args.hardware_test:
         print(f"Connected with result code {rc}")
         if rc == 0:
             # Subscribe to logs
-            client.subscribe(LOGS_TOPIC)
+            client.subscribe([(LOGS_TOPIC, 1), (ACK_TOPIC, 1)])
             # Send command
             client.publish(COMMAND_TOPIC, json.dumps(test_command), qos=1)
             print(f"Sent hardware test command: {json.dumps(test_command)}")
@@ -207,6 +212,7 @@ test_schedule = {
 # Dispense command
 dispense_command = {
     "action": "dispense",
+    "requestId": str(uuid.uuid4()),  # Retries with the same ID dispense once
     "schedule": test_schedule,
     "authorized": not args.auth,  # Bypass authentication unless --auth flag is set
 }
@@ -217,8 +223,8 @@ def on_connect(client, userdata, flags, rc):
     print(f"Connected with result code {rc}")
     if rc == 0:
         # Subscribe to logs to see the results
-        client.subscribe(LOGS_TOPIC)
-        print("Subscribed to logs topic")
+        client.subscribe([(LOGS_TOPIC, 1), (ACK_TOPIC, 1)])
+        print("Subscribed to logs and command ack topics")
 
 
 # Callback for receiving messages
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+
+# Make the dispenser services importable when run from the repo root
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dispenser_files")
+)
+
+from services import trace
+
+# Set up argument parser
+parser = argparse.ArgumentParser(
+    description="Convert a dispenser trace dump (trace.bin) to Chrome trace JSON, "
+    "open the result in chrome://tracing or ui.perfetto.dev"
+)
+parser.add_argument("dump", help="Trace dump written by the trace command")
+parser.add_argument(
+    "output", nargs="?", help="JSON file to write (default: dump name with .json)"
+)
+
+args = parser.parse_args()
+
+offset, records = trace.load(args.dump)
+output = args.output or os.path.splitext(args.dump)[0] + ".json"
+with open(output, "w") as f:
+    json.dump(trace.to_chrome(records, offset), f)
+
+# Time spent per event type, to see where the seconds go at a glance
+totals = {}
+open_spans = {}
+for timestamp, code, arg in records:
+    name, phase, lane = trace.EVENTS.get(code, (f"code {code}", "i", "?"))
+    key = (name, arg if lane is None else lane)
+    if phase == "B":
+        open_spans[key] = timestamp
+    elif phase == "E" and key in open_spans:
+        totals[name] = totals.get(name, 0) + timestamp - open_spans.pop(key)
+    elif phase == "X":
+        totals[name] = totals.get(name, 0) + arg * 1000
+
+print(f"{len(records)} records written to {output}")
+for name, total in sorted(totals.items(), key=lambda item: -item[1]):
+    print(f"  {name:16} {total / 1e9:9.3f} s")